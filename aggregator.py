@@ -1,100 +1,389 @@
 import asyncio
 import aiohttp
+import codecs
+import collections
 import json
 import os
-import re
-from v2ray_utils import parse_vmess, parse_vless, parse_trojan, parse_shadowsocks, get_config_hash, decode_base64
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
+from v2ray_utils import get_config_hash, decode_base64, HASH_FIELDS
+from uri_parser import parse_config, CONFIG_PREFIXES
+from source_cache import SourceCache
+from source_stats import SourceStats
+from results_store import RESULTS_DB
+from config_records import to_json
+from stable_output import STABLE_OUTPUT, json_lines_array, write_if_changed
 
 SOURCES_FILE = "sources.txt"
 OUTPUT_FILE = "unique_configs.json"
-TIMEOUT = 30  # Seconds to fetch a source
+SOURCE_MAP_FILE = "config_sources.json"  # Config hash -> sources that listed it, read by scheduler.py
+TIMEOUT = 30  # Seconds to fetch a source without fetch history; see SourceStats.timeout()
+HOST_CONCURRENCY = 4  # Sources fetched at once from the same host
+CHUNK_SIZE = 64 * 1024  # Bytes read from a response at a time
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", "0"))  # >1 parses on a process pool of this size
+PARSE_BATCH_LINES = 2000  # Lines sent to a parse worker at a time
+PARSE_MAX_IN_FLIGHT = 8  # Batches per source queued on the pool before waiting for results
+
+def extract_config_lines(line):
+    """
+    Yields config URIs from one line of a source body. Subscription links often
+    return base64 encoded text, so lines that are not config URLs are tried as base64 blocks.
+    """
+    line = line.strip()
+    if not line:
+        return
+
+    # If line is a valid config URL, add it
+    if line.startswith(CONFIG_PREFIXES):
+        yield line
+    else:
+        # Try to decode it as base64
+        try:
+            decoded = decode_base64(line)
+            # If decoding yields valid config lines, add them
+            if "vmess://" in decoded or "vless://" in decoded or "trojan://" in decoded or "ss://" in decoded:
+                 for sub_line in decoded.splitlines():
+                     sub_line = sub_line.strip()
+                     if sub_line.startswith(CONFIG_PREFIXES):
+                         yield sub_line
+        except:
+            pass
+
+async def iter_response_lines(response, on_text=None):
+    """
+    Yields decoded lines from a response as its chunks arrive, so only the line
+    currently being assembled is buffered. Splits exactly like str.splitlines().
+    """
+    decoder = codecs.getincrementaldecoder(response.charset or "utf-8")(errors="replace")
+    pending = ""
+
+    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+        text = decoder.decode(chunk)
+        if on_text:
+            on_text(text)
+
+        lines = (pending + text).splitlines(keepends=True)
+        # The last piece may be an unfinished line, keep it for the next chunk
+        pending = lines.pop() if lines and lines[-1].splitlines()[0] == lines[-1] else ""
+        for line in lines:
+            yield line
+
+    tail = pending + decoder.decode(b"", final=True)
+    if on_text and tail[len(pending):]:
+        on_text(tail[len(pending):])
+    if tail:
+        yield tail
+
+def raw_identity(config):
+    """The core fields as written, which is what told configs apart before canonicalization."""
+    protocol = config.get("protocol")
+    return "|".join([str(protocol)] + [str(config.get(field)) for field in HASH_FIELDS.get(protocol, ())])
+
+def parse_lines(lines):
+    """
+    Decodes, parses and hashes a batch of source lines, dropping duplicates within
+    the batch. Runs in PARSE_WORKERS processes, so it only takes and returns plain data.
+    Spellings that only canonicalization merges are kept so UniqueConfigs can count them.
+    Returns: [(line offset, index within line, config hash, config)] in source order.
+    """
+    parsed = []
+    first_seen = {}  # config hash -> first config with that hash
+    spellings = {}  # config hash -> raw identities kept, only once the hash repeats
+    for offset, line in enumerate(lines):
+        for sub_index, config_line in enumerate(extract_config_lines(line)):
+            config = parse_config(config_line)
+            if config:
+                config_hash = get_config_hash(config)
+                first = first_seen.get(config_hash)
+                if first is None:
+                    first_seen[config_hash] = config
+                else:
+                    if config_hash not in spellings:
+                        spellings[config_hash] = {raw_identity(first)}
+                    identity = raw_identity(config)
+                    if identity in spellings[config_hash]:
+                        continue
+                    spellings[config_hash].add(identity)
+                parsed.append((offset, sub_index, config_hash, config))
+    return parsed
+
+class UniqueConfigs:
+    """
+    Dedup map keyed by get_config_hash(). Sources may arrive in any order, so each
+    entry remembers its (source index, line, index within line) and the earliest
+    occurrence wins, which keeps the output identical to processing the sources
+    one after another on a single core.
+    Hashes reached by more than one raw spelling are tracked in `variants`.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.variants = {}  # config hash -> raw identities, only for hashes with several spellings
+        self.sources = {}  # config hash -> index of the source that listed it, or a set of them if several did
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, order_key, config, config_hash=None):
+        """Adds a config, returning True if its hash was not seen before."""
+        if config_hash is None:
+            config_hash = get_config_hash(config)
+        existing = self.entries.get(config_hash)
+
+        if existing is None:
+            self.entries[config_hash] = (order_key, config)
+            self.sources[config_hash] = order_key[0]
+            return True
+
+        # Most configs come from one source, so the set is only built for the rest
+        sources = self.sources[config_hash]
+        if isinstance(sources, set):
+            sources.add(order_key[0])
+        elif sources != order_key[0]:
+            self.sources[config_hash] = {sources, order_key[0]}
+
+        identity = raw_identity(config)
+        variants = self.variants.get(config_hash)
+        if variants is not None:
+            variants.add(identity)
+        elif identity != raw_identity(existing[1]):
+            self.variants[config_hash] = {raw_identity(existing[1]), identity}
+
+        if order_key < existing[0]:
+            self.entries[config_hash] = (order_key, config)
+        return False
+
+    def configs(self, by_hash=False):
+        """Configs in first-seen source order, or ordered by hash for a stable, diff-friendly output."""
+        if by_hash:
+            return [config for _, (_, config) in sorted(self.entries.items())]
+        return [config for _, config in sorted(self.entries.values(), key=lambda entry: entry[0])]
+
+    def canonical_duplicates(self):
+        """Configs that differ in their raw fields but were merged by canonical_key()."""
+        return sum(len(variants) - 1 for variants in self.variants.values())
+
+async def replay_source(url, on_config, cache):
+    """Awaits on_config() for every config cached from the last full fetch of `url`; returns their number."""
+    count = 0
+    for index, config in enumerate(cache.iter_configs(url)):
+        await on_config((index, 0), config, get_config_hash(config))
+        count += 1
+    return count
+
+async def fetch_source(session, url, on_config, cache=None, executor=None, timeout=TIMEOUT, report=None):
+    """
+    Streams and parses one source, then awaits on_config(position, config, config_hash)
+    for every config in source order, where position is (line number, index within line).
+    Configs are only passed on once the whole body arrived, so a fetch that fails or
+    times out partway contributes nothing, as if the source had been unreachable.
+    With an executor, lines are parsed in PARSE_BATCH_LINES batches on worker processes.
+    With a cache, the request is conditional and a 304 Not Modified replays the
+    configs parsed on a previous run. Returns the number of configs.
+    The `report` dict, if given, receives the status ("ok", "not_modified",
+    "http_<code>", "timeout" or "error"), bytes, lines and configs.
+    """
+    if report is None:
+        report = {}
+    headers = cache.conditional_headers(url) if cache else {}
+    loop = asyncio.get_running_loop()
+    writer = None
+    in_flight = collections.deque()  # (first line number, future) of batches on the pool
+    parsed_configs = []  # (position, config, config_hash), held until the body is complete
+
+    async def emit(first_line, parsed):
+        for offset, sub_index, config_hash, config in parsed:
+            if writer:
+                writer.add_config(config)
+            parsed_configs.append(((first_line + offset, sub_index), config, config_hash))
+
+    async def emit_oldest_batch():
+        first_line, future = in_flight.popleft()
+        await emit(first_line, await future)
 
-async def fetch_source(session, url):
     try:
-        async with session.get(url, timeout=TIMEOUT) as response:
-            if response.status == 200:
-                return await response.text()
-            else:
+        async with session.get(url, timeout=timeout, headers=headers) as response:
+            if response.status == 304 and cache and cache.has_configs(url):
+                print(f"Not modified, using cache: {url}")
+                report["status"] = "not_modified"
+                count = await replay_source(url, on_config, cache)
+                report["configs"] = count
+                return count
+
+            if response.status != 200:
                 print(f"Failed to fetch {url}: Status {response.status}")
-                return ""
+                report["status"] = f"http_{response.status}"
+                return 0
+
+            writer = cache.writer(url) if cache else None
+            batch = []
+            batch_start = 0
+            line_number = 0
+            async for line in iter_response_lines(response, writer.write_body if writer else None):
+                if executor is None:
+                    await emit(line_number, parse_lines([line]))
+                else:
+                    batch.append(line)
+                    if len(batch) >= PARSE_BATCH_LINES:
+                        in_flight.append((batch_start, loop.run_in_executor(executor, parse_lines, batch)))
+                        batch_start = line_number + 1
+                        batch = []
+                        # Results are consumed in order, which also bounds memory held by the pool
+                        while len(in_flight) > PARSE_MAX_IN_FLIGHT:
+                            await emit_oldest_batch()
+                line_number += 1
+
+            if batch:
+                in_flight.append((batch_start, loop.run_in_executor(executor, parse_lines, batch)))
+            while in_flight:
+                await emit_oldest_batch()
+
+            if writer:
+                writer.commit(response.headers.get("ETag"), response.headers.get("Last-Modified"))
+                writer = None
+            report.update(status="ok", bytes=response.content.total_bytes, lines=line_number, configs=len(parsed_configs))
     except Exception as e:
-        print(f"Error fetching {url}: {e}")
-        return ""
+        print(f"Error fetching {url}: {e!r}")
+        report["status"] = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+        return 0
+    finally:
+        for _, future in in_flight:
+            future.cancel()
+        if writer:
+            writer.discard()
+
+    for position, config, config_hash in parsed_configs:
+        await on_config(position, config, config_hash)
+    return len(parsed_configs)
+
+async def fetch_sources(session, urls, collector, cache=None, executor=None, source_stats=None):
+    """
+    Fetches every source with fetch_source(), passing it collector(source index), and
+    yields each source's config count as it completes. At most HOST_CONCURRENCY
+    sources are fetched from one host at a time. With source_stats, sources are
+    started highest priority first with timeouts from their history, the fetches are
+    recorded, and sources that are not due are replayed from the cache instead (sources
+    with nothing cached are always fetched).
+    """
+    host_limits = {}
+
+    async def fetch(index, url):
+        if source_stats and not source_stats.due(url) and cache and cache.has_configs(url):
+            due = time.strftime("%Y-%m-%d %H:%M", time.localtime(source_stats.sources[url]["next_fetch"]))
+            print(f"Low yield, not due until {due}, using cache: {url}")
+            return await replay_source(url, collector(index), cache)
+
+        host = urlparse(url).hostname
+        if host not in host_limits:
+            host_limits[host] = asyncio.Semaphore(HOST_CONCURRENCY)
+        async with host_limits[host]:
+            timeout = source_stats.timeout(url, TIMEOUT) if source_stats else TIMEOUT
+            report = {}
+            start = time.monotonic()
+            count = await fetch_source(session, url, collector(index), cache, executor, timeout, report)
+            report["seconds"] = time.monotonic() - start
+        if source_stats:
+            source_stats.record_fetch(url, report)
+        return count
+
+    order = source_stats.order(urls) if source_stats else range(len(urls))
+    # Tasks start in creation order, so higher priority sources get their host's slots first
+    tasks = [asyncio.create_task(fetch(index, urls[index])) for index in order]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def read_sources(path=SOURCES_FILE):
+    """Returns the source URLs, or None if the sources file is missing."""
+    if not os.path.exists(path):
+        print(f"{path} not found!")
+        return None
+
+    with open(path, "r") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+def print_dedup_summary(unique_configs):
+    merged = unique_configs.canonical_duplicates()
+    print(f"Found {len(unique_configs)} unique configurations.")
+    print(f"Canonicalization merged {merged} equivalent configs the raw fields would have kept "
+          f"({len(unique_configs.variants)} servers), saving {merged} Xray tests.")
+
+def save_unique_configs(unique_configs, path=OUTPUT_FILE):
+    if STABLE_OUTPUT:
+        write_if_changed(path, json_lines_array(unique_configs.configs(by_hash=True), default=to_json))
+    else:
+        with open(path, "w") as f:
+            json.dump(unique_configs.configs(), f, indent=2, default=to_json)
+    print(f"Saved to {path}")
+
+def save_source_map(unique_configs, urls, path=SOURCE_MAP_FILE):
+    """Writes which sources listed each config, for the tester's scheduler to score source yield; returns the map."""
+    source_map = {
+        "sources": urls,
+        "configs": {
+            config_hash: sorted(sources) if isinstance(sources, set) else [sources]
+            for config_hash, sources in sorted(unique_configs.sources.items())
+        }
+    }
+    with open(path, "w") as f:
+        json.dump(source_map, f, separators=(",", ":"))
+    return source_map
+
+def update_source_stats(source_stats, source_map):
+    """Records this run's per-source yield, schedules low-yield sources' next fetch and saves the stats."""
+    source_stats.record_yield(source_map)
+    source_stats.schedule()
+    source_stats.save()
+    source_stats.print_summary(source_map["sources"])
 
 async def main():
-    if not os.path.exists(SOURCES_FILE):
-        print(f"{SOURCES_FILE} not found!")
+    urls = read_sources()
+    if urls is None:
         return
 
-    with open(SOURCES_FILE, "r") as f:
-        urls = [line.strip() for line in f if line.strip() and not line.startswith("#")]
-
     if not urls:
         print("No sources found.")
         return
 
     print(f"Fetching {len(urls)} sources...")
 
-    async with aiohttp.ClientSession() as session:
-        tasks = [fetch_source(session, url) for url in urls]
-        results = await asyncio.gather(*tasks)
-
-    # Combine all results
-    combined_content = "\n".join(results)
-
-    # Process potential base64 blocks (Subscription links often return base64 encoded text)
-    # We will try to decode lines that look like base64, or the whole file if applicable
-    processed_lines = []
-
-    # 1. Split by newlines first
-    raw_lines = combined_content.splitlines()
-
-    for line in raw_lines:
-        line = line.strip()
-        if not line:
-            continue
-
-        # If line is a valid config URL, add it
-        if re.match(r'^(vmess|vless|trojan|ss)://', line):
-            processed_lines.append(line)
-        else:
-            # Try to decode it as base64
-            try:
-                decoded = decode_base64(line)
-                # If decoding yields valid config lines, add them
-                if "vmess://" in decoded or "vless://" in decoded or "trojan://" in decoded or "ss://" in decoded:
-                     for sub_line in decoded.splitlines():
-                         sub_line = sub_line.strip()
-                         if re.match(r'^(vmess|vless|trojan|ss)://', sub_line):
-                             processed_lines.append(sub_line)
-            except:
-                pass
-
-    unique_configs = {}
-    print(f"Processing {len(processed_lines)} potential config lines...")
-
-    for line in processed_lines:
-        config = None
-        if line.startswith("vmess://"):
-            config = parse_vmess(line)
-        elif line.startswith("vless://"):
-            config = parse_vless(line)
-        elif line.startswith("trojan://"):
-            config = parse_trojan(line)
-        elif line.startswith("ss://"):
-            config = parse_shadowsocks(line)
-
-        if config:
-            # Strict Deduplication
-            config_hash = get_config_hash(config)
-            if config_hash not in unique_configs:
-                unique_configs[config_hash] = config
+    cache = SourceCache()
+    # Pass rates come from the tester run on the previous aggregator output, so join before overwriting its source map
+    source_stats = SourceStats()
+    source_stats.join_results(SOURCE_MAP_FILE, RESULTS_DB)
+    unique_configs = UniqueConfigs()
+    total = 0
 
-    print(f"Found {len(unique_configs)} unique configurations.")
+    def collector(source_index):
+        async def on_config(position, config, config_hash):
+            unique_configs.add((source_index, position), config, config_hash)
+        return on_config
+
+    executor = ProcessPoolExecutor(PARSE_WORKERS) if PARSE_WORKERS > 1 else None
+    if executor:
+        print(f"Parsing on {PARSE_WORKERS} worker processes")
+
+    # Every response is parsed as it streams in and deduplicated once it completed
+    try:
+        async with aiohttp.ClientSession() as session:
+            done = 0
+            async for count in fetch_sources(session, urls, collector, cache, executor, source_stats):
+                total += count
+                done += 1
+                print(f"[{done}/{len(urls)}] {total} configs parsed, {len(unique_configs)} unique so far")
+    finally:
+        if executor:
+            executor.shutdown()
+    cache.save()
+
+    print_dedup_summary(unique_configs)
 
-    with open(OUTPUT_FILE, "w") as f:
-        json.dump(list(unique_configs.values()), f, indent=2)
-    print(f"Saved to {OUTPUT_FILE}")
+    save_unique_configs(unique_configs)
+    update_source_stats(source_stats, save_source_map(unique_configs, urls))
 
 if __name__ == "__main__":
     asyncio.run(main())
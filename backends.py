@@ -0,0 +1,204 @@
+"""
+Proxy cores the testers can run configs through, picked with PROXY_BACKEND.
+
+A backend turns parsed configs into its core's JSON config (one HTTP inbound
+per config, routed to that config's outbound), knows how to start the core
+with that JSON on stdin and which output lines mean it failed to start.
+Spawning, readiness polling, probing and batching live in v2ray_utils and
+work the same for every backend:
+
+    xray     Xray-core, what CI has always tested with
+    singbox  sing-box, the core the apps run (SingboxVpnService). Outbounds
+             mirror lib/services/singbox_config_generator.dart, so a config
+             is tested the way the app will connect with it.
+"""
+
+import os
+
+import v2ray_utils
+from v2ray_utils import generate_xray_config, generate_xray_batch_config, XRAY_FATAL_MARKERS
+from xray_toolchain import setup_xray
+
+# --- CONFIGURATION ---
+SINGBOX_BIN = os.environ.get("SINGBOX_BIN", "./bin/sing-box")  # Path to sing-box executable
+SINGBOX_FATAL_MARKERS = ("FATAL", "panic:")
+SINGBOX_CONNECT_TIMEOUT = "5s"  # Same as the app's test configs
+SINGBOX_FINGERPRINT = "chrome"  # uTLS fingerprint for links without fp (the app picks one at random)
+SINGBOX_ALPN = ["h2", "http/1.1"]  # The app's default ALPN
+SINGBOX_PROTOCOLS = ("vmess", "vless", "trojan", "shadowsocks")  # Protocols generate_singbox_outbound() handles
+
+class Backend:
+    """A proxy core: command line, fatal startup markers and config generation."""
+
+    name = None
+    fatal_markers = ()
+
+    def binary(self):
+        raise NotImplementedError
+
+    def command(self):
+        """Arguments that start the core reading its JSON config from stdin."""
+        raise NotImplementedError
+
+    def generate_config(self, config, local_port):
+        return self.generate_batch_config([config], [local_port])
+
+    def generate_batch_config(self, configs, local_ports):
+        raise NotImplementedError
+
+    def loadable(self, config):
+        """False for configs the core is known to reject, which are kept out of batches."""
+        return True
+
+    def available(self):
+        return os.path.exists(self.binary())
+
+class XrayBackend(Backend):
+    name = "xray"
+    fatal_markers = XRAY_FATAL_MARKERS
+
+    def binary(self):
+        # Read on every call: xray_toolchain.setup_xray() points it at the verified binary
+        return v2ray_utils.XRAY_BIN
+
+    def command(self):
+        return [self.binary(), "-config", "stdin:"]
+
+    def generate_config(self, config, local_port):
+        return generate_xray_config(config, local_port)
+
+    def generate_batch_config(self, configs, local_ports):
+        return generate_xray_batch_config(configs, local_ports)
+
+    def loadable(self, config):
+        # Xray refuses to start a REALITY outbound without a public key
+        return not (config.get("security") == "reality" and not config.get("pbk"))
+
+class SingboxBackend(Backend):
+    name = "singbox"
+    fatal_markers = SINGBOX_FATAL_MARKERS
+
+    def binary(self):
+        return SINGBOX_BIN
+
+    def command(self):
+        return [self.binary(), "run", "-c", "stdin"]
+
+    def generate_batch_config(self, configs, local_ports):
+        return generate_singbox_batch_config(configs, local_ports)
+
+    def loadable(self, config):
+        return config.get("protocol") in SINGBOX_PROTOCOLS
+
+def _port(value, default=443):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+def singbox_transport(network, path=None, host=None):
+    """The app's _buildSingBoxTransport(): ws and grpc get a transport, everything else is plain TCP."""
+    if network == "ws":
+        return {"type": "ws", "path": path or "/", "headers": {"Host": host or ""}}
+    if network == "grpc":
+        return {"type": "grpc", "service_name": path or "grpc"}
+    return None
+
+def singbox_tls(server_name, fingerprint=None):
+    tls = {"enabled": True, "server_name": server_name, "insecure": True, "alpn": list(SINGBOX_ALPN)}
+    if fingerprint is not None:
+        tls["utls"] = {"enabled": True, "fingerprint": fingerprint or SINGBOX_FINGERPRINT}
+    return tls
+
+def generate_singbox_outbound(config, tag="proxy"):
+    """
+    Builds the sing-box outbound the app's SingboxConfigGenerator builds for the
+    same link in test mode. Raises ValueError for protocols sing-box is not given here.
+    """
+    protocol = config["protocol"]
+    outbound = {
+        "type": protocol,
+        "tag": tag,
+        "server": config["add"],
+        "server_port": _port(config.get("port")),
+        "connect_timeout": SINGBOX_CONNECT_TIMEOUT,
+    }
+
+    if protocol == "vmess":
+        outbound.update(uuid=config["id"], alter_id=_port(config.get("aid"), 0), security="auto")
+        transport = singbox_transport(config.get("net"), config.get("path"), config.get("host"))
+        if config.get("tls") == "tls":
+            outbound["tls"] = singbox_tls(config.get("sni") or config.get("host") or config["add"])
+    elif protocol in ("vless", "trojan"):
+        if protocol == "vless":
+            outbound.update(uuid=config["id"], flow=config.get("flow") or "")
+        else:
+            outbound["password"] = config["password"]
+        security = config.get("security") or "none"
+        if security in ("tls", "reality"):
+            tls = singbox_tls(config.get("sni") or config["add"], config.get("fp") or "")
+            # Like the app, a reality link without a public key falls back to plain TLS
+            if security == "reality" and config.get("pbk"):
+                tls["reality"] = {"enabled": True, "public_key": config["pbk"], "short_id": config.get("sid") or ""}
+            outbound["tls"] = tls
+        transport = singbox_transport(config.get("type"), config.get("path"), config.get("host"))
+    elif protocol == "shadowsocks":
+        outbound.update(method=config["method"], password=config["password"])
+        transport = None
+    else:  # Not in SINGBOX_PROTOCOLS
+        raise ValueError(f"sing-box backend does not support {protocol!r} configs")
+
+    if transport:
+        outbound["transport"] = transport
+    return outbound
+
+def generate_singbox_batch_config(configs, local_ports):
+    """
+    Generates one sing-box configuration holding an HTTP inbound and an outbound
+    per config, each inbound routed to its own outbound by tag.
+    """
+    inbounds = []
+    outbounds = []
+    rules = []
+    for index, (config, local_port) in enumerate(zip(configs, local_ports)):
+        inbound_tag = f"in-{index}"
+        outbound_tag = f"out-{index}"
+        inbounds.append({"type": "http", "tag": inbound_tag, "listen": "127.0.0.1", "listen_port": local_port})
+        outbounds.append(generate_singbox_outbound(config, outbound_tag))
+        rules.append({"inbound": [inbound_tag], "outbound": outbound_tag})
+
+    return {
+        "log": {"level": "error"},
+        "inbounds": inbounds,
+        "outbounds": outbounds,
+        "route": {"rules": rules}
+    }
+
+BACKENDS = {"xray": XrayBackend, "singbox": SingboxBackend}
+_backends = {}
+
+def get_backend(name):
+    """The shared Backend instance called `name`; raises ValueError for unknown names."""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown proxy backend {name!r}, expected one of: {', '.join(BACKENDS)}")
+    if name not in _backends:
+        _backends[name] = BACKENDS[name]()
+    return _backends[name]
+
+async def setup_backend():
+    """
+    Readies the PROXY_BACKEND core: Xray through the verified toolchain, sing-box from
+    SINGBOX_BIN. Returns False (after printing why) if it cannot run.
+    """
+    try:
+        backend = v2ray_utils.default_backend()
+    except ValueError:
+        print(f"Unknown PROXY_BACKEND {v2ray_utils.PROXY_BACKEND!r}, expected one of: {', '.join(BACKENDS)}")
+        return False
+    if backend.name == "xray":
+        return await setup_xray()
+    if not backend.available():
+        print(f"{backend.name} binary not found at {backend.binary()} (set SINGBOX_BIN)")
+        return False
+    print(f"Testing through {backend.name} at {backend.binary()}")
+    return True
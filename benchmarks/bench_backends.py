@@ -0,0 +1,182 @@
+"""
+Throughput and memory of each proxy-core backend, to pick the cheaper core for bulk testing.
+
+Runs the tester worker pool over the same configs once per backend (backends.py),
+each in a fresh process so DNS / pre-check caches and metrics start empty, and
+reports configs/s, core processes spawned and the resident memory of the core
+processes (sampled from /proc: peak total and average per process).
+
+By default the configs are synthetic and both cores are played by
+benchmarks/fake_xray.py (see bench_tester.py), which checks the harness offline.
+Pass --xray-bin / --singbox-bin to measure the real cores, and --input
+unique_configs.json to test real servers over the network.
+
+    python benchmarks/bench_backends.py [--backends xray singbox] [--configs 2000] [--batch-size N]
+                                        [--xray-bin bin/<sha256>/xray] [--singbox-bin bin/sing-box]
+                                        [--input unique_configs.json] [--json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import backends
+import tester
+import v2ray_utils
+from bench_tester import FAKE_XRAY, start_local_endpoints, make_configs
+from concurrency import AdaptiveLimiter, CONCURRENCY_FLOOR, CONCURRENCY_CEILING
+from config_records import config_from_dict
+from metrics import default_metrics
+
+SAMPLE_INTERVAL = 0.25  # Seconds between /proc samples of the core processes
+
+def core_processes():
+    """(PID, resident KiB) of this process's live children (Linux /proc); zombies are skipped."""
+    processes = []
+    if not os.path.isdir("/proc"):
+        return processes
+    my_pid = str(os.getpid())
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            if fields[1] != my_pid or fields[0] == "Z":
+                continue
+            with open(f"/proc/{entry}/status") as f:
+                rss = next((int(line.split()[1]) for line in f if line.startswith("VmRSS:")), 0)
+        except (OSError, ValueError, IndexError):
+            continue
+        processes.append((int(entry), rss))
+    return processes
+
+async def sample_memory(samples):
+    while True:
+        samples.append(core_processes())
+        await asyncio.sleep(SAMPLE_INTERVAL)
+
+async def run_backend(name, args):
+    """Tests the configs through one backend; returns its report."""
+    v2ray_utils.PROXY_BACKEND = name
+    v2ray_utils.XRAY_BATCH_SIZE = args.batch_size
+    v2ray_utils.XRAY_BIN = args.xray_bin or FAKE_XRAY
+    backends.SINGBOX_BIN = args.singbox_bin or FAKE_XRAY
+    backend = v2ray_utils.default_backend()
+    if not backend.available():
+        return {"backend": name, "error": f"{backend.binary()} not found"}
+
+    runner = servers = None
+    if args.input:
+        with open(args.input, "r") as f:
+            configs = [config_from_dict(config) for config in json.load(f)][:args.configs]
+    else:
+        runner, test_url, ports, servers = await start_local_endpoints(args.endpoints)
+        v2ray_utils.TEST_URL = test_url
+        dead_ports = v2ray_utils.reserve_local_ports(max(1, args.endpoints // 10))
+        configs = make_configs(args.configs, ports, dead_ports, args.dead_endpoint_rate)
+        os.environ.setdefault("FAKE_XRAY_FAIL_RATE", "0.3")
+
+    queue = asyncio.Queue()
+    for config in configs:
+        queue.put_nowait(config)
+    results = []
+    stats = Counter()
+    limiter = AdaptiveLimiter(args.concurrency, CONCURRENCY_FLOOR, args.ceiling)
+    samples = []
+    sampler = asyncio.create_task(sample_memory(samples))
+
+    start = time.perf_counter()
+    try:
+        async with aiohttp.ClientSession() as session:
+            workers = [
+                asyncio.create_task(tester.worker(queue, results, stats, i, session, None, limiter))
+                for i in range(limiter.ceiling)
+            ]
+            limiter.start()
+            await asyncio.gather(*workers)
+            await limiter.stop()
+        seconds = time.perf_counter() - start
+    finally:
+        sampler.cancel()
+        if runner:
+            for server in servers:
+                server.close()
+            await runner.cleanup()
+
+    busy = [sample for sample in samples if sample]
+    totals = [sum(rss for _, rss in sample) for sample in busy]
+    per_process = [total / len(sample) for total, sample in zip(totals, busy)]
+    return {
+        "backend": name,
+        "binary": backend.binary(),
+        "configs": len(configs),
+        "seconds": round(seconds, 2),
+        "configs_per_s": round(len(configs) / seconds, 1),
+        "passed": stats["passed"],
+        "outcomes": {reason: count for reason, count in stats.items() if reason not in ("total", "passed")},
+        "batch_size": args.batch_size,
+        "core_spawns": default_metrics.xray_spawned,
+        "max_live_cores": max((len(sample) for sample in samples), default=0),
+        "peak_core_rss_mb": round(max(totals, default=0) / 1024, 1),
+        "mean_rss_per_core_mb": round(sum(per_process) / len(per_process) / 1024, 1) if per_process else None,
+        "phases": {phase: {key: summary[key] for key in ("count", "p50_ms", "p90_ms")}
+                   for phase, summary in default_metrics.phase_summaries().items()},
+    }
+
+def run_child(name, argv):
+    """Runs one backend in a fresh interpreter and returns its report."""
+    output = subprocess.run([sys.executable, __file__, *argv, "--child", name],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def print_report(reports):
+    print(f"\n{'backend':<9} {'configs/s':>10} {'passed':>8} {'spawns':>7} {'max live':>9} "
+          f"{'peak RSS MB':>12} {'RSS/core MB':>12}")
+    for report in reports:
+        if "error" in report:
+            print(f"{report['backend']:<9} skipped: {report['error']}")
+            continue
+        print(f"{report['backend']:<9} {report['configs_per_s']:>10} {report['passed']:>8} {report['core_spawns']:>7} "
+              f"{report['max_live_cores']:>9} {report['peak_core_rss_mb']:>12} {str(report['mean_rss_per_core_mb']):>12}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backends", nargs="+", choices=sorted(backends.BACKENDS), default=["xray", "singbox"])
+    parser.add_argument("--configs", type=int, default=2000, help="Configs per backend (synthetic, or the first N of --input)")
+    parser.add_argument("--input", help="Test the configs of this unique_configs.json instead of synthetic ones")
+    parser.add_argument("--batch-size", type=int, default=v2ray_utils.XRAY_BATCH_SIZE, help="Configs per core process")
+    parser.add_argument("--xray-bin", help="Real Xray binary (default: fake_xray.py)")
+    parser.add_argument("--singbox-bin", help="Real sing-box binary (default: fake_xray.py)")
+    parser.add_argument("--concurrency", type=int, default=tester.CONCURRENCY, help="Initial AdaptiveLimiter limit")
+    parser.add_argument("--ceiling", type=int, default=CONCURRENCY_CEILING, help="AdaptiveLimiter ceiling (and worker count)")
+    parser.add_argument("--endpoints", type=int, default=50, help="Local TCP listeners the synthetic configs point at")
+    parser.add_argument("--dead-endpoint-rate", type=float, default=0.1, help="Share of synthetic configs on closed ports")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        report = asyncio.run(run_backend(args.child, args))
+        print(json.dumps(report))
+        return
+
+    argv = [arg for arg in sys.argv[1:] if arg != "--json"]
+    reports = [run_child(name, argv) for name in args.backends]
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        print_report(reports)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Memory held by parsed configs, per 100k configs.
+
+Cycles the corpus up to --count config lines, parses them with
+uri_parser.parse_config and measures what the parsed list keeps alive with
+tracemalloc, once as returned by the parser and once converted to plain dicts.
+The source lines themselves are allocated before measuring (raw_uri points at
+them), so only the per-config overhead is counted.
+
+    python benchmarks/bench_memory.py [corpus files...] [--count N] [--json]
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from uri_parser import parse_config
+from bench_parsers import DEFAULT_CORPUS, load_corpus
+
+def as_dict(config):
+    return config.to_dict() if hasattr(config, "to_dict") else dict(config)
+
+def measure(lines, convert=None):
+    """Returns (bytes retained, configs) for parsing every line, optionally converting each config."""
+    gc.collect()
+    tracemalloc.start()
+    configs = []
+    for line in lines:
+        config = parse_config(line)
+        if config is not None:
+            configs.append(convert(config) if convert else config)
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return retained, len(configs)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("corpus", nargs="*", default=DEFAULT_CORPUS, help="Subscription dumps to parse")
+    parser.add_argument("--count", type=int, default=100_000, help="Config lines to parse")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    # Copies, so every line is its own string object like lines read from a response
+    lines = [corpus[i % len(corpus)].encode().decode() for i in range(args.count)]
+
+    report = {"lines": len(lines)}
+    for name, convert in (("parsed", None), ("dicts", as_dict)):
+        retained, count = measure(lines, convert)
+        report[name] = {
+            "configs": count,
+            "bytes_per_config": round(retained / count),
+            "mb_per_100k": round(retained / count * 100_000 / 2 ** 20, 1),
+        }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"Lines:    {report['lines']}")
+    for name in ("parsed", "dicts"):
+        entry = report[name]
+        print(f"{name:<9} {entry['configs']} configs, {entry['bytes_per_config']} bytes/config, "
+              f"{entry['mb_per_100k']} MB per 100k")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Offline throughput benchmark for the config pipeline.
+
+For every scale it generates a synthetic corpus (benchmarks/corpus.py), serves
+it from a local stub server (benchmarks/stub_server.py) and measures, each in
+a fresh process so peak RSS is per measurement:
+
+  stages           extract_config_lines / decode_base64, parse_config,
+                   get_config_hash, dedup and generate_xray_config on their own
+  aggregator_cold  aggregator.main() end to end with an empty source cache
+  aggregator_warm  aggregator.main() again, sources answered with 304
+
+    python benchmarks/bench_pipeline.py [--lines 10000 100000 1000000] [--json] [--output FILE]
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+from corpus import write_corpus, DUP_RATE
+
+SERVER_START_TIMEOUT = 10  # Seconds to wait for the stub server to listen
+
+def peak_rss_mb():
+    """Peak resident set size of this process, or None where the OS does not report it."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+def timed(stages, name, count, func):
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    stages[name] = {"seconds": round(seconds, 3), "items": count, "items_per_s": round(count / seconds) if seconds else None}
+    return result
+
+def measure_stages(corpus_dir):
+    """Times each pipeline stage on its own over the corpus files."""
+    from aggregator import extract_config_lines, UniqueConfigs
+    from uri_parser import parse_config, CONFIG_PREFIXES
+    from v2ray_utils import decode_base64, get_config_hash, generate_xray_config
+
+    with open(os.path.join(corpus_dir, "sources.txt")) as f:
+        names = f.read().split()
+    lines = []
+    for name in names:
+        with open(os.path.join(corpus_dir, name), encoding="utf-8") as f:
+            lines.extend(f.read().splitlines())
+
+    stages = {}
+    wrapped = [line for line in lines if line and not line.startswith(CONFIG_PREFIXES)]
+    timed(stages, "decode_base64", len(wrapped), lambda: [decode_base64(line) for line in wrapped])
+    config_lines = timed(stages, "extract", len(lines),
+                         lambda: [uri for line in lines for uri in extract_config_lines(line)])
+    configs = timed(stages, "parse", len(config_lines), lambda: [c for c in map(parse_config, config_lines) if c])
+    hashes = timed(stages, "hash", len(configs), lambda: [get_config_hash(c) for c in configs])
+
+    unique = UniqueConfigs()
+    def dedup():
+        for index, (config, config_hash) in enumerate(zip(configs, hashes)):
+            unique.add((index,), config, config_hash)
+    timed(stages, "dedup", len(configs), dedup)
+
+    unique_configs = unique.configs()
+    timed(stages, "xray_config", len(unique_configs), lambda: [generate_xray_config(c, 10000) for c in unique_configs])
+
+    return {"stages": stages, "configs": len(configs), "unique": len(unique), "peak_rss_mb": peak_rss_mb()}
+
+def measure_aggregator(work_dir):
+    """Runs aggregator.main() in work_dir, whose sources.txt points at the stub server."""
+    import asyncio
+    import aggregator
+
+    os.chdir(work_dir)
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        asyncio.run(aggregator.main())
+    seconds = time.perf_counter() - start
+
+    with open(os.path.join(work_dir, "unique_configs.json")) as f:
+        unique = len(json.load(f))
+    return {"seconds": round(seconds, 3), "unique": unique, "peak_rss_mb": peak_rss_mb()}
+
+def run_child(*args, env=None):
+    output = subprocess.run([sys.executable, __file__, "--child", *args], check=True,
+                            capture_output=True, text=True, env=env).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def start_stub_server(corpus_dir):
+    """Starts stub_server.py on a free port in its own process, so it stays out of the measured RSS."""
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "stub_server.py"), corpus_dir, "--port", "0"],
+        stdout=subprocess.PIPE, text=True
+    )
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        line = server.stdout.readline()
+        if line.startswith("Serving"):
+            return server, line.split()[-1]
+        if server.poll() is not None:
+            break
+    server.kill()
+    raise RuntimeError("Stub server did not start")
+
+def bench_scale(lines, args, scratch):
+    corpus_dir = os.path.join(scratch, f"corpus_{lines}")
+    work_dir = os.path.join(scratch, f"work_{lines}")
+    os.makedirs(work_dir)
+    names, corpus_bytes = write_corpus(corpus_dir, lines, args.sources, args.seed, args.dup_rate)
+
+    result = {"lines": lines, "sources": len(names), "corpus_mb": round(corpus_bytes / 2 ** 20, 1)}
+    result.update(run_child("stages", corpus_dir))
+
+    env = dict(os.environ, PARSE_WORKERS=str(args.parse_workers))
+    server, base_url = start_stub_server(corpus_dir)
+    try:
+        with open(os.path.join(work_dir, "sources.txt"), "w") as f:
+            f.write("".join(f"{base_url}/{name}\n" for name in names))
+        for run in ("aggregator_cold", "aggregator_warm"):
+            measured = run_child("aggregator", work_dir, env=env)
+            measured["lines_per_s"] = round(lines / measured["seconds"])
+            result[run] = measured
+    finally:
+        server.terminate()
+        server.wait()
+    return result
+
+def print_report(report):
+    print(f"Python {report['python']}, {report['cpus']} CPUs, PARSE_WORKERS={report['parse_workers']}")
+    for scale in report["scales"]:
+        print(f"\n{scale['lines']} lines, {scale['sources']} sources, {scale['corpus_mb']} MB "
+              f"-> {scale['configs']} configs, {scale['unique']} unique")
+        for name, stage in scale["stages"].items():
+            print(f"  {name:<16} {stage['seconds']:>8.3f}s  {stage['items_per_s'] or 0:>10} items/s")
+        print(f"  {'stages peak RSS':<16} {scale['peak_rss_mb']} MB")
+        for run in ("aggregator_cold", "aggregator_warm"):
+            measured = scale[run]
+            print(f"  {run:<16} {measured['seconds']:>8.3f}s  {measured['lines_per_s']:>10} lines/s  "
+                  f"peak RSS {measured['peak_rss_mb']} MB")
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--child":
+        measure = measure_stages if sys.argv[2] == "stages" else measure_aggregator
+        print(json.dumps(measure(sys.argv[3])))
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lines", type=int, nargs="+", default=[10_000, 100_000], help="Corpus sizes to run")
+    parser.add_argument("--sources", type=int, default=8, help="Source files per corpus")
+    parser.add_argument("--dup-rate", type=float, default=DUP_RATE, help="Share of lines repeating a server")
+    parser.add_argument("--seed", type=int, default=1, help="Corpus random seed")
+    parser.add_argument("--parse-workers", type=int, default=0, help="PARSE_WORKERS for aggregator runs")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = {
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "parse_workers": args.parse_workers,
+        "scales": [],
+    }
+    scratch = tempfile.mkdtemp(prefix="bench_pipeline_")
+    try:
+        for lines in args.lines:
+            report["scales"].append(bench_scale(lines, args, scratch))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+if __name__ == "__main__":
+    main()
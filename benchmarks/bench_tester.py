@@ -0,0 +1,224 @@
+"""
+Hermetic load test for the tester worker pool.
+
+Runs tester.worker over synthetic configs with benchmarks/fake_xray.py as
+XRAY_BIN and a local endpoint answering 204 as TEST_URL, so the worker pool,
+AdaptiveLimiter, Xray batching and process cleanup can be exercised at 10k+
+configs on an offline box. Config endpoints are local listeners (plus a share
+of closed ports) so the TCP pre-check passes or fails without a network.
+Exits non-zero if fake Xray processes are left running after the run.
+
+    python benchmarks/bench_tester.py [--configs 10000] [--batch-size N] [--fail-rate R] [--json]
+                                      [--deadline 30s] [--target-passed N]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from collections import Counter
+
+import aiohttp
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import tester
+import v2ray_utils
+from concurrency import AdaptiveLimiter, CONCURRENCY_FLOOR, CONCURRENCY_CEILING
+from config_records import VlessConfig, TrojanConfig, ShadowsocksConfig
+from metrics import default_metrics
+from results_store import parse_duration
+
+FAKE_XRAY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_xray.py")
+SAMPLE_INTERVAL = 0.5  # Seconds between counts of live fake Xray processes
+CLEANUP_GRACE = 3.0  # Seconds allowed for stopped processes to exit before counting leftovers
+
+async def start_local_endpoints(count):
+    """Starts the 204 test endpoint plus `count` TCP listeners; returns (runner, test URL, listener ports, servers)."""
+    async def generate_204(request):
+        return web.Response(status=204)
+
+    app = web.Application()
+    app.router.add_get("/generate_204", generate_204)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    test_url = f"http://127.0.0.1:{runner.addresses[0][1]}/generate_204"
+
+    async def accept(reader, writer):
+        writer.close()
+
+    servers = [await asyncio.start_server(accept, "127.0.0.1", 0) for _ in range(count)]
+    ports = [server.sockets[0].getsockname()[1] for server in servers]
+    return runner, test_url, ports, servers
+
+def make_configs(count, live_ports, dead_ports, dead_share):
+    """Builds unique vless/trojan/ss records spread over the local endpoints."""
+    configs = []
+    for index in range(count):
+        dead = dead_ports and (index * 7919 % 1000) / 1000 < dead_share
+        ports = dead_ports if dead else live_ports
+        port = ports[index % len(ports)]
+        secret = str(uuid.UUID(int=index + 1))
+        kind = index % 3
+        if kind == 0:
+            configs.append(VlessConfig("127.0.0.1", port, secret, "none", "tcp", "none", "", "", "", "", f"bench{index}",
+                                       f"vless://{secret}@127.0.0.1:{port}?type=tcp#bench{index}"))
+        elif kind == 1:
+            configs.append(TrojanConfig("127.0.0.1", port, secret, "", "tcp", "tls", "", "", f"bench{index}",
+                                        f"trojan://{secret}@127.0.0.1:{port}#bench{index}"))
+        else:
+            configs.append(ShadowsocksConfig("127.0.0.1", port, "aes-256-gcm", secret, f"bench{index}",
+                                             f"ss://{secret}@127.0.0.1:{port}#bench{index}"))
+    return configs
+
+def fake_xray_processes():
+    """PIDs of this process's children running fake_xray.py, zombies included (Linux /proc)."""
+    pids = []
+    if not os.path.isdir("/proc"):
+        return pids
+    my_pid = str(os.getpid())
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                cmdline = f.read()
+        except OSError:
+            continue
+        # fields[1] is the parent PID; zombies have an empty cmdline, so match them by parent alone
+        if fields[1] == my_pid and (b"fake_xray" in cmdline or fields[0] == "Z"):
+            pids.append(int(entry))
+    return pids
+
+async def sample_processes(samples):
+    while True:
+        samples.append(len(fake_xray_processes()))
+        await asyncio.sleep(SAMPLE_INTERVAL)
+
+async def run(args):
+    runner, test_url, ports, servers = await start_local_endpoints(args.endpoints)
+    dead_ports = v2ray_utils.reserve_local_ports(max(1, args.endpoints // 10))
+
+    v2ray_utils.XRAY_BIN = FAKE_XRAY
+    v2ray_utils.TEST_URL = test_url
+    v2ray_utils.XRAY_BATCH_SIZE = args.batch_size
+    tester.PROBE_SAMPLES = args.samples
+    # Engines read XRAY_BATCH_SIZE when created, so drop any made before it was set
+    v2ray_utils._batch_engines.clear()
+    os.environ.update({
+        "FAKE_XRAY_STARTUP_DELAY": str(args.startup_delay),
+        "FAKE_XRAY_LATENCY": str(args.latency),
+        "FAKE_XRAY_FAIL_RATE": str(args.fail_rate),
+        "FAKE_XRAY_HANG_RATE": str(args.hang_rate),
+        "FAKE_XRAY_REJECT_RATE": str(args.reject_rate),
+        "FAKE_XRAY_CRASH_RATE": str(args.crash_rate),
+    })
+
+    configs = make_configs(args.configs, ports, dead_ports, args.dead_endpoint_rate)
+    queue = asyncio.Queue()
+    for config in configs:
+        queue.put_nowait(config)
+
+    results = []
+    stats = Counter()
+    limiter = AdaptiveLimiter(args.concurrency, CONCURRENCY_FLOOR, args.ceiling)
+    samples = []
+    sampler = asyncio.create_task(sample_processes(samples))
+    budget = tester.RunBudget(args.deadline, args.target_passed)
+    budget.start()
+
+    start = time.perf_counter()
+    try:
+        async with aiohttp.ClientSession() as session:
+            workers = [
+                asyncio.create_task(tester.worker(queue, results, stats, i, session, None, limiter, None, budget))
+                for i in range(limiter.ceiling)
+            ]
+            limiter.start()
+            await budget.wait(workers, stats)
+            await limiter.stop()
+        seconds = time.perf_counter() - start
+    finally:
+        sampler.cancel()
+        for server in servers:
+            server.close()
+        await runner.cleanup()
+
+    leftovers = fake_xray_processes()
+    deadline = time.monotonic() + CLEANUP_GRACE
+    while leftovers and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+        leftovers = fake_xray_processes()
+
+    ready = v2ray_utils.summarize_ready_times() or {}
+    return {
+        "configs": len(configs),
+        "seconds": round(seconds, 2),
+        "configs_per_s": round(len(configs) / seconds, 1),
+        "passed": stats["passed"],
+        "stopped_early": budget.reason,
+        "skipped": len(configs) - stats["total"] - stats["InvalidConfig"],
+        "outcomes": {reason: count for reason, count in stats.items() if reason not in ("total", "passed")},
+        "batch_size": args.batch_size,
+        "samples": args.samples,
+        "concurrency": {"initial": args.concurrency, "final": limiter.limit, "history": limiter.history},
+        "xray_spawns": ready.get("count", 0),
+        "xray_ready_ms": {key: ready[key] for key in ("median_ms", "p90_ms", "max_ms") if key in ready},
+        "phases": {phase: {key: summary[key] for key in ("count", "p50_ms", "p90_ms", "max_ms")}
+                   for phase, summary in default_metrics.phase_summaries().items()},
+        "max_live_xray": max(samples, default=0),
+        "leftover_xray": len(leftovers),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--configs", type=int, default=10_000, help="Synthetic configs to test")
+    parser.add_argument("--batch-size", type=int, default=v2ray_utils.XRAY_BATCH_SIZE, help="XRAY_BATCH_SIZE for the run")
+    parser.add_argument("--samples", type=int, default=v2ray_utils.PROBE_SAMPLES, help="PROBE_SAMPLES for the run")
+    parser.add_argument("--concurrency", type=int, default=tester.CONCURRENCY, help="Initial AdaptiveLimiter limit")
+    parser.add_argument("--ceiling", type=int, default=CONCURRENCY_CEILING, help="AdaptiveLimiter ceiling (and worker count)")
+    parser.add_argument("--endpoints", type=int, default=50, help="Local TCP listeners the configs point at")
+    parser.add_argument("--dead-endpoint-rate", type=float, default=0.1, help="Share of configs on closed ports")
+    parser.add_argument("--startup-delay", type=float, default=0.05, help="Fake Xray seconds to start listening")
+    parser.add_argument("--latency", type=float, default=0.02, help="Fake Xray seconds added per request")
+    parser.add_argument("--fail-rate", type=float, default=0.3, help="Share of outbounds that drop connections")
+    parser.add_argument("--hang-rate", type=float, default=0.02, help="Share of outbounds that never answer")
+    parser.add_argument("--reject-rate", type=float, default=0.0, help="Share of outbounds fake Xray refuses to load")
+    parser.add_argument("--crash-rate", type=float, default=0.01, help="Share of fake Xray processes that panic")
+    parser.add_argument("--deadline", type=parse_duration, help="Stop the run after this long, like tester.py --deadline")
+    parser.add_argument("--target-passed", type=tester.parse_count, help="Stop once this many configs passed")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"\n{report['configs']} configs in {report['seconds']}s ({report['configs_per_s']} configs/s), "
+              f"{report['passed']} passed")
+        if report["stopped_early"]:
+            print(f"Stopped early ({report['stopped_early']}): {report['skipped']} configs skipped")
+        for reason, count in sorted(report["outcomes"].items(), key=lambda item: -item[1]):
+            print(f"  {reason}: {count}")
+        print(f"Concurrency: {report['concurrency']['initial']} -> {report['concurrency']['final']} "
+              f"({len(report['concurrency']['history'])} adjustments), batch size {report['batch_size']}, "
+              f"{report['samples']} probe(s) per config")
+        print(f"Xray: {report['xray_spawns']} ready spawns {report['xray_ready_ms']}, "
+              f"max {report['max_live_xray']} alive at once, {report['leftover_xray']} left over")
+        print("Phase timings:")
+        default_metrics.print_phases()
+
+    if report["leftover_xray"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Synthetic subscription corpus generator.
+
+Writes N source files that look like the dumps aggregator.py fetches: a mix
+of vmess, vless, trojan and ss links (default weights follow the
+config-refinery corpus), some sources base64-wrapped as one line the way
+subscription links serve them, and a share of duplicates that repeat an
+earlier server with a new remark or an equivalent spelling (host case,
+trailing dot, string port, escaped path) the canonical hash should merge.
+
+    python benchmarks/corpus.py OUT_DIR [--lines N] [--sources N] [--dup-rate R] [--seed S]
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import uuid
+from urllib.parse import quote
+
+# Share of each scheme, from the bundled config-refinery dumps
+SCHEME_WEIGHTS = {"vless": 0.55, "vmess": 0.30, "trojan": 0.10, "ss": 0.05}
+BASE64_SOURCE_SHARE = 0.25  # Sources served as one base64 line
+DUP_RATE = 0.3  # Share of lines that repeat an earlier server
+NOISE_RATE = 0.02  # Share of lines that are comments, blank or broken links
+
+NETWORKS = ["tcp", "ws", "grpc", "tcp", "ws"]
+SS_METHODS = ["aes-256-gcm", "chacha20-ietf-poly1305", "aes-128-gcm", "2022-blake3-aes-128-gcm"]
+FINGERPRINTS = ["chrome", "firefox", "safari", "randomized", ""]
+FLAGS = ["\U0001F1E9\U0001F1EA", "\U0001F1F3\U0001F1F1", "\U0001F1FA\U0001F1F8", "\U0001F1EB\U0001F1EE", "\U0001F1EE\U0001F1F7"]
+NOISE = ["", "# updated hourly", "vless://broken", "ss://notbase64!!@host:port", "vmess://bm90IGpzb24="]
+
+class Server:
+    """The identity of one synthetic server; links are rendered from it with varying spellings."""
+
+    def __init__(self, rng, index):
+        self.scheme = rng.choices(list(SCHEME_WEIGHTS), weights=list(SCHEME_WEIGHTS.values()))[0]
+        if rng.random() < 0.5:
+            self.host = f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+        else:
+            self.host = f"node{index}.{rng.choice(['cdn', 'edge', 'srv', 'vip'])}{rng.randint(1, 99)}.example.com"
+        self.port = rng.choice([443, 443, 8443, 80, 2053, 2083, rng.randint(1024, 65535)])
+        self.id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        self.password = base64.urlsafe_b64encode(rng.randbytes(12)).decode().rstrip("=")
+        self.network = rng.choice(NETWORKS)
+        self.security = rng.choice(["tls", "reality", "none"]) if self.scheme == "vless" else rng.choice(["tls", "tls", ""])
+        self.path = f"/{rng.choice(['ws', 'api', 'graphql', 'v2'])}/{rng.randint(0, 9999)}" if self.network != "tcp" else ""
+        self.sni = f"sni{rng.randint(1, 50)}.example.org" if self.security in ("tls", "reality") else ""
+        self.method = rng.choice(SS_METHODS)
+        self.fp = rng.choice(FINGERPRINTS)
+
+def remark(rng, index):
+    return f"{rng.choice(FLAGS)} {rng.choice(['DE', 'NL', 'US', 'FI', 'IR'])} | @channel{rng.randint(1, 300)} #{index}"
+
+def render(server, rng, index, variant=False):
+    """Renders one link. A variant spells the same server differently (host case, trailing dot, ...)."""
+    host = server.host
+    port = str(server.port)
+    path = server.path
+    if variant:
+        choice = rng.randrange(3)
+        if choice == 0 and not host[0].isdigit():
+            host = host.upper()
+        elif choice == 1 and not host[0].isdigit():
+            host = host + "."
+        elif path:
+            path = path.replace("/", "%2F")
+    name = remark(rng, index)
+
+    if server.scheme == "vmess":
+        data = {
+            "v": "2", "ps": name, "add": host, "port": port if rng.random() < 0.7 else server.port,
+            "id": server.id, "aid": "0", "scy": "auto", "net": server.network, "type": "none",
+            "host": server.sni, "path": path, "tls": server.security, "sni": server.sni
+        }
+        return "vmess://" + base64.b64encode(json.dumps(data, ensure_ascii=False).encode()).decode()
+
+    if server.scheme == "vless":
+        params = ["encryption=none", f"security={server.security or 'none'}", f"type={server.network}"]
+        if server.sni:
+            params.append(f"sni={server.sni}")
+        if server.fp:
+            params.append(f"fp={server.fp}")
+        if server.security == "reality":
+            params.append(f"pbk={server.password}&sid={server.id[:8]}")
+        if path:
+            params.append(f"path={path}")
+        return f"vless://{server.id}@{host}:{port}?{'&'.join(params)}#{quote(name)}"
+
+    if server.scheme == "trojan":
+        params = ["security=tls", f"type={server.network}"]
+        if server.sni:
+            params.append(f"sni={server.sni}")
+        if path:
+            params.append(f"path={path}")
+        return f"trojan://{server.password}@{host}:{port}?{'&'.join(params)}#{quote(name)}"
+
+    user = base64.b64encode(f"{server.method}:{server.password}".encode()).decode()
+    if rng.random() < 0.5:
+        return f"ss://{user.rstrip('=')}@{host}:{port}#{quote(name)}"
+    # Legacy form: the whole method:password@host:port is base64 encoded
+    return "ss://" + base64.b64encode(f"{server.method}:{server.password}@{host}:{port}".encode()).decode() + f"#{quote(name)}"
+
+def generate_lines(count, seed=1, dup_rate=DUP_RATE):
+    """Yields `count` subscription lines, deterministic for a given seed."""
+    rng = random.Random(seed)
+    servers = []
+    for index in range(count):
+        roll = rng.random()
+        if roll < NOISE_RATE:
+            yield rng.choice(NOISE)
+        elif servers and roll < NOISE_RATE + dup_rate:
+            yield render(rng.choice(servers), rng, index, variant=rng.random() < 0.3)
+        else:
+            server = Server(rng, index)
+            servers.append(server)
+            yield render(server, rng, index)
+
+def write_corpus(directory, lines, sources=8, seed=1, dup_rate=DUP_RATE):
+    """
+    Writes the corpus as source_<i>.txt files plus a sources.txt listing their
+    names, and returns (file names, total bytes).
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    names = [f"source_{i}.txt" for i in range(sources)]
+    buckets = [[] for _ in names]
+    for index, line in enumerate(generate_lines(lines, seed, dup_rate)):
+        buckets[index % sources].append(line)
+
+    total = 0
+    for name, bucket in zip(names, buckets):
+        body = "\n".join(bucket) + "\n"
+        if rng.random() < BASE64_SOURCE_SHARE:
+            body = base64.b64encode(body.encode()).decode() + "\n"
+        with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+            f.write(body)
+        total += len(body.encode())
+
+    with open(os.path.join(directory, "sources.txt"), "w") as f:
+        f.write("\n".join(names) + "\n")
+    return names, total
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("out_dir", help="Directory to write the source files to")
+    parser.add_argument("--lines", type=int, default=100_000, help="Lines across all sources")
+    parser.add_argument("--sources", type=int, default=8, help="Number of source files")
+    parser.add_argument("--dup-rate", type=float, default=DUP_RATE, help="Share of lines repeating a server")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    args = parser.parse_args()
+
+    names, total = write_corpus(args.out_dir, args.lines, args.sources, args.seed, args.dup_rate)
+    print(f"Wrote {args.lines} lines in {len(names)} sources ({total / 2 ** 20:.1f} MB) to {args.out_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the Xray (or sing-box) binary, for offline load tests of tester.py.
+
+Invoked like Xray (`fake_xray.py -config stdin:`) or like sing-box
+(`fake_xray.py run -c stdin`), it reads that core's JSON config from stdin
+and opens an HTTP proxy on every inbound port. Requests are forwarded to
+their real target (normally the harness's local 204 endpoint) after an added
+latency, over a new outbound connection per plain-HTTP request or per CONNECT
+tunnel as Xray does, unless the outbound they are routed to was picked as
+dead (connection closed) or hanging (no answer). Whether an outbound is dead
+or hanging depends only on its settings and the seed, so a config gets
+the same outcome in every process and batch it lands in.
+
+Environment (all optional):
+  FAKE_XRAY_STARTUP_DELAY  seconds before the inbounds listen (default 0.05)
+  FAKE_XRAY_LATENCY        seconds added to each outbound connection, standing in for
+                           the server handshake (default 0.02)
+  FAKE_XRAY_FAIL_RATE      share of outbounds whose connections are closed (default 0)
+  FAKE_XRAY_HANG_RATE      share of outbounds that never answer (default 0)
+  FAKE_XRAY_REJECT_RATE    share of outbounds the core refuses to load, failing the whole process (default 0)
+  FAKE_XRAY_CRASH_RATE     share of processes that panic during startup (default 0)
+  FAKE_XRAY_SEED           seed for the choices above (default 0)
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+from urllib.parse import urlsplit
+
+STARTUP_DELAY = float(os.environ.get("FAKE_XRAY_STARTUP_DELAY", "0.05"))
+LATENCY = float(os.environ.get("FAKE_XRAY_LATENCY", "0.02"))
+FAIL_RATE = float(os.environ.get("FAKE_XRAY_FAIL_RATE", "0"))
+HANG_RATE = float(os.environ.get("FAKE_XRAY_HANG_RATE", "0"))
+REJECT_RATE = float(os.environ.get("FAKE_XRAY_REJECT_RATE", "0"))
+CRASH_RATE = float(os.environ.get("FAKE_XRAY_CRASH_RATE", "0"))
+SEED = os.environ.get("FAKE_XRAY_SEED", "0")
+
+def outbound_behavior(outbound):
+    """Returns 'ok', 'dead', 'hang' or 'reject' for an outbound, stable across processes."""
+    # Xray keeps the server in "settings"; a sing-box outbound is flat, so use all of it but the tag
+    settings = json.dumps(outbound.get("settings") or {k: v for k, v in outbound.items() if k != "tag"}, sort_keys=True)
+    roll = int(hashlib.sha1(f"{SEED}|{settings}".encode()).hexdigest()[:8], 16) / 0xFFFFFFFF
+    if roll < FAIL_RATE:
+        return "dead"
+    if roll < FAIL_RATE + HANG_RATE:
+        return "hang"
+    if roll < FAIL_RATE + HANG_RATE + REJECT_RATE:
+        return "reject"
+    return "ok"
+
+def routes(config):
+    """Maps every inbound port to the behavior of the outbound it is routed to (Xray or sing-box config)."""
+    outbounds = {outbound.get("tag"): outbound for outbound in config["outbounds"]}
+    by_inbound_tag = {}
+    for rule in config.get("routing", {}).get("rules", []):
+        for tag in rule.get("inboundTag", []):
+            by_inbound_tag[tag] = outbounds.get(rule.get("outboundTag"))
+    for rule in config.get("route", {}).get("rules", []):
+        for tag in rule.get("inbound", []):
+            by_inbound_tag[tag] = outbounds.get(rule.get("outbound"))
+
+    default = config["outbounds"][0]
+    return {
+        inbound.get("port", inbound.get("listen_port")): outbound_behavior(by_inbound_tag.get(inbound.get("tag")) or default)
+        for inbound in config["inbounds"]
+    }
+
+async def pipe(reader, writer):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        writer.close()
+
+async def relay_response(upstream_reader, client_writer):
+    """Copies one HTTP response; returns False if its end is only marked by the upstream closing."""
+    head = await upstream_reader.readuntil(b"\r\n\r\n")
+    client_writer.write(head)
+    status = int(head.split(b" ", 2)[1])
+    length = re.search(rb"(?im)^content-length:\s*(\d+)", head)
+    if status in (204, 304) or length:
+        client_writer.write(await upstream_reader.readexactly(int(length.group(1)) if length else 0))
+        await client_writer.drain()
+        return True
+    await pipe(upstream_reader, client_writer)
+    return False
+
+def make_handler(behavior):
+    async def handle(client_reader, client_writer):
+        try:
+            head = await client_reader.readuntil(b"\r\n\r\n")
+            if behavior == "dead":
+                return
+            if behavior == "hang":
+                await client_reader.read()  # Until the client gives up
+                return
+
+            request_line, _, headers = head.decode("latin-1").partition("\r\n")
+            method, target, version = request_line.split(" ", 2)
+
+            if method == "CONNECT":
+                # One outbound connection for the whole tunnel
+                await asyncio.sleep(LATENCY)
+                host, _, port = target.rpartition(":")
+                upstream_reader, upstream_writer = await asyncio.open_connection(host, int(port))
+                client_writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+                await asyncio.gather(pipe(client_reader, upstream_writer), pipe(upstream_reader, client_writer))
+                return
+
+            # Like Xray's HTTP inbound, every plain request gets its own outbound connection
+            while True:
+                await asyncio.sleep(LATENCY)
+                url = urlsplit(target)
+                upstream_reader, upstream_writer = await asyncio.open_connection(url.hostname, url.port or 80)
+                path = (url.path or "/") + (f"?{url.query}" if url.query else "")
+                kept = [line for line in headers.split("\r\n") if line and not line.lower().startswith("proxy-")]
+                request = f"{method} {path} {version}\r\n" + "".join(f"{line}\r\n" for line in kept) + "\r\n"
+                upstream_writer.write(request.encode("latin-1"))
+                try:
+                    if not await relay_response(upstream_reader, client_writer):
+                        return
+                finally:
+                    upstream_writer.close()
+
+                head = await client_reader.readuntil(b"\r\n\r\n")
+                request_line, _, headers = head.decode("latin-1").partition("\r\n")
+                method, target, version = request_line.split(" ", 2)
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            client_writer.close()
+    return handle
+
+async def main():
+    singbox = sys.argv[1:2] == ["run"]
+    if "-config" not in sys.argv and not (singbox and "-c" in sys.argv):
+        print("usage: fake_xray.py -config stdin: | fake_xray.py run -c stdin", file=sys.stderr)
+        sys.exit(1)
+    config = json.loads(sys.stdin.read())
+
+    await asyncio.sleep(STARTUP_DELAY * random.uniform(0.5, 1.5))
+    if random.random() < CRASH_RATE:
+        print("panic: fake crash during startup", flush=True)
+        sys.exit(2)
+
+    if any(outbound_behavior(outbound) == "reject" for outbound in config["outbounds"]):
+        prefix = "FATAL[0000] decode config:" if singbox else "Failed to start:"
+        print(f"{prefix} fake invalid outbound", flush=True)
+        sys.exit(23)
+
+    servers = []
+    for port, behavior in routes(config).items():
+        try:
+            servers.append(await asyncio.start_server(make_handler(behavior), "127.0.0.1", port))
+        except OSError as e:
+            prefix = "FATAL[0000] start service:" if singbox else "Failed to start:"
+            print(f"{prefix} listen tcp 127.0.0.1:{port}: {e}", flush=True)
+            sys.exit(23)
+
+    print(f"{'sing-box' if singbox else 'Xray'} (fake) started with {len(servers)} inbounds", flush=True)
+    await asyncio.Event().wait()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
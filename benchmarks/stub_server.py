@@ -0,0 +1,58 @@
+"""
+Local aiohttp server that serves a corpus directory like raw.githubusercontent.com.
+
+Files are streamed with ETag / Last-Modified validators, so conditional
+requests get 304 Not Modified just like the real sources, and an optional
+per-request latency simulates slow hosts.
+
+    python benchmarks/stub_server.py DIR [--port 18080] [--latency MS]
+"""
+
+import argparse
+import asyncio
+import os
+from aiohttp import web
+
+def make_app(directory, latency=0.0):
+    async def serve(request):
+        path = os.path.join(directory, request.match_info["name"])
+        if not os.path.isfile(path):
+            raise web.HTTPNotFound()
+        if latency:
+            await asyncio.sleep(latency)
+        return web.FileResponse(path, headers={"Content-Type": "text/plain; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/{name}", serve)
+    return app
+
+async def start_server(directory, port=0, latency=0.0):
+    """Starts serving on 127.0.0.1 and returns (runner, base URL); call runner.cleanup() to stop."""
+    runner = web.AppRunner(make_app(directory, latency))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    return runner, f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+async def serve_forever(directory, port, latency):
+    runner, base_url = await start_server(directory, port, latency)
+    print(f"Serving {directory} on {base_url}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("directory", help="Corpus directory to serve")
+    parser.add_argument("--port", type=int, default=18080, help="Port to listen on (0 picks a free one)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Milliseconds to wait before each response")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve_forever(args.directory, args.port, args.latency / 1000))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import asyncio
+import os
+from metrics import default_metrics
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# --- CONFIGURATION ---
+CONCURRENCY_FLOOR = 8  # Never run fewer tests in parallel than this
+CONCURRENCY_CEILING = 200  # Never run more tests in parallel than this
+ADJUST_INTERVAL = 5.0  # Seconds between two concurrency decisions
+MIN_SAMPLES = 20  # Finished tests needed in a window before its timeout rate is trusted
+TIMEOUT_RATE_MARGIN = 0.15  # Shrink when the timeout rate exceeds the best seen by this much
+LOOP_LAG_LIMIT = 0.2  # Seconds of event-loop lag that count as overload
+LOAD_LIMIT = 1.5  # 1-minute load average per CPU that counts as overload
+FD_USAGE_LIMIT = 0.8  # Share of RLIMIT_NOFILE in use that counts as overload
+ADDITIVE_STEP = 4  # Slots added per healthy window
+MULTIPLICATIVE_FACTOR = 0.7  # Limit multiplier on overload
+
+TIMEOUT_ERRORS = ("Timeout", "XrayStartTimeout")
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limiter. Workers hold a slot while testing a config; every
+    ADJUST_INTERVAL the limit grows by ADDITIVE_STEP if all slots were busy and
+    the run looks healthy, or is multiplied by MULTIPLICATIVE_FACTOR when the
+    timeout rate, event-loop lag, CPU load or open file descriptors signal overload.
+    """
+
+    def __init__(self, initial, floor=CONCURRENCY_FLOOR, ceiling=CONCURRENCY_CEILING):
+        self.floor = floor
+        self.ceiling = max(ceiling, floor)
+        self.limit = min(max(initial, self.floor), self.ceiling)
+        self.active = 0
+        self.saturated = False
+        self.finished = 0
+        self.timeouts = 0
+        self.best_timeout_rate = None
+        self.max_lag = 0.0
+        self.history = []  # (seconds since start, new limit, reason)
+        self._condition = asyncio.Condition()
+        self._monitor = None
+        self._start = None
+
+    async def __aenter__(self):
+        async with self._condition:
+            with default_metrics.timed("slot_wait"):
+                await self._condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+            if self.active >= self.limit:
+                self.saturated = True
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    def record(self, error):
+        """Feeds one finished test's error reason (None on success) into the current window."""
+        self.finished += 1
+        if error in TIMEOUT_ERRORS:
+            self.timeouts += 1
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._start = loop.time()
+        self._monitor = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._monitor:
+            self._monitor.cancel()
+            try:
+                await self._monitor
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        tick = 0.1
+        next_adjust = loop.time() + ADJUST_INTERVAL
+
+        while True:
+            before = loop.time()
+            await asyncio.sleep(tick)
+            self.max_lag = max(self.max_lag, loop.time() - before - tick)
+
+            if loop.time() >= next_adjust:
+                await self._adjust()
+                next_adjust = loop.time() + ADJUST_INTERVAL
+
+    async def _adjust(self):
+        reason = self._overload_reason()
+        old_limit = self.limit
+
+        if reason:
+            self.limit = max(self.floor, int(self.limit * MULTIPLICATIVE_FACTOR))
+        elif self.saturated:
+            self.limit = min(self.ceiling, self.limit + ADDITIVE_STEP)
+            reason = "all slots busy, healthy"
+
+        if self.limit != old_limit:
+            elapsed = asyncio.get_running_loop().time() - self._start
+            self.history.append((round(elapsed, 1), self.limit, reason))
+            print(f"[concurrency] {elapsed:7.1f}s  {old_limit} -> {self.limit}  ({reason})")
+            async with self._condition:
+                self._condition.notify_all()
+
+        self.saturated = self.active >= self.limit
+        self.finished = 0
+        self.timeouts = 0
+        self.max_lag = 0.0
+
+    def _overload_reason(self):
+        if self.finished >= MIN_SAMPLES:
+            rate = self.timeouts / self.finished
+            if self.best_timeout_rate is not None and rate > self.best_timeout_rate + TIMEOUT_RATE_MARGIN:
+                return f"timeout rate {rate:.0%} vs best {self.best_timeout_rate:.0%}"
+            if self.best_timeout_rate is None or rate < self.best_timeout_rate:
+                self.best_timeout_rate = rate
+
+        if self.max_lag > LOOP_LAG_LIMIT:
+            return f"event-loop lag {self.max_lag * 1000:.0f}ms"
+
+        load = cpu_load()
+        if load is not None and load > LOAD_LIMIT:
+            return f"load {load:.2f} per CPU"
+
+        fd_usage = fd_usage_ratio()
+        if fd_usage is not None and fd_usage > FD_USAGE_LIMIT:
+            return f"{fd_usage:.0%} of file descriptors in use"
+
+        return None
+
+def cpu_load():
+    """1-minute load average per CPU, or None where the OS does not report it."""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        return None
+
+def fd_usage_ratio():
+    """Share of the soft RLIMIT_NOFILE currently open, or None where it cannot be read."""
+    if resource is None or not os.path.isdir("/proc/self/fd"):
+        return None
+    soft_limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft_limit <= 0:
+        return None
+    return len(os.listdir("/proc/self/fd")) / soft_limit
@@ -0,0 +1,148 @@
+"""
+Compact per-protocol config records.
+
+A parsed config used to be a dict of 10-14 keys; these classes store the same
+fields in __slots__ and keep the protocol on the class, which makes each config
+several times smaller. They keep read-only dict access (config["add"],
+config.get("sni"), "fp" in config, keys()) so get_config_hash and
+generate_xray_config accept either form. to_dict() returns the fields in the
+original key order, so the JSON written from a record matches the dict's byte for byte.
+"""
+
+import sys
+
+def _intern(value):
+    """sys.intern() for vmess fields, which come from arbitrary JSON and may not be strings."""
+    return sys.intern(value) if type(value) is str else value
+
+class ConfigRecord:
+    __slots__ = ()
+    protocol = None
+    FIELDS = ()  # Keys in JSON order, "protocol" first
+    KEYS = frozenset()  # FIELDS as a set, for lookups
+
+    def __getitem__(self, key):
+        if key in self.KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.KEYS else default
+
+    def __contains__(self, key):
+        return key in self.KEYS
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def keys(self):
+        return self.FIELDS
+
+    def values(self):
+        return [getattr(self, key) for key in self.FIELDS]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.FIELDS]
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.FIELDS}
+
+    def __eq__(self, other):
+        if not isinstance(other, ConfigRecord):
+            return NotImplemented
+        return type(self) is type(other) and self.values() == other.values()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+class VmessConfig(ConfigRecord):
+    __slots__ = ("add", "port", "id", "aid", "net", "type", "host", "path", "tls", "ps", "raw_uri")
+    protocol = "vmess"
+    FIELDS = ("protocol",) + __slots__
+    KEYS = frozenset(FIELDS)
+
+    def __init__(self, add, port, id, aid, net, type, host, path, tls, ps, raw_uri):
+        self.add = add
+        self.port = port
+        self.id = id
+        self.aid = aid
+        self.net = _intern(net)
+        self.type = _intern(type)
+        self.host = host
+        self.path = path
+        self.tls = _intern(tls)
+        self.ps = ps
+        self.raw_uri = raw_uri
+
+class VlessConfig(ConfigRecord):
+    __slots__ = ("add", "port", "id", "encryption", "type", "security", "path", "host", "sni", "fp", "ps", "raw_uri")
+    protocol = "vless"
+    FIELDS = ("protocol",) + __slots__
+    KEYS = frozenset(FIELDS)
+
+    def __init__(self, add, port, id, encryption, type, security, path, host, sni, fp, ps, raw_uri):
+        self.add = add
+        self.port = port
+        self.id = id
+        self.encryption = sys.intern(encryption)
+        self.type = sys.intern(type)
+        self.security = sys.intern(security)
+        self.path = path
+        self.host = host
+        self.sni = sni
+        self.fp = sys.intern(fp)
+        self.ps = ps
+        self.raw_uri = raw_uri
+
+class TrojanConfig(ConfigRecord):
+    __slots__ = ("add", "port", "password", "sni", "type", "security", "path", "host", "ps", "raw_uri")
+    protocol = "trojan"
+    FIELDS = ("protocol",) + __slots__
+    KEYS = frozenset(FIELDS)
+
+    def __init__(self, add, port, password, sni, type, security, path, host, ps, raw_uri):
+        self.add = add
+        self.port = port
+        self.password = password
+        self.sni = sni
+        self.type = sys.intern(type)
+        self.security = sys.intern(security)
+        self.path = path
+        self.host = host
+        self.ps = ps
+        self.raw_uri = raw_uri
+
+class ShadowsocksConfig(ConfigRecord):
+    __slots__ = ("add", "port", "method", "password", "ps", "raw_uri")
+    protocol = "shadowsocks"
+    FIELDS = ("protocol",) + __slots__
+    KEYS = frozenset(FIELDS)
+
+    def __init__(self, add, port, method, password, ps, raw_uri):
+        self.add = add
+        self.port = port
+        self.method = sys.intern(method)
+        self.password = password
+        self.ps = ps
+        self.raw_uri = raw_uri
+
+RECORD_TYPES = {cls.protocol: cls for cls in (VmessConfig, VlessConfig, TrojanConfig, ShadowsocksConfig)}
+
+def config_from_dict(data):
+    """
+    Turns a config dict loaded from JSON back into its record. Dicts with other
+    keys (hand-edited or from older versions) are returned unchanged so no field is lost.
+    """
+    cls = RECORD_TYPES.get(data.get("protocol"))
+    if cls is None or tuple(data) != cls.FIELDS:
+        return data
+    return cls(*[data[key] for key in cls.__slots__])
+
+def to_json(value):
+    """json.dump(default=...) hook that writes records as their dicts."""
+    if isinstance(value, ConfigRecord):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
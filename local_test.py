@@ -1,57 +1,27 @@
 import asyncio
 import json
 import os
-import shutil
 import datetime
 import aiohttp
-import zipfile
 from collections import Counter
-from v2ray_utils import test_connection, parse_vmess, parse_vless, parse_trojan, parse_shadowsocks, decode_base64, test_tcp_connection
+from v2ray_utils import test_connection, decode_base64, tcp_precheck, summarize_ready_times, summarize_precheck, get_config_hash, PROBE_SAMPLES
+from result_cache import ResultCache
+from results_store import ResultsStore
+from uri_parser import parse_config
+from concurrency import AdaptiveLimiter, CONCURRENCY_FLOOR, CONCURRENCY_CEILING
+from metrics import default_metrics
+from backends import setup_backend
 
 # --- CONFIGURATION ---
-XRAY_BIN_DIR = "bin"
-XRAY_BIN = os.path.join(XRAY_BIN_DIR, "xray")
-XRAY_ZIP = "xray.zip"
-XRAY_DOWNLOAD_URL = "https://github.com/XTLS/Xray-core/releases/download/v1.8.4/Xray-linux-64.zip"
-
 INPUT_FILE = "real_delay_passed.txt"
 RESULTS_BASE_DIR = "local_results"
-CONCURRENCY = 80
+CONCURRENCY = 80  # Initial limit, adapted between CONCURRENCY_FLOOR and CONCURRENCY_CEILING
 PORT_START = 20000
+CACHE_FILE = os.path.join(RESULTS_BASE_DIR, "test_cache.json")  # Kept apart from the CI cache: different network
+RESULTS_DB = os.path.join(RESULTS_BASE_DIR, "results.db")  # Every local run, queried with results_store.py --db
+SORT_BY = os.environ.get("SORT_BY", "median")  # "median" or "p90" latency when ranking passed configs
 
-async def download_xray():
-    """Downloads and extracts Xray core if not present."""
-    if os.path.exists(XRAY_BIN):
-        print(f"Xray binary found at {XRAY_BIN}")
-        return
-
-    print("Downloading Xray Core...")
-    os.makedirs(XRAY_BIN_DIR, exist_ok=True)
-
-    async with aiohttp.ClientSession() as session:
-        async with session.get(XRAY_DOWNLOAD_URL) as response:
-            if response.status == 200:
-                with open(XRAY_ZIP, "wb") as f:
-                    f.write(await response.read())
-            else:
-                print(f"Failed to download Xray: {response.status}")
-                return
-
-    print("Extracting Xray...")
-    try:
-        with zipfile.ZipFile(XRAY_ZIP, "r") as zip_ref:
-            zip_ref.extractall(XRAY_BIN_DIR)
-
-        # Ensure executable permission
-        os.chmod(XRAY_BIN, 0o755)
-        print("Xray installed successfully.")
-    except Exception as e:
-        print(f"Error extracting Xray: {e}")
-    finally:
-        if os.path.exists(XRAY_ZIP):
-            os.remove(XRAY_ZIP)
-
-async def worker(queue, results, log_file_handle, stats, port_offset, session):
+async def worker(queue, results, log_file_handle, stats, port_offset, session, cache=None, limiter=None, store=None):
     local_port = PORT_START + port_offset
 
     while True:
@@ -61,33 +31,48 @@ async def worker(queue, results, log_file_handle, stats, port_offset, session):
             break
 
         # Re-parse the URI since we are reading from txt
-        config = None
-        if config_uri.startswith("vmess://"):
-            config = parse_vmess(config_uri)
-        elif config_uri.startswith("vless://"):
-            config = parse_vless(config_uri)
-        elif config_uri.startswith("trojan://"):
-            config = parse_trojan(config_uri)
-        elif config_uri.startswith("ss://"):
-            config = parse_shadowsocks(config_uri)
+        config = parse_config(config_uri)
 
         if not config:
             stats["InvalidConfig"] += 1
             queue.task_done()
             continue
 
-        # TCP Pre-Check
-        if not await test_tcp_connection(config['add'], config['port'], timeout=1.5):
-            log_file_handle.write(f"{datetime.datetime.now()} - TCP Failed - {config_uri[:50]}...\n")
-            stats['TCP_Failed'] += 1
-            stats["total"] += 1
-            queue.task_done()
-            continue
+        config_hash = get_config_hash(config)
+        cached = cache.lookup(config_hash) if cache else None
 
-        success, delay, error = await test_connection(config, local_port, session=session)
+        if cached:
+            success, delay, error = cached["ok"], cached["delay"], cached["error"]
+            latency = cached.get("latency")
+            source = "CACHED"
+        else:
+            # TCP Pre-Check
+            if not await tcp_precheck(config['add'], config['port'], timeout=1.5):
+                if cache:
+                    cache.record(config_hash, False, -1, "TCP_Failed")
+                if store:
+                    store.add(config_hash, config, False, -1, "TCP_Failed")
+                log_file_handle.write(f"{datetime.datetime.now()} - TCP Failed - {config_uri[:50]}...\n")
+                stats['TCP_Failed'] += 1
+                stats["total"] += 1
+                queue.task_done()
+                continue
+
+            latency = {}
+            if limiter:
+                async with limiter:
+                    success, delay, error = await test_connection(config, local_port, session, PROBE_SAMPLES, latency)
+                limiter.record(error)
+            else:
+                success, delay, error = await test_connection(config, local_port, session, PROBE_SAMPLES, latency)
+            if cache:
+                cache.record(config_hash, success, delay, error, latency=latency)
+            if store:
+                store.add(config_hash, config, success, delay, error, latency)
+            source = f"Port {local_port}"
 
         # Log result
-        log_msg = f"Port {local_port}: {error if error else 'SUCCESS'} ({delay}ms) - {config_uri[:50]}..."
+        log_msg = f"{source}: {error if error else 'SUCCESS'} ({delay}ms) - {config_uri[:50]}..."
         log_file_handle.write(f"{datetime.datetime.now()} - {log_msg}\n")
         log_file_handle.flush() # Ensure real-time logging
 
@@ -96,6 +81,8 @@ async def worker(queue, results, log_file_handle, stats, port_offset, session):
             "delay_ms": delay,
             "error": error
         }
+        if latency:
+            result_entry["latency"] = latency
         results.append(result_entry)
 
         if success:
@@ -110,7 +97,8 @@ async def worker(queue, results, log_file_handle, stats, port_offset, session):
         queue.task_done()
 
 async def main():
-    await download_xray()
+    if not await setup_backend():
+        raise SystemExit(1)
 
     if not os.path.exists(INPUT_FILE):
         print(f"{INPUT_FILE} not found!")
@@ -136,22 +124,34 @@ async def main():
 
     results = []
     stats = Counter()
+    cache = ResultCache(CACHE_FILE)
+    limiter = AdaptiveLimiter(CONCURRENCY, CONCURRENCY_FLOOR, CONCURRENCY_CEILING)
+    store = ResultsStore(RESULTS_DB)
+    store.start_run("local_test")
 
     with open(log_path, "w") as log_file:
         async with aiohttp.ClientSession() as session:
             tasks = []
-            for i in range(CONCURRENCY):
-                task = asyncio.create_task(worker(queue, results, log_file, stats, i, session))
+            for i in range(limiter.ceiling):
+                task = asyncio.create_task(worker(queue, results, log_file, stats, i, session, cache, limiter, store))
                 tasks.append(task)
 
+            limiter.start()
+            default_metrics.start_sampling({"queue": queue}, limiter)
             await asyncio.gather(*tasks)
+            await default_metrics.stop_sampling()
+            await limiter.stop()
+
+    cache.save()
+    store.finish_run(stats)
+    store.close()
 
     # Sort results by delay (fastest first), pushing errors (-1) to the end?
     def sort_key(item):
         d = item["delay_ms"]
         if d == -1:
             return float('inf') # Push to end
-        return d
+        return item.get("latency", {}).get(f"{SORT_BY}_ms", d)
 
     results.sort(key=sort_key)
 
@@ -174,6 +174,21 @@ async def main():
     for reason, count in stats.items():
          if reason not in ["total", "passed"]:
             print(f"  {reason}: {count}")
+    print(f"Result cache: {cache.hits} reused, {cache.misses} probed")
+    precheck = summarize_precheck()
+    print(f"TCP pre-check: {precheck.get('endpoints_probed', 0)} endpoints probed, "
+          f"{precheck.get('endpoint_reused', 0)} reused, {precheck.get('dns_lookups', 0)} DNS lookups, "
+          f"{precheck.get('dns_cache_hits', 0)} DNS cache hits")
+    print(f"               {precheck.get('coalesced', 0)} coalesced, "
+          f"{precheck.get('short_circuited', 0)} short-circuited by dead endpoints")
+    print(f"Concurrency: final limit {limiter.limit}, {len(limiter.history)} adjustments")
+    ready_times = summarize_ready_times()
+    if ready_times:
+        print(f"Xray Time-to-Ready: median {ready_times['median_ms']}ms, p90 {ready_times['p90_ms']}ms, "
+              f"max {ready_times['max_ms']}ms ({ready_times['count']} spawns)")
+    print("Phase timings:")
+    default_metrics.print_phases()
+    default_metrics.export(output_dir, stats)
     print(f"Results saved to {output_dir}")
 
 if __name__ == "__main__":
@@ -0,0 +1,219 @@
+import asyncio
+import bisect
+import contextlib
+import json
+import os
+import time
+
+# --- CONFIGURATION ---
+METRICS_JSON = "test_metrics.json"
+METRICS_PROM = "test_metrics.prom"
+SAMPLE_INTERVAL = 1.0  # Seconds between queue depth / active Xray samples
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)  # Histogram upper bounds
+PROM_PREFIX = "ivpn_tester"
+
+# Phases in the order a config goes through them, for reports
+PHASES = ("tcp_precheck", "slot_wait", "batch_wait", "spawn", "ready", "http_probe", "terminate", "test_connection")
+
+def label_value(value):
+    """Escapes a Prometheus label value: backslash, double quote and newline."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Histogram:
+    """Latency histogram in milliseconds with Prometheus-style buckets; keeps samples for quantiles."""
+
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last slot is +Inf
+        self.samples = []
+        self.sum = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.samples.append(ms)
+        self.sum += ms
+
+    def quantile(self, q):
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else None
+
+    def cumulative(self):
+        """Returns [(upper bound or '+Inf', count of samples <= bound)]."""
+        total = 0
+        result = []
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def summary(self):
+        ordered = sorted(self.samples)
+        count = len(ordered)
+        return {
+            "count": count,
+            "sum_ms": round(self.sum, 1),
+            "mean_ms": round(self.sum / count, 1) if count else None,
+            "p50_ms": round(ordered[count // 2], 1) if count else None,
+            "p90_ms": round(ordered[min(count - 1, int(count * 0.9))], 1) if count else None,
+            "p99_ms": round(ordered[min(count - 1, int(count * 0.99))], 1) if count else None,
+            "max_ms": round(ordered[-1], 1) if count else None,
+            "buckets": {str(bound): total for bound, total in self.cumulative()},
+        }
+
+class Metrics:
+    """
+    Run-wide instrumentation for the testers: a latency histogram per phase
+    (pre-check, slot wait, batch wait, Xray spawn / ready / terminate, HTTP probe), the set of
+    live Xray processes, and periodic samples of queue depths, live Xray
+    processes and limiter state. Exported as JSON and as a Prometheus textfile.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.active_xray = set()  # PIDs of Xray processes started and not yet stopped
+        self.xray_spawned = 0
+        self.max_active_xray = 0
+        self.series = []  # One dict per sample
+        self._start = time.monotonic()
+        self._end = None
+        self._sampler = None
+
+    def observe(self, phase, seconds):
+        histogram = self.phases.get(phase)
+        if histogram is None:
+            histogram = self.phases[phase] = Histogram()
+        histogram.observe(seconds * 1000)
+
+    @contextlib.contextmanager
+    def timed(self, phase):
+        """Times the enclosed block, awaits included, even when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - start)
+
+    def xray_started(self, process):
+        self.xray_spawned += 1
+        self.active_xray.add(process.pid)
+        self.max_active_xray = max(self.max_active_xray, len(self.active_xray))
+
+    def xray_stopped(self, process):
+        self.active_xray.discard(process.pid)
+
+    def start_sampling(self, queues=None, limiter=None):
+        """Samples the given {name: asyncio.Queue} depths and limiter state every SAMPLE_INTERVAL."""
+        self._start = time.monotonic()
+        self._end = None
+        self._sampler = asyncio.create_task(self._sample(queues or {}, limiter))
+
+    async def stop_sampling(self):
+        self._end = time.monotonic()
+        if self._sampler:
+            self._sampler.cancel()
+            try:
+                await self._sampler
+            except asyncio.CancelledError:
+                pass
+            self._sampler = None
+
+    async def _sample(self, queues, limiter):
+        while True:
+            sample = {"t": round(time.monotonic() - self._start, 1), "active_xray": len(self.active_xray)}
+            for name, queue in queues.items():
+                sample[f"{name}_depth"] = queue.qsize()
+            if limiter:
+                sample["limit"] = limiter.limit
+                sample["in_flight"] = limiter.active
+            self.series.append(sample)
+            await asyncio.sleep(SAMPLE_INTERVAL)
+
+    def phase_summaries(self):
+        ordered = [phase for phase in PHASES if phase in self.phases]
+        ordered += sorted(phase for phase in self.phases if phase not in PHASES)
+        return {phase: self.phases[phase].summary() for phase in ordered}
+
+    def report(self, stats=None):
+        peaks = {}
+        for sample in self.series:
+            for key, value in sample.items():
+                if key != "t":
+                    peaks[key] = max(peaks.get(key, value), value)
+        return {
+            "duration_s": round((self._end or time.monotonic()) - self._start, 1),
+            "outcomes": dict(stats or {}),
+            "phases": self.phase_summaries(),
+            "xray": {"spawned": self.xray_spawned, "max_active": self.max_active_xray, "still_active": len(self.active_xray)},
+            "peaks": peaks,
+            "series": self.series,
+        }
+
+    def to_prometheus(self, stats=None):
+        """Renders the run in the Prometheus text exposition format (node_exporter textfile collector)."""
+        lines = [
+            f"# HELP {PROM_PREFIX}_phase_seconds Duration of each tester phase.",
+            f"# TYPE {PROM_PREFIX}_phase_seconds histogram",
+        ]
+        for phase, histogram in self.phases.items():
+            for bound, total in histogram.cumulative():
+                le = bound if bound == "+Inf" else f"{bound / 1000:g}"
+                lines.append(f'{PROM_PREFIX}_phase_seconds_bucket{{phase="{phase}",le="{le}"}} {total}')
+            lines.append(f'{PROM_PREFIX}_phase_seconds_sum{{phase="{phase}"}} {histogram.sum / 1000:.6f}')
+            lines.append(f'{PROM_PREFIX}_phase_seconds_count{{phase="{phase}"}} {len(histogram.samples)}')
+
+        lines += [
+            f"# HELP {PROM_PREFIX}_configs_total Tested configs by outcome.",
+            f"# TYPE {PROM_PREFIX}_configs_total counter",
+        ]
+        outcomes = {}
+        for outcome, count in (stats or {}).items():
+            if outcome != "total":
+                # "XrayCrash: <exception text>" and the like are counted under their prefix
+                outcome = str(outcome).partition(": ")[0]
+                outcomes[outcome] = outcomes.get(outcome, 0) + count
+        for outcome, count in sorted(outcomes.items()):
+            lines.append(f'{PROM_PREFIX}_configs_total{{outcome="{label_value(outcome)}"}} {count}')
+
+        report = self.report(stats)
+        lines += [
+            f"# HELP {PROM_PREFIX}_xray_spawned_total Xray processes started.",
+            f"# TYPE {PROM_PREFIX}_xray_spawned_total counter",
+            f"{PROM_PREFIX}_xray_spawned_total {self.xray_spawned}",
+            f"# HELP {PROM_PREFIX}_peak Highest sampled value of a run gauge (queue depths, live Xray, limit).",
+            f"# TYPE {PROM_PREFIX}_peak gauge",
+        ]
+        for key, value in sorted(report["peaks"].items()):
+            lines.append(f'{PROM_PREFIX}_peak{{gauge="{key}"}} {value}')
+        lines += [
+            f"# HELP {PROM_PREFIX}_duration_seconds Wall time of the run.",
+            f"# TYPE {PROM_PREFIX}_duration_seconds gauge",
+            f"{PROM_PREFIX}_duration_seconds {report['duration_s']}",
+            f"# HELP {PROM_PREFIX}_last_run_timestamp_seconds End of the run.",
+            f"# TYPE {PROM_PREFIX}_last_run_timestamp_seconds gauge",
+            f"{PROM_PREFIX}_last_run_timestamp_seconds {int(time.time())}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def export(self, directory="", stats=None, suffix=""):
+        """Writes METRICS_JSON and METRICS_PROM (with `suffix` before the extension) into `directory`; returns their paths."""
+        json_path = os.path.join(directory, suffixed(METRICS_JSON, suffix))
+        prom_path = os.path.join(directory, suffixed(METRICS_PROM, suffix))
+        # Temp file + rename, so a textfile collector never reads a half-written file
+        for path, content in ((json_path, json.dumps(self.report(stats), indent=2)), (prom_path, self.to_prometheus(stats))):
+            with open(f"{path}.tmp", "w") as f:
+                f.write(content)
+            os.replace(f"{path}.tmp", path)
+        return json_path, prom_path
+
+    def print_phases(self):
+        """Prints one line per phase: count, median, p90 and max."""
+        for phase, summary in self.phase_summaries().items():
+            print(f"  {phase:<16} {summary['count']:>6}x  median {summary['p50_ms']:>8.1f}ms  "
+                  f"p90 {summary['p90_ms']:>8.1f}ms  max {summary['max_ms']:>8.1f}ms")
+
+def suffixed(path, suffix):
+    """Inserts `suffix` before the file extension: suffixed("a.json", ".shard-0-of-2") -> "a.shard-0-of-2.json"."""
+    root, ext = os.path.splitext(path)
+    return f"{root}{suffix}{ext}"
+
+default_metrics = Metrics()
@@ -0,0 +1,233 @@
+"""
+Fused aggregate-and-test pipeline:
+
+    fetch -> decode -> parse -> dedup -> TCP pre-check -> real delay test
+
+Stages are connected by queues, so a source's configs reach the Xray workers as
+soon as that source has been fetched and deduplicated, instead of after every
+source has been fetched. Writes the same unique_configs.json and
+real_delay_passed.txt as running aggregator.py followed by tester.py, and takes
+the tester's --shard, --deadline and --target-passed. The budget only bounds
+testing: fetching always completes, so unique_configs.json and the source stats
+cover every source. Configs wait for the pre-check best scheduler score first;
+as they arrive over time, that orders each backlog rather than the whole run.
+"""
+
+import argparse
+import asyncio
+import aiohttp
+import itertools
+from collections import Counter
+import aggregator
+import tester
+from result_cache import ResultCache
+from results_store import ResultsStore, RESULTS_DB, parse_duration
+from scheduler import Scheduler
+from source_cache import SourceCache
+from source_stats import SourceStats
+from concurrency import AdaptiveLimiter, CONCURRENCY_FLOOR, CONCURRENCY_CEILING
+from v2ray_utils import test_connection, tcp_precheck, get_config_hash, PROBE_SAMPLES
+from metrics import default_metrics, suffixed
+from backends import setup_backend
+
+# --- CONFIGURATION ---
+QUEUE_SIZE = 1000  # Max configs buffered between the pre-check and the real delay test
+PRECHECK_CONCURRENCY = 100  # Workers running the TCP pre-check
+PROBE_CONCURRENCY = tester.CONCURRENCY  # Initial real delay test limit, adapted by AdaptiveLimiter
+STOP = None  # Sentinel telling a stage worker that its input is exhausted
+LAST = float("inf")  # Pre-check queue priority of STOP, after every config
+
+def make_collector(source_index, unique_configs, precheck_queue, results, stats, cache, scheduler, sequence, shard=None):
+    async def on_config(position, config, config_hash):
+        if not unique_configs.add((source_index, position), config, config_hash):
+            return
+        if shard and not tester.in_shard(config_hash, shard):
+            return
+
+        host = config.get('add')
+        port = config.get('port')
+        try:
+            port = int(port)
+        except (TypeError, ValueError):
+            port = None
+        if not host or not port:
+            stats['InvalidConfig'] += 1
+            return
+
+        cached = cache.lookup(config_hash)
+        if cached:
+            if cached["ok"]:
+                results.append((config, cached["delay"], cached.get("latency")))
+                stats["passed"] += 1
+            else:
+                stats[cached["error"]] += 1
+            stats["total"] += 1
+            return
+
+        # The sequence number breaks ties in arrival order and keeps configs out of comparisons
+        await precheck_queue.put((-scheduler.score(config_hash, config), next(sequence), (config_hash, config)))
+
+    return on_config
+
+async def precheck_worker(precheck_queue, probe_queue, stats, cache, store):
+    while True:
+        _, _, item = await precheck_queue.get()
+        if item is STOP:
+            break
+
+        config_hash, config = item
+        if await tcp_precheck(config['add'], int(config['port']), timeout=1.5):
+            await probe_queue.put(item)
+        else:
+            cache.record(config_hash, False, -1, "TCP_Failed")
+            store.add(config_hash, config, False, -1, "TCP_Failed")
+            stats['TCP_Failed'] += 1
+            stats["total"] += 1
+
+async def probe_worker(probe_queue, results, stats, port_offset, session, cache, limiter, store):
+    local_port = tester.PORT_START + port_offset
+
+    while True:
+        item = await probe_queue.get()
+        if item is STOP:
+            break
+
+        config_hash, config = item
+        latency = {}
+        async with limiter:
+            success, delay, error = await test_connection(config, local_port, session, PROBE_SAMPLES, latency)
+        limiter.record(error)
+        cache.record(config_hash, success, delay, error, latency=latency)
+        store.add(config_hash, config, success, delay, error, latency)
+
+        if success:
+            results.append((config, delay, latency))
+            stats["passed"] += 1
+        else:
+            stats[error] += 1
+
+        stats["total"] += 1
+        if stats["total"] % 500 == 0:
+            print(f"Processed {stats['total']} configs...")
+
+def queued_configs(queue, item=lambda entry: entry):
+    """Empties a stage queue, returning how many configs (not STOP sentinels) were still waiting."""
+    count = 0
+    while not queue.empty():
+        if item(queue.get_nowait()) is not STOP:
+            count += 1
+    return count
+
+def canonical_results(results, unique_configs):
+    """
+    Swaps each result's config for the variant unique_configs kept. Duplicates are tested
+    as whichever arrives first, but the output should list the same raw_uri as unique_configs.json.
+    """
+    return [(unique_configs.entries[get_config_hash(config)][1], delay, latency) for config, delay, latency in results]
+
+async def main(shard=None, deadline=None, target_passed=None):
+    # The deadline covers the whole run, setup included
+    budget = tester.RunBudget(deadline, target_passed)
+    budget.start()
+
+    if not await setup_backend():
+        raise SystemExit(1)
+
+    urls = aggregator.read_sources()
+    if not urls:
+        print("No sources found.")
+        return
+
+    print(f"Fetching {len(urls)} sources, testing with concurrency {PROBE_CONCURRENCY}...")
+    if shard:
+        print(f"Shard {shard[0]}/{shard[1]}: testing only its slice of the unique configs")
+
+    suffix = tester.shard_suffix(shard)
+    source_cache = SourceCache()
+    source_stats = SourceStats()
+    source_stats.join_results(aggregator.SOURCE_MAP_FILE, RESULTS_DB)
+    scheduler = Scheduler.from_files(suffixed(RESULTS_DB, suffix), suffixed(tester.DETAILED_FILE, suffix), aggregator.SOURCE_MAP_FILE)
+    cache = ResultCache(suffixed(tester.CACHE_FILE, suffix))
+    store = ResultsStore(suffixed(RESULTS_DB, suffix))
+    store.start_run("pipeline", shard)
+    unique_configs = aggregator.UniqueConfigs()
+    # Unbounded on purpose: it only references configs already held by unique_configs,
+    # and blocking here would stall downloads into their TIMEOUT
+    precheck_queue = asyncio.PriorityQueue()
+    probe_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    sequence = itertools.count()
+    results = []
+    stats = Counter()
+    limiter = AdaptiveLimiter(PROBE_CONCURRENCY, CONCURRENCY_FLOOR, CONCURRENCY_CEILING)
+
+    async with aiohttp.ClientSession() as session:
+        prechecks = [asyncio.create_task(precheck_worker(precheck_queue, probe_queue, stats, cache, store))
+                     for _ in range(PRECHECK_CONCURRENCY)]
+        probes = [asyncio.create_task(probe_worker(probe_queue, results, stats, i, session, cache, limiter, store))
+                  for i in range(limiter.ceiling)]
+        limiter.start()
+        default_metrics.start_sampling({"precheck_queue": precheck_queue, "probe_queue": probe_queue}, limiter)
+
+        def collector(source_index):
+            return make_collector(source_index, unique_configs, precheck_queue, results, stats, cache, scheduler, sequence, shard)
+
+        async def fetch():
+            parsed = 0
+            done = 0
+            try:
+                async for count in aggregator.fetch_sources(session, urls, collector, source_cache, None, source_stats):
+                    parsed += count
+                    done += 1
+                    print(f"[{done}/{len(urls)}] {parsed} configs parsed, {len(unique_configs)} unique so far")
+                source_cache.save()
+            finally:
+                for _ in prechecks:
+                    precheck_queue.put_nowait((LAST, next(sequence), STOP))
+
+        async def stop_probes():
+            # Drain the stages in order: no more configs, then no more pre-checks
+            await asyncio.gather(*prechecks)
+            for _ in probes:
+                await probe_queue.put(STOP)
+
+        fetcher = asyncio.create_task(fetch())
+        # An exhausted budget cancels the stages (and the tests in flight) but not the fetch
+        await budget.wait(prechecks + probes + [asyncio.create_task(stop_probes())], stats)
+        await fetcher
+        await default_metrics.stop_sampling()
+        await limiter.stop()
+
+    # Configs never tested: still queued, or cancelled in flight when the budget ran out
+    selected = sum(1 for config_hash in unique_configs.entries if not shard or tester.in_shard(config_hash, shard))
+    queued = queued_configs(precheck_queue, lambda entry: entry[2]) + queued_configs(probe_queue)
+    skipped = {"queued": queued, "cancelled": selected - stats["total"] - stats["InvalidConfig"] - queued}
+
+    cache.save()
+    store.finish_run(stats)
+    store.close()
+
+    aggregator.print_dedup_summary(unique_configs)
+    aggregator.save_unique_configs(unique_configs)
+    aggregator.update_source_stats(source_stats, aggregator.save_source_map(unique_configs, urls))
+
+    tester.print_summary(stats, cache, limiter)
+    if budget.reason:
+        tester.print_skipped(skipped, selected, budget.reason)
+    results = canonical_results(results, unique_configs)
+    tester.save_results(results, suffixed(tester.OUTPUT_FILE, suffix))
+    tester.save_detailed_results(results, stats, suffixed(tester.DETAILED_FILE, suffix), shard, skipped if budget.reason else None)
+    tester.export_metrics(stats, suffix=suffix)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fetches the sources and tests their unique configs as they arrive.")
+    parser.add_argument("--shard", type=tester.parse_shard, metavar="i/N",
+                        help="Test only slice i of N (0-based), chosen by config hash; test outputs get a .shard-i-of-N suffix")
+    parser.add_argument("--deadline", type=parse_duration, metavar="DURATION",
+                        help="Stop testing after this long (e.g. 45m, 2h or seconds), cancel running tests and save what passed")
+    parser.add_argument("--target-passed", type=tester.parse_count, metavar="N",
+                        help="Stop testing once N configs passed, cancel running tests and save them")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    asyncio.run(main(args.shard, args.deadline, args.target_passed))
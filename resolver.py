@@ -0,0 +1,141 @@
+import asyncio
+import ipaddress
+import socket
+import time
+from collections import Counter
+
+# --- CONFIGURATION ---
+DNS_TTL = 300  # Seconds a lookup stays cached (getaddrinfo does not expose record TTLs)
+DNS_NEGATIVE_TTL = 60  # Seconds a failed lookup stays cached
+DNS_TIMEOUT = 5.0  # Max seconds for one lookup
+DNS_CONCURRENCY = 32  # Max lookups in flight on the executor
+HAPPY_EYEBALLS_DELAY = 0.25  # Seconds before racing the next address (RFC 8305)
+
+class Resolver:
+    """
+    Async resolver with an in-memory TTL cache. Lookups go through the loop's
+    getaddrinfo executor, bounded by a semaphore, and concurrent lookups of the
+    same host share one request.
+    """
+
+    def __init__(self, ttl=DNS_TTL, negative_ttl=DNS_NEGATIVE_TTL, concurrency=DNS_CONCURRENCY):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.concurrency = concurrency
+        self.cache = {}  # host -> (expires_at, addresses)
+        self.inflight = {}  # host -> Task resolving it
+        self.semaphore = None
+        self.stats = Counter()
+
+    async def resolve(self, host, timeout=None):
+        """
+        Returns the host's IP addresses with IPv6 and IPv4 interleaved as RFC 8305
+        suggests, or an empty list if the lookup fails, `host` is not a non-empty
+        string, or no answer arrives within `timeout` seconds. A lookup the caller
+        gave up on still runs to completion and fills the cache.
+        """
+        if not isinstance(host, str) or not host:
+            return []
+        try:
+            return [str(ipaddress.ip_address(host))]
+        except ValueError:
+            pass
+
+        host = host.lower()
+        entry = self.cache.get(host)
+        if entry and entry[0] > time.monotonic():
+            self.stats["cache_hits"] += 1
+            return entry[1]
+
+        lookup = self.inflight.get(host)
+        if lookup is None:
+            lookup = self.inflight[host] = asyncio.ensure_future(self._resolve(host))
+        else:
+            self.stats["coalesced"] += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(lookup), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            return []
+
+    async def _resolve(self, host):
+        try:
+            addresses = await self._lookup(host)
+            ttl = self.ttl if addresses else self.negative_ttl
+            self.cache[host] = (time.monotonic() + ttl, addresses)
+            return addresses
+        finally:
+            del self.inflight[host]
+
+    async def _lookup(self, host):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+
+        async with self.semaphore:
+            self.stats["lookups"] += 1
+            try:
+                infos = await asyncio.wait_for(
+                    asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM),
+                    timeout=DNS_TIMEOUT
+                )
+            except (OSError, asyncio.TimeoutError, ValueError):
+                self.stats["failures"] += 1
+                return []
+
+        by_family = {socket.AF_INET6: [], socket.AF_INET: []}
+        for family, _, _, _, sockaddr in infos:
+            if family in by_family and sockaddr[0] not in by_family[family]:
+                by_family[family].append(sockaddr[0])
+
+        # Interleave families so one broken stack cannot stall every attempt
+        addresses = []
+        v6, v4 = by_family[socket.AF_INET6], by_family[socket.AF_INET]
+        for i in range(max(len(v6), len(v4))):
+            addresses.extend(v6[i:i + 1])
+            addresses.extend(v4[i:i + 1])
+        return addresses
+
+async def open_connection(addresses, port, delay=HAPPY_EYEBALLS_DELAY):
+    """
+    Happy-Eyeballs connect: starts an attempt on the next address every `delay`
+    seconds (or as soon as one fails) and returns the first (reader, writer) to
+    succeed. Losing attempts are cancelled. Raises OSError if all fail.
+    """
+    remaining = list(addresses)
+    pending = set()
+    last_error = None
+
+    try:
+        while remaining or pending:
+            if remaining:
+                pending.add(asyncio.create_task(asyncio.open_connection(remaining.pop(0), port)))
+
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=delay if remaining else None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+
+            winner = None
+            for task in done:
+                if task.exception() is not None:
+                    last_error = task.exception()
+                elif winner is None:
+                    winner = task.result()
+                else:
+                    task.result()[1].close()
+            if winner:
+                return winner
+
+        raise last_error or OSError(f"No addresses to connect to on port {port}")
+    finally:
+        for task in pending:
+            task.cancel()
+            task.add_done_callback(_close_if_connected)
+
+def _close_if_connected(task):
+    """Closes the connection of an attempt that won a race with its own cancellation."""
+    if not task.cancelled() and task.exception() is None:
+        task.result()[1].close()
+
+default_resolver = Resolver()
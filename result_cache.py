@@ -0,0 +1,91 @@
+import json
+import os
+import time
+
+# --- CONFIGURATION ---
+CACHE_FILE = "test_cache.json"
+PASS_TTL = 6 * 3600  # Seconds a passing result is reused before re-verifying
+FAIL_TTL = 3600  # Base seconds a failure is trusted; doubles with every consecutive failure
+MAX_FAIL_TTL = 7 * 24 * 3600  # Upper bound for the failure backoff
+MAX_ENTRY_AGE = 30 * 24 * 3600  # Entries untouched for this long are dropped on save
+SERVER_ERRORS = ("TCP_Failed", "Timeout", "ConnectionError")  # Failures that are about the server (as are HTTP_<status>)
+
+def is_server_error(error):
+    """
+    True for failures that say something about the server. The rest (XrayStartFailed,
+    XrayStartTimeout, XrayCrash, RequestError) come from the tester's own core or
+    client and are not worth remembering.
+    """
+    return error in SERVER_ERRORS or (error or "").startswith("HTTP_")
+
+class ResultCache:
+    """
+    On-disk cache of test outcomes keyed by get_config_hash().
+    Each entry holds the last outcome, delay, error, timestamp and the
+    number of consecutive failures used for exponential retest backoff,
+    plus the latency summary of multi-sample tests.
+    """
+
+    def __init__(self, path=CACHE_FILE, pass_ttl=PASS_TTL, fail_ttl=FAIL_TTL, max_fail_ttl=MAX_FAIL_TTL):
+        self.path = path
+        self.pass_ttl = pass_ttl
+        self.fail_ttl = fail_ttl
+        self.max_fail_ttl = max_fail_ttl
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable result cache {path}: {e}")
+
+    def ttl(self, entry):
+        """Seconds an entry stays fresh: fixed for passes, backed off for repeated failures."""
+        if entry["ok"]:
+            return self.pass_ttl
+        return min(self.fail_ttl * 2 ** (entry["fails"] - 1), self.max_fail_ttl)
+
+    def lookup(self, config_hash, now=None):
+        """Returns the cached entry if it is still fresh, otherwise None."""
+        entry = self.entries.get(config_hash)
+        now = now if now is not None else time.time()
+
+        if entry and now - entry["ts"] < self.ttl(entry):
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def record(self, config_hash, success, delay, error, now=None, latency=None):
+        """Stores an outcome. Failures the tester caused itself are skipped, so they neither stick nor back off."""
+        if not success and not is_server_error(error):
+            return
+        previous = self.entries.get(config_hash)
+        fails = 0 if success else (previous["fails"] + 1 if previous else 1)
+
+        self.entries[config_hash] = {
+            "ok": success,
+            "delay": delay,
+            "error": error,
+            "ts": now if now is not None else time.time(),
+            "fails": fails
+        }
+        if latency:
+            self.entries[config_hash]["latency"] = latency
+
+    def save(self):
+        cutoff = time.time() - MAX_ENTRY_AGE
+        self.entries = {h: e for h, e in self.entries.items() if e["ts"] >= cutoff}
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Write to a temp file first so an interrupted run never corrupts the cache
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,291 @@
+"""
+SQLite store of test results across runs.
+
+Testers open a run, add every fresh outcome (cached outcomes are not new
+measurements and are skipped) and the rows are written in batched
+transactions. The CLI ranks configs straight from the indexes, streaming
+rows instead of loading whole runs:
+
+    python results_store.py top [--protocol vless] [--port 443] [--since 7d] [--limit 50] [--format txt|json|csv]
+    python results_store.py runs
+    python results_store.py import local_results/*/detailed_results.json
+"""
+
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+
+# --- CONFIGURATION ---
+RESULTS_DB = "results.db"
+BATCH_SIZE = 200  # Results buffered before they are written in one transaction
+RETENTION_DAYS = 30  # Results older than this are pruned when a run finishes (scheduler reads HISTORY_DAYS=14)
+PROTOCOLS = ("vmess", "vless", "trojan", "shadowsocks")  # As stored in the protocol column
+PROTOCOL_ALIASES = {"ss": "shadowsocks"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    tester TEXT NOT NULL,
+    shard TEXT,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    stats TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    tested_at REAL NOT NULL,
+    hash TEXT NOT NULL,
+    protocol TEXT,
+    host TEXT,
+    port INTEGER,
+    ok INTEGER NOT NULL,
+    delay_ms INTEGER,
+    p90_ms INTEGER,
+    jitter_ms REAL,
+    handshake_ms INTEGER,
+    error TEXT,
+    uri TEXT
+);
+CREATE INDEX IF NOT EXISTS results_hash ON results(hash, tested_at);
+CREATE INDEX IF NOT EXISTS results_protocol ON results(protocol, port, delay_ms);
+CREATE INDEX IF NOT EXISTS results_port ON results(port, delay_ms);
+CREATE INDEX IF NOT EXISTS results_delay ON results(delay_ms);
+CREATE INDEX IF NOT EXISTS results_tested_at ON results(tested_at);
+"""
+
+class ResultsStore:
+    """
+    Appends test outcomes to an SQLite database, one `runs` row per tester run.
+    add() only buffers; rows are written every `batch_size` results and on finish_run(),
+    which also prunes results older than `retention_days`.
+    """
+
+    def __init__(self, path=RESULTS_DB, batch_size=BATCH_SIZE, retention_days=RETENTION_DAYS):
+        self.path = path
+        self.batch_size = batch_size
+        self.retention_days = retention_days
+        self.pending = []
+        self.run_id = None
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def start_run(self, tester, shard=None, started_at=None):
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO runs (tester, shard, started_at) VALUES (?, ?, ?)",
+                (tester, f"{shard[0]}/{shard[1]}" if shard else None, started_at or time.time())
+            )
+        self.run_id = cursor.lastrowid
+        return self.run_id
+
+    def add(self, config_hash, config, success, delay, error, latency=None, tested_at=None):
+        latency = latency or {}
+        self.pending.append((
+            self.run_id, tested_at or time.time(), config_hash,
+            config.get("protocol"), config.get("add"), safe_port(config.get("port")),
+            1 if success else 0, delay if success else None,
+            latency.get("p90_ms"), latency.get("jitter_ms"), latency.get("handshake_ms"),
+            error, config.get("raw_uri")
+        ))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO results (run_id, tested_at, hash, protocol, host, port, ok, delay_ms, "
+                "p90_ms, jitter_ms, handshake_ms, error, uri) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self.pending
+            )
+        self.pending = []
+
+    def finish_run(self, stats=None):
+        self.flush()
+        with self.conn:
+            self.conn.execute("UPDATE runs SET finished_at = ?, stats = ? WHERE id = ?",
+                              (time.time(), json.dumps(dict(stats or {})), self.run_id))
+        self.prune(time.time() - self.retention_days * 86400)
+
+    def prune(self, before):
+        """Deletes results tested before `before`, and the runs left without results."""
+        with self.conn:
+            removed = self.conn.execute("DELETE FROM results WHERE tested_at < ?", (before,)).rowcount
+            self.conn.execute("DELETE FROM runs WHERE started_at < ? AND id NOT IN (SELECT run_id FROM results)",
+                              (before,))
+        return removed
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def top(self, protocol=None, port=None, since=None, rank="latest", limit=None):
+        """
+        Yields passed configs ranked by delay, fastest first.
+        rank="latest" uses each config's most recent result in the window (configs whose
+        latest test failed are left out); rank="average" averages every pass in the window
+        and adds the pass rate.
+        """
+        where, params = ["tested_at >= ?"], [since or 0]
+        if protocol:
+            where.append("protocol = ?")
+            params.append(protocol)
+        if port:
+            where.append("port = ?")
+            params.append(port)
+        condition = " AND ".join(where)
+
+        if rank == "average":
+            sql = (f"SELECT hash, protocol, host, port, ROUND(AVG(CASE WHEN ok THEN delay_ms END)) AS delay_ms, "
+                   f"ROUND(AVG(ok), 2) AS pass_rate, COUNT(*) AS tests, MAX(tested_at) AS tested_at, MAX(uri) AS uri "
+                   f"FROM results WHERE {condition} GROUP BY hash HAVING SUM(ok) > 0 ORDER BY delay_ms")
+        else:
+            sql = (f"SELECT r.* FROM results r JOIN (SELECT hash, MAX(tested_at) AS tested_at FROM results "
+                   f"WHERE {condition} GROUP BY hash) latest USING (hash, tested_at) WHERE r.ok = 1 ORDER BY r.delay_ms")
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        yield from self.conn.execute(sql, params)
+
+    def history(self, since=None):
+        """
+        Yields one row per config tested since `since`: hash, host, port, tests, passes,
+        last_tested, last_ok and last_error (of the latest test) and last_delay (of the latest pass).
+        """
+        # SQLite takes bare columns (ok, error) from the row that holds MAX(tested_at)
+        yield from self.conn.execute(
+            "SELECT hash, host, port, COUNT(*) AS tests, SUM(ok) AS passes, MAX(tested_at) AS last_tested, "
+            "ok AS last_ok, error AS last_error, "
+            "(SELECT delay_ms FROM results AS passed WHERE passed.hash = results.hash AND passed.ok = 1 "
+            "ORDER BY passed.tested_at DESC LIMIT 1) AS last_delay "
+            "FROM results WHERE tested_at >= ? GROUP BY hash", (since or 0,)
+        )
+
+    def runs(self, limit=20):
+        """Yields the most recent runs with their pass counts."""
+        yield from self.conn.execute(
+            "SELECT runs.*, COUNT(results.hash) AS tested, COALESCE(SUM(results.ok), 0) AS passed "
+            "FROM runs LEFT JOIN results ON results.run_id = runs.id "
+            "GROUP BY runs.id ORDER BY runs.id DESC LIMIT ?", (limit,)
+        )
+
+def safe_port(port):
+    try:
+        return int(port)
+    except (TypeError, ValueError):
+        return None
+
+def parse_duration(value):
+    """Turns "7d", "12h", "30m" or plain seconds into seconds."""
+    units = {"d": 86400, "h": 3600, "m": 60, "s": 1}
+    try:
+        if value[-1] in units:
+            seconds = float(value[:-1]) * units[value[-1]]
+        else:
+            seconds = float(value)
+    except (ValueError, IndexError):
+        raise argparse.ArgumentTypeError(f"expected a duration like 7d, 12h or 30m, got {value!r}")
+    if seconds <= 0:
+        raise argparse.ArgumentTypeError(f"duration must be positive, got {value!r}")
+    return seconds
+
+def parse_since(value):
+    """Turns "7d", "12h", "30m" or plain seconds into an absolute cutoff timestamp."""
+    return time.time() - parse_duration(value)
+
+def import_detailed_results(store, path):
+    """Imports a local_test.py detailed_results.json (list of {config, delay_ms, error}) as one run."""
+    from uri_parser import parse_config
+    from v2ray_utils import get_config_hash
+
+    tested_at = os.path.getmtime(path)
+    with open(path, "r") as f:
+        entries = json.load(f)
+
+    store.start_run("import", started_at=tested_at)
+    imported = 0
+    for entry in entries:
+        config = parse_config(entry["config"])
+        if not config:
+            continue
+        store.add(get_config_hash(config), config, entry["delay_ms"] != -1, entry["delay_ms"],
+                  entry.get("error"), entry.get("latency"), tested_at)
+        imported += 1
+    store.finish_run({"total": imported})
+    return imported
+
+def write_rows(rows, fmt, out):
+    """Streams query rows as raw URIs (txt), JSON lines or CSV."""
+    writer = None
+    count = 0
+    for row in rows:
+        if fmt == "txt":
+            out.write(f"{row['uri']}\n")
+        elif fmt == "json":
+            out.write(json.dumps(dict(row)) + "\n")
+        else:
+            if writer is None:
+                writer = csv.DictWriter(out, fieldnames=row.keys())
+                writer.writeheader()
+            writer.writerow(dict(row))
+        count += 1
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the SQLite store of test results.")
+    parser.add_argument("--db", default=RESULTS_DB, help=f"Database file (default {RESULTS_DB})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    top = commands.add_parser("top", help="Rank passed configs by delay")
+    top.add_argument("--protocol", type=lambda value: PROTOCOL_ALIASES.get(value, value), choices=PROTOCOLS,
+                     help="vmess, vless, trojan or shadowsocks (ss)")
+    top.add_argument("--port", type=int)
+    top.add_argument("--since", type=parse_since, help="Only results newer than this, e.g. 7d, 12h")
+    top.add_argument("--rank", choices=("latest", "average"), default="latest",
+                     help="Rank by each config's latest result or by its average over the window")
+    top.add_argument("--limit", type=int)
+    top.add_argument("--format", choices=("txt", "json", "csv"), default="txt",
+                     help="Raw URIs, JSON lines or CSV")
+    top.add_argument("--output", help="Write to this file instead of stdout")
+
+    runs = commands.add_parser("runs", help="List recent runs")
+    runs.add_argument("--limit", type=int, default=20)
+
+    importer = commands.add_parser("import", help="Import local_test.py detailed_results.json files")
+    importer.add_argument("paths", nargs="+")
+
+    args = parser.parse_args()
+    store = ResultsStore(args.db)
+    try:
+        if args.command == "top":
+            rows = store.top(args.protocol, args.port, args.since, args.rank, args.limit)
+            if args.output:
+                with open(args.output, "w", newline="") as f:
+                    count = write_rows(rows, args.format, f)
+                print(f"Saved {count} configs to {args.output}")
+            else:
+                write_rows(rows, args.format, sys.stdout)
+        elif args.command == "runs":
+            for run in store.runs(args.limit):
+                started = time.strftime("%Y-%m-%d %H:%M", time.localtime(run["started_at"]))
+                shard = f" shard {run['shard']}" if run["shard"] else ""
+                print(f"#{run['id']:<5} {started}  {run['tester']}{shard}: {run['passed']}/{run['tested']} passed")
+        else:
+            for path in args.paths:
+                print(f"Imported {import_detailed_results(store, path)} results from {path}")
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
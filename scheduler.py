@@ -0,0 +1,152 @@
+"""
+History-driven test order for tester.py.
+
+Every config is scored from what earlier runs learned about it: its pass
+rate and last delay (results store, else the previous detailed results),
+the yield of the sources that list it (config_sources.json from the
+aggregator) and whether its host:port answered recently. Configs are then
+popped from a priority heap, best first, while at least EXPLORATION_SHARE
+of the picks go to configs with no history, so new servers are not starved.
+"""
+
+import heapq
+import json
+import os
+import time
+
+from results_store import ResultsStore
+
+# --- CONFIGURATION ---
+HISTORY_DAYS = 14  # Results older than this are ignored
+EXPLORATION_SHARE = float(os.environ.get("EXPLORATION_SHARE", "0.2"))  # Share of picks given to never-tested configs
+DELAY_CEILING_MS = 3000  # Delays at or above this earn no delay score
+# Score weights; every component is in 0..1
+PASS_RATE_WEIGHT = 0.4
+DELAY_WEIGHT = 0.2
+SOURCE_YIELD_WEIGHT = 0.2
+ENDPOINT_WEIGHT = 0.2
+UNKNOWN = 0.5  # Component value when there is nothing to go on
+
+class History:
+    """Per-config outcomes and per-endpoint liveness from earlier runs."""
+
+    def __init__(self):
+        self.configs = {}  # hash -> {"tests", "passes", "last_delay"}
+        self.endpoints = {}  # (host, port) -> (last tested, reachable)
+
+    def __len__(self):
+        return len(self.configs)
+
+    def add(self, config_hash, host, port, tests, passes, last_delay, tested_at, reachable):
+        self.configs[config_hash] = {"tests": tests, "passes": passes, "last_delay": last_delay}
+        endpoint = (str(host).lower(), port)
+        previous = self.endpoints.get(endpoint)
+        # The most recent test of any config behind the endpoint decides whether it is alive
+        if previous is None or tested_at >= previous[0]:
+            self.endpoints[endpoint] = (tested_at, reachable)
+
+    def load_store(self, path, since):
+        """Reads per-config history from a results_store database."""
+        store = ResultsStore(path)
+        try:
+            for row in store.history(since):
+                self.add(row["hash"], row["host"], row["port"], row["tests"], row["passes"] or 0,
+                         row["last_delay"], row["last_tested"], row["last_error"] != "TCP_Failed")
+        finally:
+            store.close()
+
+    def load_detailed(self, path):
+        """Adds configs from a previous tester detailed results file (passed configs only) not already known."""
+        tested_at = os.path.getmtime(path)
+        with open(path, "r") as f:
+            report = json.load(f)
+        for entry in report.get("results", []):
+            if entry["hash"] not in self.configs:
+                config = entry["config"]
+                self.add(entry["hash"], config.get("add"), config.get("port"), 1, 1, entry["delay_ms"], tested_at, True)
+
+    def endpoint_alive(self, host, port):
+        state = self.endpoints.get((str(host).lower(), port))
+        return None if state is None else state[1]
+
+def source_yields(source_map, history):
+    """Smoothed pass rate of every source over its configs with history: source index -> 0..1."""
+    tested = {}
+    passed = {}
+    for config_hash, sources in source_map.get("configs", {}).items():
+        entry = history.configs.get(config_hash)
+        if entry is None:
+            continue
+        for source in sources:
+            tested[source] = tested.get(source, 0) + 1
+            passed[source] = passed.get(source, 0) + (1 if entry["passes"] else 0)
+    return {source: (passed[source] + 1) / (tested[source] + 2) for source in tested}
+
+class Scheduler:
+    """Orders configs by score with priority heaps, reserving EXPLORATION_SHARE of picks for configs without history."""
+
+    def __init__(self, history, source_map=None, exploration_share=EXPLORATION_SHARE):
+        self.history = history
+        self.source_map = (source_map or {}).get("configs", {})
+        self.yields = source_yields(source_map or {}, history)
+        self.exploration_share = exploration_share
+        self.picked = {"known": 0, "explored": 0}
+
+    @classmethod
+    def from_files(cls, store_path=None, detailed_path=None, source_map_path=None, history_days=HISTORY_DAYS):
+        history = History()
+        if store_path and os.path.exists(store_path):
+            history.load_store(store_path, time.time() - history_days * 86400)
+        if detailed_path and os.path.exists(detailed_path):
+            history.load_detailed(detailed_path)
+        source_map = None
+        if source_map_path and os.path.exists(source_map_path):
+            with open(source_map_path, "r") as f:
+                source_map = json.load(f)
+        return cls(history, source_map)
+
+    def score(self, config_hash, config):
+        entry = self.history.configs.get(config_hash)
+        if entry:
+            pass_rate = (entry["passes"] + 1) / (entry["tests"] + 2)
+            delay = entry["last_delay"]
+            delay_score = 1 - min(delay, DELAY_CEILING_MS) / DELAY_CEILING_MS if delay is not None and delay >= 0 else 0.0
+        else:
+            pass_rate = delay_score = UNKNOWN
+
+        yields = [self.yields[source] for source in self.source_map.get(config_hash, ()) if source in self.yields]
+        source_yield = max(yields) if yields else UNKNOWN
+
+        try:
+            alive = self.history.endpoint_alive(config.get("add"), int(config.get("port")))
+        except (TypeError, ValueError):
+            alive = False
+        endpoint = UNKNOWN if alive is None else float(alive)
+
+        return (PASS_RATE_WEIGHT * pass_rate + DELAY_WEIGHT * delay_score
+                + SOURCE_YIELD_WEIGHT * source_yield + ENDPOINT_WEIGHT * endpoint)
+
+    def order(self, configs, hashes):
+        """Returns `configs` in test order; `hashes` holds get_config_hash() of each."""
+        known, unexplored = [], []
+        for index, (config, config_hash) in enumerate(zip(configs, hashes)):
+            heap = known if config_hash in self.history.configs else unexplored
+            # The index breaks ties in file order and keeps configs themselves out of comparisons
+            heap.append((-self.score(config_hash, config), index, config))
+        heapq.heapify(known)
+        heapq.heapify(unexplored)
+
+        ordered = []
+        while known or unexplored:
+            # Unexplored configs get at least their share of picks, and any pick where they simply score higher
+            owed = self.picked["explored"] < self.exploration_share * len(ordered)
+            explore = bool(unexplored) and (not known or owed or unexplored[0][0] < known[0][0])
+            heap = unexplored if explore else known
+            ordered.append(heapq.heappop(heap)[2])
+            self.picked["explored" if explore else "known"] += 1
+        return ordered
+
+    def summary(self):
+        return (f"Scheduler: {len(self.history)} configs with history, {len(self.yields)} sources scored, "
+                f"{self.picked['known']} known + {self.picked['explored']} unexplored configs queued "
+                f"({self.exploration_share:.0%} exploration share)")
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+from config_records import config_from_dict, to_json
+
+# --- CONFIGURATION ---
+SOURCE_CACHE_DIR = ".source_cache"
+INDEX_FILE = "index.json"
+
+class SourceCache:
+    """
+    Local cache of subscription sources for conditional HTTP fetching.
+    For every URL it keeps the ETag / Last-Modified validators, the raw body
+    and the configs parsed from it (one JSON object per line), so a 304
+    response skips download and parsing.
+    """
+
+    def __init__(self, directory=SOURCE_CACHE_DIR):
+        self.directory = directory
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.index = {}
+
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r") as f:
+                    self.index = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable source cache index: {e}")
+
+    def _path(self, url, suffix):
+        key = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.directory, f"{key}.{suffix}")
+
+    def conditional_headers(self, url):
+        """Returns If-None-Match / If-Modified-Since headers for a cached URL."""
+        entry = self.index.get(url)
+        if not entry or not os.path.exists(self._path(url, "configs.jsonl")):
+            return {}
+
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def has_configs(self, url):
+        return url in self.index and os.path.exists(self._path(url, "configs.jsonl"))
+
+    def iter_configs(self, url):
+        """Yields the configs parsed from the cached body, one per line of the cache file."""
+        with open(self._path(url, "configs.jsonl"), "r") as f:
+            for line in f:
+                yield config_from_dict(json.loads(line))
+
+    def writer(self, url):
+        """Returns a SourceCacheWriter that stores a body and its configs as they stream in."""
+        return SourceCacheWriter(self, url)
+
+    def _commit(self, url, etag, last_modified):
+        self.index[url] = {"etag": etag, "last_modified": last_modified}
+
+    def save(self):
+        with open(self.index_path, "w") as f:
+            json.dump(self.index, f, indent=2)
+
+class SourceCacheWriter:
+    """
+    Streams one source body and its parsed configs to temp files, so a
+    source never has to be held in memory whole. Nothing replaces the
+    previous cache entry until commit() is called.
+    """
+
+    def __init__(self, cache, url):
+        self.cache = cache
+        self.url = url
+        self.body_path = cache._path(url, "body")
+        self.configs_path = cache._path(url, "configs.jsonl")
+        self.body_file = open(f"{self.body_path}.tmp", "w", encoding="utf-8")
+        self.configs_file = open(f"{self.configs_path}.tmp", "w")
+
+    def write_body(self, text):
+        self.body_file.write(text)
+
+    def add_config(self, config):
+        self.configs_file.write(json.dumps(config, separators=(",", ":"), default=to_json))
+        self.configs_file.write("\n")
+
+    def commit(self, etag, last_modified):
+        self.close()
+        os.replace(f"{self.body_path}.tmp", self.body_path)
+        os.replace(f"{self.configs_path}.tmp", self.configs_path)
+        self.cache._commit(self.url, etag, last_modified)
+
+    def discard(self):
+        self.close()
+        for path in (f"{self.body_path}.tmp", f"{self.configs_path}.tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def close(self):
+        if not self.body_file.closed:
+            self.body_file.close()
+            self.configs_file.close()
@@ -0,0 +1,171 @@
+"""
+Per-source fetch history for aggregator.py, kept across runs in SOURCE_STATS_FILE.
+
+For every source URL it remembers what fetching cost (seconds, bytes, lines),
+what the source yielded (configs, distinct configs, configs no earlier source
+in sources.txt listed) and, joined from the results store through
+config_sources.json, the pass rate of its configs. From that history each
+source gets:
+
+    timeout    a multiple of its usual fetch time, within MIN/MAX_TIMEOUT
+    priority   sources yielding unique, passing configs are fetched first
+    due        a source that keeps failing, being slow or adding only duplicates
+               or dead servers (BAD_RUNS_BEFORE_STRIKE runs in a row) is refetched
+               after a growing interval; in between its configs are replayed from
+               the source cache
+"""
+
+import json
+import os
+import time
+
+from scheduler import History, source_yields, HISTORY_DAYS
+
+# --- CONFIGURATION ---
+SOURCE_STATS_FILE = "source_stats.json"
+SMOOTHING = 0.3  # Weight of the latest fetch in the running fetch time
+TIMEOUT_FACTOR = 3  # Timeout = this many times the usual fetch time...
+MIN_TIMEOUT = 10  # ...but never below this many seconds
+MAX_TIMEOUT = 60  # ...or above this many
+SLOW_FETCH_SECONDS = 20  # Fetches taking longer count against the source
+LOW_PASS_RATE = 0.05  # Smoothed pass rates below this count against the source
+BAD_RUNS_BEFORE_STRIKE = 3  # Consecutive bad runs before a source is refetched less often
+# Seconds from the start of the run a struck source sits out, doubled per further bad run. With the
+# 12h workflow schedule that skips one run; measured from the start so the next due run is not missed
+REFETCH_INTERVAL = 24 * 3600
+MAX_REFETCH_INTERVAL = 4 * 86400
+
+class SourceStats:
+    """Fetch and yield statistics of every source, loaded from and saved to a JSON file keyed by URL."""
+
+    def __init__(self, path=SOURCE_STATS_FILE):
+        self.path = path
+        self.sources = {}
+        self.fetched = []  # URLs fetched (not replayed) this run
+        self.started = time.time()
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self.sources = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable source stats: {e}")
+
+    def entry(self, url):
+        return self.sources.setdefault(url, {"runs": 0, "bad_runs": 0, "strikes": 0, "next_fetch": 0})
+
+    def timeout(self, url, default):
+        """Seconds allowed to fetch `url`: TIMEOUT_FACTOR times its usual fetch time, or `default` without history."""
+        seconds = self.sources.get(url, {}).get("seconds")
+        if seconds is None:
+            return default
+        return min(MAX_TIMEOUT, max(MIN_TIMEOUT, TIMEOUT_FACTOR * seconds))
+
+    def priority(self, url):
+        """0..1, higher for sources that add configs no earlier source lists and whose configs pass."""
+        entry = self.sources.get(url)
+        if not entry or not entry.get("distinct"):
+            return 0.5
+        unique_share = entry.get("unique", 0) / entry["distinct"]
+        pass_rate = entry.get("pass_rate")
+        return (unique_share + (0.5 if pass_rate is None else pass_rate)) / 2 / (1 + entry.get("strikes", 0))
+
+    def order(self, urls):
+        """Indexes of `urls`, highest priority first (ties keep file order)."""
+        return sorted(range(len(urls)), key=lambda index: -self.priority(urls[index]))
+
+    def due(self, url, now=None):
+        return (now or time.time()) >= self.sources.get(url, {}).get("next_fetch", 0)
+
+    def record_fetch(self, url, report, now=None):
+        """Records one fetch_source() report: status, seconds, bytes, lines and configs."""
+        entry = self.entry(url)
+        self.fetched.append(url)
+        entry["runs"] += 1
+        entry["fetched_at"] = now or time.time()
+        entry["status"] = report.get("status")
+        for key in ("bytes", "lines", "configs"):
+            if key in report:
+                entry[key] = report[key]
+        if "seconds" in report:
+            seconds = report["seconds"]
+            entry["last_seconds"] = round(seconds, 2)
+            # Only full downloads (or timeouts) say how long the body takes; a 304 or an error is no guide
+            if entry["status"] in ("ok", "timeout"):
+                previous = entry.get("seconds")
+                entry["seconds"] = round(seconds if previous is None else SMOOTHING * seconds + (1 - SMOOTHING) * previous, 2)
+
+    def record_yield(self, source_map):
+        """
+        Counts distinct configs per source and the unique ones it contributed, from the
+        aggregator's source map. Like the dedup, a config shared by several sources is
+        credited to the first of them, so of two mirrors only the later one adds nothing.
+        """
+        distinct = {}
+        unique = {}
+        for sources in source_map["configs"].values():
+            for source in sources:
+                distinct[source] = distinct.get(source, 0) + 1
+            first = min(sources)
+            unique[first] = unique.get(first, 0) + 1
+        for index, url in enumerate(source_map["sources"]):
+            if url in self.sources or distinct.get(index):
+                entry = self.entry(url)
+                entry["distinct"] = distinct.get(index, 0)
+                entry["unique"] = unique.get(index, 0)
+
+    def join_results(self, source_map_path, store_path):
+        """
+        Sets each source's smoothed pass rate from the results store, through the source
+        map written by the previous aggregator run (the one the tester then tested).
+        """
+        if not (os.path.exists(source_map_path) and os.path.exists(store_path)):
+            return
+        with open(source_map_path, "r") as f:
+            source_map = json.load(f)
+        history = History()
+        history.load_store(store_path, time.time() - HISTORY_DAYS * 86400)
+        urls = source_map.get("sources", [])
+        for index, rate in source_yields(source_map, history).items():
+            if index < len(urls):
+                self.entry(urls[index])["pass_rate"] = round(rate, 3)
+
+    def low_yield(self, url):
+        entry = self.sources.get(url, {})
+        return (entry.get("status") not in ("ok", "not_modified")
+                or (entry.get("last_seconds") or 0) > SLOW_FETCH_SECONDS
+                or entry.get("distinct") is not None and entry.get("unique", 0) == 0
+                or entry.get("pass_rate") is not None and entry["pass_rate"] < LOW_PASS_RATE)
+
+    def schedule(self, now=None):
+        """
+        After a run, gives each fetched source that was low-yield BAD_RUNS_BEFORE_STRIKE runs
+        in a row a strike and a doubled refetch interval; a good run resets both.
+        """
+        now = now or self.started
+        for url in self.fetched:
+            entry = self.entry(url)
+            if not self.low_yield(url):
+                entry["bad_runs"] = 0
+                entry["strikes"] = 0
+                entry["next_fetch"] = 0
+                continue
+            entry["bad_runs"] = entry.get("bad_runs", 0) + 1
+            if entry["bad_runs"] >= BAD_RUNS_BEFORE_STRIKE:
+                entry["strikes"] += 1
+                entry["next_fetch"] = now + min(MAX_REFETCH_INTERVAL, REFETCH_INTERVAL * 2 ** (entry["strikes"] - 1))
+
+    def save(self):
+        with open(f"{self.path}.tmp", "w") as f:
+            json.dump(self.sources, f, indent=2, sort_keys=True)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def print_summary(self, urls):
+        print("Sources (unique / distinct configs, pass rate, fetch time, next fetch):")
+        for url in urls:
+            entry = self.sources.get(url, {})
+            pass_rate = entry.get("pass_rate")
+            wait = entry.get("next_fetch", 0) - time.time()
+            print(f"  {entry.get('unique', '?')}/{entry.get('distinct', '?')}, "
+                  f"{'?' if pass_rate is None else f'{pass_rate:.0%}'}, "
+                  f"{entry.get('last_seconds', '?')}s ({entry.get('status', 'never fetched')}), "
+                  f"{f'in {wait / 3600:.0f}h' if wait > 0 else 'next run'}: {url}")
@@ -0,0 +1,51 @@
+import difflib
+import json
+import os
+
+# --- CONFIGURATION ---
+STABLE_OUTPUT = os.environ.get("STABLE_OUTPUT", "1") != "0"  # "0" restores the indented, source-ordered legacy output
+DELAY_TIER_MS = 100  # Passed configs are ranked by delay tier, then by hash, so jitter inside a tier does not reorder lines
+
+def json_lines_array(records, default=None):
+    """
+    Serializes records as a JSON array with one compact record per line, so a
+    changed record is a one-line diff and the file still loads with json.load().
+    """
+    if not records:
+        return "[]\n"
+    lines = [json.dumps(record, separators=(",", ":"), ensure_ascii=False, default=default) for record in records]
+    return "[\n" + ",\n".join(lines) + "\n]\n"
+
+def line_churn(old_content, new_content):
+    """Lines added and removed between two versions of a file, as a line diff (moves count) would show."""
+    matcher = difflib.SequenceMatcher(None, old_content.splitlines(), new_content.splitlines(), autojunk=False)
+    added = removed = 0
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag != "equal":
+            added += new_end - new_start
+            removed += old_end - old_start
+    return added, removed
+
+def write_if_changed(path, content):
+    """
+    Writes `content` to `path` unless the file already holds exactly that, and prints
+    the size and line churn against the previous version. Returns True if written.
+    """
+    old_content = ""
+    exists = os.path.exists(path)
+    if exists:
+        with open(path, "r", encoding="utf-8") as f:
+            old_content = f.read()
+
+    added, removed = line_churn(old_content, content)
+    changed = content != old_content or not exists
+    print(f"Churn {path}: {len(old_content.encode()) / 1024:.1f} KB -> {len(content.encode()) / 1024:.1f} KB, "
+          f"+{added} -{removed} lines ({'rewritten' if changed else 'unchanged, not rewritten'})")
+
+    if changed:
+        # Temp file + rename, so a failed run never leaves a truncated output behind
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    return changed
@@ -1,64 +1,87 @@
+import argparse
 import asyncio
 import json
 import os
-import zipfile
 import subprocess
-import shutil
 import aiohttp
 import sys
+import time
 from collections import Counter
-from v2ray_utils import test_connection, decode_base64, test_tcp_connection
+from v2ray_utils import test_connection, decode_base64, tcp_precheck, summarize_ready_times, summarize_precheck, get_config_hash, PROBE_SAMPLES, PROXY_BACKEND
+from result_cache import ResultCache
+from results_store import ResultsStore, RESULTS_DB, parse_duration
+from concurrency import AdaptiveLimiter, CONCURRENCY_FLOOR, CONCURRENCY_CEILING
+from config_records import config_from_dict, to_json
+from metrics import default_metrics, suffixed
+from stable_output import STABLE_OUTPUT, DELAY_TIER_MS, write_if_changed
+from backends import setup_backend
+from scheduler import Scheduler
+from aggregator import SOURCE_MAP_FILE
 
 # --- CONFIGURATION ---
-XRAY_BIN_DIR = "bin"
-XRAY_BIN = os.path.join(XRAY_BIN_DIR, "xray")
-XRAY_ZIP = "xray.zip"
-XRAY_DOWNLOAD_URL = "https://github.com/XTLS/Xray-core/releases/download/v1.8.4/Xray-linux-64.zip"
-
 INPUT_FILE = "unique_configs.json"
 OUTPUT_FILE = "real_delay_passed.txt"
-CONCURRENCY = 80
+DETAILED_FILE = "detailed_results.json"  # Passed configs with hash and latency, plus the run's stats
+CONCURRENCY = 80  # Initial limit, adapted between CONCURRENCY_FLOOR and CONCURRENCY_CEILING
 PORT_START = 10000
+CACHE_FILE = "test_cache.json"
+SORT_BY = os.environ.get("SORT_BY", "median")  # "median" or "p90" latency when ranking passed configs
+BUDGET_CHECK_INTERVAL = 0.5  # Seconds between checks of the --deadline / --target-passed budget
 
-async def download_xray():
-    """Downloads and extracts Xray core if not present."""
-    if os.path.exists(XRAY_BIN):
-        print(f"Xray binary found at {XRAY_BIN}")
-        return
+class RunBudget:
+    """
+    Ends a run early at a wall-clock deadline (seconds from start()) or once
+    `target_passed` configs passed. Workers stop taking configs as soon as it is
+    exhausted, and wait() cancels the tests still in flight.
+    """
 
-    print("Downloading Xray Core...")
-    os.makedirs(XRAY_BIN_DIR, exist_ok=True)
+    def __init__(self, deadline=None, target_passed=None):
+        self.deadline = deadline
+        self.target_passed = target_passed
+        self.reason = None
+        self._deadline_at = None
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(XRAY_DOWNLOAD_URL) as response:
-            if response.status == 200:
-                with open(XRAY_ZIP, "wb") as f:
-                    f.write(await response.read())
-            else:
-                print(f"Failed to download Xray: {response.status}")
-                return
+    def start(self):
+        if self.deadline:
+            self._deadline_at = time.monotonic() + self.deadline
 
-    print("Extracting Xray...")
-    try:
-        with zipfile.ZipFile(XRAY_ZIP, "r") as zip_ref:
-            zip_ref.extractall(XRAY_BIN_DIR)
-
-        # Ensure executable permission
-        os.chmod(XRAY_BIN, 0o755)
-        print("Xray installed successfully.")
-    except Exception as e:
-        print(f"Error extracting Xray: {e}")
-    finally:
-        if os.path.exists(XRAY_ZIP):
-            os.remove(XRAY_ZIP)
-
-async def worker(queue, results, stats, port_offset, session):
+    def exhausted(self, stats):
+        if self.reason is None:
+            if self.target_passed and stats["passed"] >= self.target_passed:
+                self.reason = f"target of {self.target_passed} passed configs reached"
+            elif self._deadline_at is not None and time.monotonic() >= self._deadline_at:
+                self.reason = f"deadline of {self.deadline:g}s reached"
+        return self.reason is not None
+
+    async def wait(self, tasks, stats):
+        """Waits for the worker tasks; once the budget is exhausted, cancels those still testing."""
+        pending = set(tasks)
+        while pending:
+            _, pending = await asyncio.wait(pending, timeout=BUDGET_CHECK_INTERVAL)
+            if pending and self.exhausted(stats):
+                print(f"Stopping early: {self.reason}. Cancelling {len(pending)} busy workers...")
+                for task in pending:
+                    task.cancel()
+                # Cancelled tests stop their Xray processes on the way out
+                await asyncio.gather(*pending, return_exceptions=True)
+                break
+        for task in tasks:
+            if not task.cancelled():
+                task.result()
+
+async def worker(queue, results, stats, port_offset, session, cache=None, limiter=None, store=None, budget=None):
     """
     Worker to process configs from the queue.
+    Fresh outcomes from the result cache are reused instead of retesting,
+    and Xray tests only run while the limiter grants a slot.
+    Fresh outcomes are also added to the results store, if given.
+    Stops taking configs once the budget, if given, is exhausted.
     """
     local_port = PORT_START + port_offset
 
     while True:
+        if budget and budget.exhausted(stats):
+            break
         try:
             config = queue.get_nowait()
         except asyncio.QueueEmpty:
@@ -81,17 +104,43 @@ async def worker(queue, results, stats, port_offset, session):
              queue.task_done()
              continue
 
-        if not await test_tcp_connection(host, port, timeout=1.5):
+        config_hash = get_config_hash(config)
+        cached = cache.lookup(config_hash) if cache else None
+        if cached:
+            if cached["ok"]:
+                results.append((config, cached["delay"], cached.get("latency")))
+                stats["passed"] += 1
+            else:
+                stats[cached["error"]] += 1
+            stats["total"] += 1
+            queue.task_done()
+            continue
+
+        if not await tcp_precheck(host, port, timeout=1.5):
+            if cache:
+                cache.record(config_hash, False, -1, "TCP_Failed")
+            if store:
+                store.add(config_hash, config, False, -1, "TCP_Failed")
             stats['TCP_Failed'] += 1
             stats["total"] += 1
             queue.task_done()
             continue
 
         # 2. Real Delay Test (Xray)
-        success, delay, error = await test_connection(config, local_port, session=session)
+        latency = {}
+        if limiter:
+            async with limiter:
+                success, delay, error = await test_connection(config, local_port, session, PROBE_SAMPLES, latency)
+            limiter.record(error)
+        else:
+            success, delay, error = await test_connection(config, local_port, session, PROBE_SAMPLES, latency)
+        if cache:
+            cache.record(config_hash, success, delay, error, latency=latency)
+        if store:
+            store.add(config_hash, config, success, delay, error, latency)
 
         if success:
-            results.append((config, delay))
+            results.append((config, delay, latency))
             stats["passed"] += 1
         else:
             stats[error] += 1
@@ -102,22 +151,69 @@ async def worker(queue, results, stats, port_offset, session):
 
         queue.task_done()
 
-async def main():
+def parse_shard(value):
+    """Parses "i/N" into (i, N), 0 <= i < N."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {value!r}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be in 0..N-1, got {value!r}")
+    return index, count
+
+def in_shard(config_hash, shard):
+    """True if the config belongs to shard (i, N); the split depends only on the config hash."""
+    index, count = shard
+    return int(config_hash, 16) % count == index
+
+def shard_suffix(shard):
+    return f".shard-{shard[0]}-of-{shard[1]}" if shard else ""
+
+def parse_count(value):
+    try:
+        count = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a positive integer, got {value!r}")
+    if count < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive integer, got {value!r}")
+    return count
+
+async def main(shard=None, deadline=None, target_passed=None):
+    # The deadline covers the whole run, setup included
+    budget = RunBudget(deadline, target_passed)
+    budget.start()
+
     # 1. Setup Environment
-    await download_xray()
+    if not await setup_backend():
+        raise SystemExit(1)  # Fail the job rather than publish results from no test at all
 
     if not os.path.exists(INPUT_FILE):
         print(f"{INPUT_FILE} not found. Run aggregator.py first.")
         return
 
     with open(INPUT_FILE, "r") as f:
-        configs = json.load(f)
+        configs = [config_from_dict(config) for config in json.load(f)]
+
+    hashes = [get_config_hash(config) for config in configs]
+    if shard:
+        total = len(configs)
+        selected = [(config, config_hash) for config, config_hash in zip(configs, hashes) if in_shard(config_hash, shard)]
+        configs = [config for config, _ in selected]
+        hashes = [config_hash for _, config_hash in selected]
+        print(f"Shard {shard[0]}/{shard[1]}: {len(configs)} of {total} configs")
 
     if not configs:
         print("No configs to test.")
         return
 
-    print(f"Starting tests for {len(configs)} configs with concurrency {CONCURRENCY}...")
+    # Likely winners first, from earlier runs of this shard (or of the single run)
+    suffix = shard_suffix(shard)
+    scheduler = Scheduler.from_files(suffixed(RESULTS_DB, suffix), suffixed(DETAILED_FILE, suffix), SOURCE_MAP_FILE)
+    configs = scheduler.order(configs, hashes)
+    print(scheduler.summary())
+
+    print(f"Starting {PROXY_BACKEND} tests for {len(configs)} configs with concurrency {CONCURRENCY} "
+          f"(adaptive {CONCURRENCY_FLOOR}-{CONCURRENCY_CEILING}), {PROBE_SAMPLES} probe(s) per config...")
 
     # 2. Setup Queue and Workers
     queue = asyncio.Queue()
@@ -126,21 +222,45 @@ async def main():
 
     results = []
     stats = Counter()
+    # A shard always gets the same configs, so it keeps its own cache
+    cache = ResultCache(suffixed(CACHE_FILE, suffix))
+    store = ResultsStore(suffixed(RESULTS_DB, suffix))
+    store.start_run("tester", shard)
+    limiter = AdaptiveLimiter(CONCURRENCY, CONCURRENCY_FLOOR, CONCURRENCY_CEILING)
 
     # Shared session for all workers to reuse connections
     async with aiohttp.ClientSession() as session:
+        # One worker (and port) per possible slot; the limiter decides how many test at once
         tasks = []
-        for i in range(CONCURRENCY):
-            task = asyncio.create_task(worker(queue, results, stats, i, session))
+        for i in range(limiter.ceiling):
+            task = asyncio.create_task(worker(queue, results, stats, i, session, cache, limiter, store, budget))
             tasks.append(task)
 
         # 3. Wait for Completion
-        await asyncio.gather(*tasks)
+        limiter.start()
+        default_metrics.start_sampling({"queue": queue}, limiter)
+        await budget.wait(tasks, stats)
+        await default_metrics.stop_sampling()
+        await limiter.stop()
+
+    # Configs never tested: still queued, or cancelled in flight when the budget ran out
+    skipped = {"queued": queue.qsize(), "cancelled": len(configs) - stats["total"] - stats["InvalidConfig"] - queue.qsize()}
+
+    cache.save()
+    store.finish_run(stats)
+    store.close()
 
     # 4. Summary Report
-    print("\n" + "="*40)
-    print("SUMMARY REPORT")
-    print("="*40)
+    print_summary(stats, cache, limiter)
+    if budget.reason:
+        print_skipped(skipped, len(configs), budget.reason)
+
+    # 5. Save Results
+    save_results(results, suffixed(OUTPUT_FILE, suffix))
+    save_detailed_results(results, stats, suffixed(DETAILED_FILE, suffix), shard, skipped if budget.reason else None)
+    export_metrics(stats, suffix=suffix)
+
+def print_outcomes(stats):
     print(f"Total Configs: {stats['total']}")
     print(f"Passed:        {stats['passed']}")
     print(f"Failed:        {stats['total'] - stats['passed']}")
@@ -149,20 +269,146 @@ async def main():
     for reason, count in stats.items():
         if reason not in ["total", "passed"]:
             print(f"  {reason}: {count}")
+
+def print_skipped(skipped, queued, reason=None):
+    """Prints how much of the queue an early stop left untested."""
+    total = skipped["queued"] + skipped["cancelled"]
+    print(f"Stopped early{f' ({reason})' if reason else ''}: {total} of {queued} configs skipped "
+          f"({total / queued:.1%}), {skipped['cancelled']} of them cancelled in flight")
+
+def print_summary(stats, cache, limiter=None):
+    print("\n" + "="*40)
+    print("SUMMARY REPORT")
+    print("="*40)
+    print_outcomes(stats)
+    print("-" * 20)
+    print(f"Result Cache:  {cache.hits} reused, {cache.misses} probed")
+    precheck = summarize_precheck()
+    print(f"TCP Pre-Check: {precheck.get('endpoints_probed', 0)} endpoints probed, "
+          f"{precheck.get('endpoint_reused', 0)} reused, {precheck.get('dns_lookups', 0)} DNS lookups, "
+          f"{precheck.get('dns_cache_hits', 0)} DNS cache hits")
+    print(f"               {precheck.get('coalesced', 0)} coalesced, "
+          f"{precheck.get('short_circuited', 0)} short-circuited by dead endpoints")
+    if limiter:
+        print(f"Concurrency:   final limit {limiter.limit}, {len(limiter.history)} adjustments")
+    ready_times = summarize_ready_times()
+    if ready_times:
+        print("-" * 20)
+        print(f"Xray Time-to-Ready: median {ready_times['median_ms']}ms, p90 {ready_times['p90_ms']}ms, "
+              f"max {ready_times['max_ms']}ms ({ready_times['count']} spawns)")
+    if default_metrics.phases:
+        print("-" * 20)
+        print("Phase Timings:")
+        default_metrics.print_phases()
     print("="*40)
 
-    # 5. Save Results
-    # Sort by delay (fastest first)
-    results.sort(key=lambda x: x[1])
+def latency_key(delay, latency, sort_by=SORT_BY):
+    """Ranking delay of a passed config: its SORT_BY latency when multi-sampled, else the single delay."""
+    if latency and f"{sort_by}_ms" in latency:
+        return latency[f"{sort_by}_ms"]
+    return delay
 
-    with open(OUTPUT_FILE, "w") as f:
-        for config, delay in results:
-            if "raw_uri" in config:
-                f.write(f"{config['raw_uri']}\n")
-            else:
-                pass
+def save_results(results, path=OUTPUT_FILE, sort_by=SORT_BY):
+    """
+    Writes the raw URIs of passed configs, sorted by delay (fastest first). With
+    STABLE_OUTPUT delays are compared in DELAY_TIER_MS tiers with ties broken by
+    hash, and an unchanged list is not rewritten.
+    """
+    if STABLE_OUTPUT:
+        results.sort(key=lambda x: (latency_key(x[1], x[2], sort_by) // DELAY_TIER_MS, get_config_hash(x[0])))
+        write_if_changed(path, "".join(f"{config['raw_uri']}\n" for config, _, _ in results if "raw_uri" in config))
+    else:
+        results.sort(key=lambda x: latency_key(x[1], x[2], sort_by))
+
+        with open(path, "w") as f:
+            for config, delay, latency in results:
+                if "raw_uri" in config:
+                    f.write(f"{config['raw_uri']}\n")
+                else:
+                    pass
+
+    print(f"Saved {len(results)} passed configs to {path}")
+
+def save_detailed_results(results, stats, path=DETAILED_FILE, shard=None, skipped=None):
+    """
+    Writes passed configs (in save_results() order) with hash, delay and latency, plus
+    the stats and, after an early stop, the skipped counts ({"queued", "cancelled"}).
+    """
+    report = {
+        "shard": list(shard) if shard else None,
+        "stats": dict(stats),
+        "skipped": skipped,
+        "results": [
+            {"hash": get_config_hash(config), "delay_ms": delay, "latency": latency or None, "config": config}
+            for config, delay, latency in results
+        ]
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, default=to_json)
+
+    print(f"Saved detailed results to {path}")
+
+def merge_shards(paths):
+    """
+    Combines the detailed results of shard runs into the OUTPUT_FILE and DETAILED_FILE
+    a single run would have written, and prints the combined stats.
+    """
+    results = {}
+    stats = Counter()
+    skipped = Counter()
+    shards = set()
+    for path in paths:
+        with open(path, "r") as f:
+            report = json.load(f)
+        stats.update(report["stats"])
+        skipped.update(report.get("skipped") or {})
+        if report.get("shard"):
+            shards.add(tuple(report["shard"]))
+        for entry in report["results"]:
+            results[entry["hash"]] = (config_from_dict(entry["config"]), entry["delay_ms"], entry["latency"])
+
+    counts = {count for _, count in shards}
+    if len(counts) > 1:
+        print(f"Warning: merging shards of different splits {sorted(counts)}")
+    for count in counts:
+        missing = [index for index in range(count) if (index, count) not in shards]
+        if missing:
+            print(f"Warning: missing shard(s) {', '.join(f'{index}/{count}' for index in missing)}")
+
+    print("\n" + "="*40)
+    print(f"MERGED SUMMARY ({len(paths)} shard files)")
+    print("="*40)
+    print_outcomes(stats)
+    if skipped:
+        print_skipped(skipped, stats["total"] + stats["InvalidConfig"] + sum(skipped.values()))
+    print("="*40)
+
+    results = list(results.values())
+    save_results(results)
+    save_detailed_results(results, stats, skipped=dict(skipped) or None)
+
+def export_metrics(stats, directory=None, suffix=""):
+    """Writes the run's metrics as JSON and a Prometheus textfile next to the results."""
+    if directory is None:
+        directory = os.path.dirname(OUTPUT_FILE)
+    json_path, prom_path = default_metrics.export(directory, stats, suffix)
+    print(f"Saved test metrics to {json_path} and {prom_path}")
 
-    print(f"Saved {len(results)} passed configs to {OUTPUT_FILE}")
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Tests unique_configs.json through Xray and saves the passing configs.")
+    parser.add_argument("--shard", type=parse_shard, metavar="i/N",
+                        help="Test only slice i of N (0-based), chosen by config hash; outputs get a .shard-i-of-N suffix")
+    parser.add_argument("--merge", nargs="+", metavar="DETAILED_JSON",
+                        help="Merge shard detailed results into the single-run outputs instead of testing")
+    parser.add_argument("--deadline", type=parse_duration, metavar="DURATION",
+                        help="Stop testing after this long (e.g. 45m, 2h or seconds), cancel running tests and save what passed")
+    parser.add_argument("--target-passed", type=parse_count, metavar="N",
+                        help="Stop testing once N configs passed, cancel running tests and save them")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    if args.merge:
+        merge_shards(args.merge)
+    else:
+        asyncio.run(main(args.shard, args.deadline, args.target_passed))
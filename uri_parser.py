@@ -0,0 +1,246 @@
+"""
+Single-pass config URI parsers with a scheme dispatch table.
+
+Each fast parser produces exactly what the urlparse/parse_qs based parsers in
+v2ray_utils produce, and hands anything unusual (tabs or newlines, non-ASCII or
+bracketed hosts, non-numeric ports, ...) to those parsers so edge cases keep
+their exact behavior. benchmarks/bench_parsers.py checks both on a golden corpus.
+
+The gain is in the URL-style schemes: vless and trojan skip urlparse/parse_qs
+and run about 3.3x faster. vmess and ss gain only about 1.1x. The old ss parser
+never used urlparse either, and vmess time is mostly base64 plus json.loads,
+both already C (a regex scan of the JSON measured slower). A mixed corpus
+therefore parses about 2.4x faster, not 3x.
+"""
+
+import base64
+import binascii
+import functools
+import json
+import re
+from urllib.parse import unquote
+from v2ray_utils import parse_vmess, parse_vless, parse_trojan, parse_shadowsocks
+from config_records import VmessConfig, VlessConfig, TrojanConfig, ShadowsocksConfig
+
+CONFIG_PREFIXES = ("vmess://", "vless://", "trojan://", "ss://")
+
+# Query keys each protocol reads, with the default used when a key is missing or blank
+VLESS_QUERY_DEFAULTS = {"encryption": "none", "type": "tcp", "security": "none", "path": "", "host": "", "sni": "", "fp": ""}
+TROJAN_QUERY_DEFAULTS = {"sni": "", "peer": "", "type": "tcp", "security": "tls", "path": "", "host": ""}
+
+NETLOC_END_PATTERN = re.compile(r"[/?#]")
+
+@functools.lru_cache(maxsize=4096)
+def unquote_plus(value):
+    """parse_qs-style decoding; memoized because paths and hosts repeat across configs."""
+    return unquote(value.replace("+", " "))
+
+def parse_query(query, defaults):
+    """
+    Extracts only the keys in `defaults` from a query string. Matches
+    parse_qs(query)[key][0]: '&' separated, first non-blank value wins,
+    '+' means space and %-escapes are decoded.
+    """
+    params = dict(defaults)
+    found = set()
+    for pair in query.split("&"):
+        name, _, value = pair.partition("=")
+        if not value:
+            continue
+        if "%" in name or "+" in name:
+            name = unquote_plus(name)
+        if name in params and name not in found:
+            found.add(name)
+            params[name] = unquote_plus(value) if "%" in value or "+" in value else value
+    return params
+
+def split_url(url, prefix_length):
+    """
+    Splits '<scheme>://<netloc><path>?<query>#<fragment>' like urlsplit().
+    Returns (netloc, query, fragment), or None when urlsplit would strip,
+    normalize or reject something and the slow parser must decide.
+    """
+    if "\t" in url or "\r" in url or "\n" in url or url[0] <= " ":
+        return None
+
+    match = NETLOC_END_PATTERN.search(url, prefix_length)
+    end = match.start() if match else len(url)
+    netloc = url[prefix_length:end]
+    if "[" in netloc or "]" in netloc or not netloc.isascii():
+        return None
+
+    rest = url[end:]
+    fragment = ""
+    if "#" in rest:
+        rest, fragment = rest.split("#", 1)
+    query = rest.split("?", 1)[1] if "?" in rest else ""
+    return netloc, query, fragment
+
+def split_netloc(netloc):
+    """
+    Returns (username, hostname, port) like SplitResult's properties, raising
+    ValueError for a port out of range. Returns None for inputs left to urlparse.
+    """
+    userinfo, has_userinfo, hostinfo = netloc.rpartition("@")
+    username = userinfo.partition(":")[0] if has_userinfo else None
+
+    hostname, _, port = hostinfo.partition(":")
+    if "%" in hostname:
+        return None
+
+    if port:
+        if not (port.isdigit() and port.isascii()):
+            return None
+        port = int(port)
+        if port > 65535:
+            raise ValueError("Port out of range 0-65535")
+    else:
+        port = None
+
+    return username, hostname.lower() or None, port
+
+def parse_vless_fast(url):
+    parts = split_url(url, 8)
+    if parts is None:
+        return parse_vless(url)
+    netloc, query, fragment = parts
+
+    try:
+        userinfo = split_netloc(netloc)
+    except ValueError:
+        return None
+    if userinfo is None:
+        return parse_vless(url)
+    username, hostname, port = userinfo
+
+    params = parse_query(query, VLESS_QUERY_DEFAULTS)
+    return VlessConfig(
+        hostname,
+        port,
+        username,
+        params["encryption"],
+        params["type"],
+        params["security"],
+        params["path"],
+        params["host"],
+        params["sni"],
+        params["fp"],
+        fragment,
+        url
+    )
+
+def parse_trojan_fast(url):
+    parts = split_url(url, 9)
+    if parts is None:
+        return parse_trojan(url)
+    netloc, query, fragment = parts
+
+    try:
+        userinfo = split_netloc(netloc)
+    except ValueError:
+        return None
+    if userinfo is None:
+        return parse_trojan(url)
+    username, hostname, port = userinfo
+
+    params = parse_query(query, TROJAN_QUERY_DEFAULTS)
+    return TrojanConfig(
+        hostname,
+        port,
+        username,
+        params["sni"] or params["peer"],
+        params["type"],
+        params["security"],
+        params["path"],
+        params["host"],
+        fragment,
+        url
+    )
+
+def b64decode_bytes(s):
+    """decode_base64() without the final text decoding. Returns None where it would return ''."""
+    s = s.strip()
+    missing_padding = len(s) % 4
+    if missing_padding:
+        s += '=' * (4 - missing_padding)
+    try:
+        return base64.b64decode(s)
+    except (binascii.Error, ValueError):
+        return None
+
+BASE64_ALPHABET = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/")
+
+def parse_shadowsocks_fast(url):
+    # The slow parser strips every "ss://", not only the prefix
+    if url.find("ss://", 5) != -1:
+        return parse_shadowsocks(url)
+
+    main_part, _, ps = url[5:].partition("#")
+    try:
+        decoded_bytes = b64decode_bytes(main_part)
+        decoded = decoded_bytes.decode("utf-8", errors="ignore") if decoded_bytes is not None else ""
+
+        if "@" in decoded:
+            # method:password@server:port
+            user_pass, server_port = decoded.split("@", 1)
+        elif "@" in main_part:
+            # base64(method:password)@server:port
+            user_pass_b64, server_port = main_part.split("@", 1)
+            if (decoded_bytes is not None and len(user_pass_b64) % 4 == 0
+                    and BASE64_ALPHABET.issuperset(user_pass_b64)):
+                # A clean base64 prefix decodes to the same leading bytes as the whole part
+                user_pass = decoded_bytes[:len(user_pass_b64) // 4 * 3].decode("utf-8", errors="ignore")
+            else:
+                user_pass_bytes = b64decode_bytes(user_pass_b64)
+                user_pass = user_pass_bytes.decode("utf-8", errors="ignore") if user_pass_bytes is not None else ""
+        else:
+            return None
+
+        method, password = user_pass.split(":", 1)
+        server, port = server_port.rsplit(":", 1)
+        return ShadowsocksConfig(
+            server,
+            int(port),
+            method,
+            password,
+            ps,
+            url
+        )
+    except Exception:
+        return None
+
+def parse_vmess_fast(url):
+    # The slow parser strips every "vmess://", not only the prefix
+    if url.find("vmess://", 8) != -1:
+        return parse_vmess(url)
+
+    try:
+        data = json.loads(b64decode_bytes(url[8:]).decode("utf-8", errors="ignore"))
+        return VmessConfig(
+            data.get("add"),
+            int(data.get("port")),
+            data.get("id"),
+            data.get("aid", 0),
+            data.get("net", "tcp"),
+            data.get("type", "none"),
+            data.get("host", ""),
+            data.get("path", ""),
+            data.get("tls", ""),
+            data.get("ps", ""),
+            url
+        )
+    except Exception:
+        return None
+
+PARSERS = {
+    "vmess": parse_vmess_fast,
+    "vless": parse_vless_fast,
+    "trojan": parse_trojan_fast,
+    "ss": parse_shadowsocks_fast,
+}
+
+def parse_config(uri):
+    """Parses a vmess/vless/trojan/ss URI. Returns None for unknown schemes or bad input."""
+    scheme, separator, _ = uri.partition("://")
+    parser = PARSERS.get(scheme) if separator else None
+    return parser(uri) if parser else None
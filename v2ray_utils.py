@@ -2,19 +2,39 @@ import base64
 import json
 import asyncio
 import re
+import functools
 import hashlib
+import ipaddress
 import subprocess
 import os
+import socket
 import aiohttp
-from urllib.parse import urlparse, parse_qs
+from collections import Counter
+from urllib.parse import urlparse, parse_qs, unquote
+from resolver import default_resolver, open_connection
+from config_records import VmessConfig, VlessConfig, TrojanConfig, ShadowsocksConfig
+from metrics import default_metrics
 
 # --- CONFIGURATION ---
 XRAY_BIN = "./bin/xray"  # Path to Xray executable
 TCP_TIMEOUT = 1.5
+ENDPOINT_PASS_TTL = 1800  # Seconds a reachable endpoint's pre-check is reused by other configs
+ENDPOINT_FAIL_TTL = 300  # Seconds an unreachable endpoint is rejected without a new handshake
 REAL_DELAY_TIMEOUT = 3.0
 REAL_DELAY_CONCURRENCY = 80
 TEST_URL = "http://cp.cloudflare.com/"
 EXPECTED_RESPONSE_CODE = 204
+XRAY_BATCH_SIZE = int(os.environ.get("XRAY_BATCH_SIZE", "1"))  # >1 shares one Xray process per batch of configs
+XRAY_BATCH_WINDOW = 0.05  # Seconds a batch waits to fill before Xray is spawned
+XRAY_READY_TIMEOUT = 5.0  # Max seconds to wait for Xray inbounds to accept connections
+XRAY_READY_BACKOFF = (0.01, 0.1)  # Initial and max poll interval while Xray starts
+XRAY_FATAL_MARKERS = ("Failed to start", "panic:", "failed to load config")
+PROBE_SAMPLES = int(os.environ.get("PROBE_SAMPLES", "1"))  # >1 sends this many probes per config over one kept-alive connection
+PROBE_MAX_LOSS = 1  # Failed follow-up probes tolerated before a multi-sample test gives up
+PROXY_BACKEND = os.environ.get("PROXY_BACKEND", "xray")  # Core the tests run through: "xray" or "singbox" (backends.py)
+
+# Time-to-ready (ms) of every spawned Xray process, for tuning XRAY_READY_BACKOFF
+xray_ready_times = []
 
 def decode_base64(s):
     """Robust base64 decoding."""
@@ -27,51 +47,126 @@ def decode_base64(s):
     except Exception:
         return ""
 
-def get_config_hash(config):
+# Fields that identified a config before canonicalization, per protocol ('ps' is never part of it)
+HASH_FIELDS = {
+    "vmess": ("add", "port", "id", "net", "path", "tls"),
+    "vless": ("add", "port", "id", "encryption", "type", "security", "path"),
+    "trojan": ("add", "port", "password", "sni"),
+    "shadowsocks": ("add", "port", "method", "password"),
+}
+
+def canonical_host(host):
+    """Lowercase, no trailing dot, IDNs in punycode and IPv6 addresses in compressed form."""
+    if not isinstance(host, str):
+        return "" if host is None else str(host)
+    return _canonical_host_name(host)
+
+@functools.lru_cache(maxsize=65536)
+def _canonical_host_name(host):
+    # Memoized: the same hosts and CDN fronts appear across thousands of configs
+    host = host.strip().rstrip(".").lower()
+    if ":" in host:
+        try:
+            return ipaddress.ip_address(host.strip("[]")).compressed
+        except ValueError:
+            return host
+    if not host.isascii():
+        try:
+            return host.encode("idna").decode("ascii")
+        except UnicodeError:
+            return host
+    return host
+
+def canonical_port(port):
+    """"443", " 443" and 443 are the same port."""
+    if type(port) is int:
+        return port
+    try:
+        return int(port)
+    except (TypeError, ValueError):
+        return port
+
+def canonical_value(value, default=""):
+    """Case-insensitive enum-like field (network, security, method, ...), with blank meaning `default`."""
+    if value is None or value == "":
+        return default
+    return str(value).strip().lower()
+
+UUID_PATTERN = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+
+def canonical_id(user_id):
+    """UUIDs are case-insensitive; any other ID is hashed into one by Xray as written."""
+    if isinstance(user_id, str) and UUID_PATTERN.fullmatch(user_id):
+        return user_id.lower()
+    return user_id
+
+def canonical_path(path):
+    """'/a%20b' and '/a b' are the same path."""
+    if not isinstance(path, str):
+        return "" if path is None else str(path)
+    return unquote(path) if "%" in path else path
+
+def canonical_key(config):
     """
-    Generates a unique hash for a config based ONLY on core connection details.
-    Ignores 'ps' (remark/name).
+    Returns the core connection details of a config with equivalent spellings
+    normalized (host case/trailing dot/IDN, string vs int port, path escaping,
+    blank fields vs their defaults), or None for unknown protocols.
     """
-    core_data = ""
-    protocol = config.get("protocol")
+    get = config.get
+    protocol = get("protocol")
+    host = canonical_host(get("add"))
+    port = canonical_port(get("port"))
 
     if protocol == "vmess":
-        # Hash based on: add, port, id, net, path, tls
-        core_data = f"{config.get('add')}|{config.get('port')}|{config.get('id')}|{config.get('net')}|{config.get('path')}|{config.get('tls')}"
-    elif protocol == "vless":
-        # Hash based on: add, port, id, encryption, type, security, path
-        core_data = f"{config.get('add')}|{config.get('port')}|{config.get('id')}|{config.get('encryption')}|{config.get('type')}|{config.get('security')}|{config.get('path')}"
-    elif protocol == "trojan":
-         # Hash based on: add, port, password, sni
-        core_data = f"{config.get('add')}|{config.get('port')}|{config.get('password')}|{config.get('sni')}"
-    elif protocol == "shadowsocks":
-         # Hash based on: add, port, method, password
-        core_data = f"{config.get('add')}|{config.get('port')}|{config.get('method')}|{config.get('password')}"
+        tls = canonical_value(get("tls"))
+        return (protocol, host, port, canonical_id(get("id")), canonical_value(get("net"), "tcp"),
+                canonical_path(get("path")), "" if tls == "none" else tls)
+    if protocol == "vless":
+        return (protocol, host, port, canonical_id(get("id")), canonical_value(get("encryption"), "none"),
+                canonical_value(get("type"), "tcp"), canonical_value(get("security"), "none"),
+                canonical_path(get("path")))
+    if protocol == "trojan":
+        # An empty SNI means the Host header or the address is sent, as in generate_xray_config
+        sni = canonical_host(get("sni") or get("host") or get("add"))
+        return (protocol, host, port, get("password"), sni)
+    if protocol == "shadowsocks":
+        return (protocol, host, port, canonical_value(get("method")), get("password"))
+    return None
+
+def get_config_hash(config):
+    """
+    Generates a unique hash for a config based ONLY on core connection details,
+    canonicalized so equivalent configs share one hash. Ignores 'ps' (remark/name).
+    BLAKE2b with an 8-byte digest is stable across runs and processes (unlike hash())
+    and gives 16 character keys; the key is an identity, not a security boundary.
+    """
+    key = canonical_key(config)
+    if key is not None:
+        core_data = "|".join(map(str, key))
     else:
         # Fallback for unknown protocols
         core_data = json.dumps(config, sort_keys=True)
 
-    return hashlib.md5(core_data.encode()).hexdigest()
+    return hashlib.blake2b(core_data.encode(), digest_size=8).hexdigest()
 
 def parse_vmess(url):
     try:
         b64 = url.replace("vmess://", "")
         json_str = decode_base64(b64)
         data = json.loads(json_str)
-        return {
-            "protocol": "vmess",
-            "add": data.get("add"),
-            "port": int(data.get("port")),
-            "id": data.get("id"),
-            "aid": data.get("aid", 0),
-            "net": data.get("net", "tcp"),
-            "type": data.get("type", "none"),
-            "host": data.get("host", ""),
-            "path": data.get("path", ""),
-            "tls": data.get("tls", ""),
-            "ps": data.get("ps", ""),
-            "raw_uri": url
-        }
+        return VmessConfig(
+            add=data.get("add"),
+            port=int(data.get("port")),
+            id=data.get("id"),
+            aid=data.get("aid", 0),
+            net=data.get("net", "tcp"),
+            type=data.get("type", "none"),
+            host=data.get("host", ""),
+            path=data.get("path", ""),
+            tls=data.get("tls", ""),
+            ps=data.get("ps", ""),
+            raw_uri=url
+        )
     except Exception:
         return None
 
@@ -81,21 +176,20 @@ def parse_vless(url):
         params = parse_qs(parsed.query)
         user_info = parsed.username
 
-        return {
-            "protocol": "vless",
-            "add": parsed.hostname,
-            "port": parsed.port,
-            "id": user_info,
-            "encryption": params.get("encryption", ["none"])[0],
-            "type": params.get("type", ["tcp"])[0],
-            "security": params.get("security", ["none"])[0],
-            "path": params.get("path", [""])[0],
-            "host": params.get("host", [""])[0],
-            "sni": params.get("sni", [""])[0],
-            "fp": params.get("fp", [""])[0],
-            "ps": parsed.fragment,
-            "raw_uri": url
-        }
+        return VlessConfig(
+            add=parsed.hostname,
+            port=parsed.port,
+            id=user_info,
+            encryption=params.get("encryption", ["none"])[0],
+            type=params.get("type", ["tcp"])[0],
+            security=params.get("security", ["none"])[0],
+            path=params.get("path", [""])[0],
+            host=params.get("host", [""])[0],
+            sni=params.get("sni", [""])[0],
+            fp=params.get("fp", [""])[0],
+            ps=parsed.fragment,
+            raw_uri=url
+        )
     except Exception:
         return None
 
@@ -104,19 +198,18 @@ def parse_trojan(url):
         parsed = urlparse(url)
         params = parse_qs(parsed.query)
 
-        return {
-            "protocol": "trojan",
-            "add": parsed.hostname,
-            "port": parsed.port,
-            "password": parsed.username,
-            "sni": params.get("sni", [""])[0] or params.get("peer", [""])[0],
-            "type": params.get("type", ["tcp"])[0],
-            "security": params.get("security", ["tls"])[0], # Trojan usually implies TLS
-            "path": params.get("path", [""])[0],
-            "host": params.get("host", [""])[0],
-             "ps": parsed.fragment,
-             "raw_uri": url
-        }
+        return TrojanConfig(
+            add=parsed.hostname,
+            port=parsed.port,
+            password=parsed.username,
+            sni=params.get("sni", [""])[0] or params.get("peer", [""])[0],
+            type=params.get("type", ["tcp"])[0],
+            security=params.get("security", ["tls"])[0], # Trojan usually implies TLS
+            path=params.get("path", [""])[0],
+            host=params.get("host", [""])[0],
+            ps=parsed.fragment,
+            raw_uri=url
+        )
     except Exception:
         return None
 
@@ -148,15 +241,14 @@ def parse_shadowsocks(url):
         else:
              return None
 
-        return {
-            "protocol": "shadowsocks",
-            "add": server,
-            "port": int(port),
-            "method": method,
-            "password": password,
-            "ps": ps,
-            "raw_uri": url
-        }
+        return ShadowsocksConfig(
+            add=server,
+            port=int(port),
+            method=method,
+            password=password,
+            ps=ps,
+            raw_uri=url
+        )
 
     except Exception:
         return None
@@ -246,13 +338,75 @@ def generate_xray_config(config, local_port):
         "outbounds": [outbound]
     }
 
+def generate_xray_batch_config(configs, local_ports):
+    """
+    Generates one Xray JSON configuration holding an HTTP inbound and an outbound
+    per config. Each inbound is routed to its own outbound by tag.
+    """
+    inbounds = []
+    outbounds = []
+    rules = []
+
+    for index, (config, local_port) in enumerate(zip(configs, local_ports)):
+        single = generate_xray_config(config, local_port)
+        inbound_tag = f"in-{index}"
+        outbound_tag = f"out-{index}"
+
+        inbounds.append(dict(single["inbounds"][0], tag=inbound_tag))
+        outbounds.append(dict(single["outbounds"][0], tag=outbound_tag))
+        rules.append({"type": "field", "inboundTag": [inbound_tag], "outboundTag": outbound_tag})
+
+    return {
+        "log": {"loglevel": "none"},
+        "inbounds": inbounds,
+        "outbounds": outbounds,
+        "routing": {"rules": rules}
+    }
+
+# Pre-check per resolved endpoint (addresses, port): [Future of the handshake, expiry].
+# The expiry is None while the handshake is in flight, then ENDPOINT_PASS_TTL or
+# ENDPOINT_FAIL_TTL (loop time) after it settled
+_endpoint_checks = {}
+precheck_stats = Counter()
+
 async def test_tcp_connection(host, port, timeout=TCP_TIMEOUT):
     """
     Performs a quick TCP handshake to verify the server is reachable.
+    The host is resolved through the shared DNS cache, and the handshake runs once
+    per resolved endpoint: concurrent checks of the same IPs and port await it, and
+    later ones reuse its outcome until it expires, so a dead endpoint is rejected
+    without a new handshake for ENDPOINT_FAIL_TTL seconds.
+    The lookup and the handshake are each bounded by `timeout`.
     """
+    addresses = await default_resolver.resolve(host, timeout)
+    if not addresses:
+        precheck_stats["dns_failed"] += 1
+        return False
+
+    loop = asyncio.get_running_loop()
+    endpoint = (tuple(sorted(addresses)), int(port))
+    check = _endpoint_checks.get(endpoint)
+    if check is None or check[1] is not None and loop.time() >= check[1]:
+        check = _endpoint_checks[endpoint] = [asyncio.ensure_future(_handshake(addresses, port, timeout)), None]
+        precheck_stats["endpoints_probed"] += 1
+
+        # Set the expiry on completion, even if every waiter was cancelled
+        def settle(done, check=check):
+            reachable = not done.cancelled() and done.exception() is None and done.result()
+            check[1] = loop.time() + (ENDPOINT_PASS_TTL if reachable else ENDPOINT_FAIL_TTL)
+        check[0].add_done_callback(settle)
+    elif check[1] is None:
+        precheck_stats["coalesced"] += 1
+    elif check[0].result():
+        precheck_stats["endpoint_reused"] += 1
+    else:
+        precheck_stats["short_circuited"] += 1
+    return await asyncio.shield(check[0])
+
+async def _handshake(addresses, port, timeout):
     try:
         _, writer = await asyncio.wait_for(
-            asyncio.open_connection(host, port),
+            open_connection(addresses, port),
             timeout=timeout
         )
         writer.close()
@@ -261,81 +415,514 @@ async def test_tcp_connection(host, port, timeout=TCP_TIMEOUT):
     except:
         return False
 
-async def test_connection(config, local_port, session=None):
+async def tcp_precheck(host, port, timeout=TCP_TIMEOUT):
+    """test_tcp_connection(), timed for the metrics and returning False on any error."""
+    with default_metrics.timed("tcp_precheck"):
+        try:
+            return await test_tcp_connection(host, port, timeout)
+        except Exception:
+            # A malformed config (e.g. a non-numeric port) must not take its worker down
+            precheck_stats["errors"] += 1
+            return False
+
+def summarize_precheck():
+    """Returns DNS cache and endpoint dedup counters for the summary report."""
+    return dict(precheck_stats, **{f"dns_{key}": value for key, value in default_resolver.stats.items()})
+
+def reserve_local_ports(count):
     """
-    Tests a configuration by spawning an Xray subprocess, piping the config via stdin,
-    and attempting an HTTP request through the local HTTP proxy using aiohttp.
-    Returns: (success: bool, delay_ms: int, error_reason: str)
+    Asks the OS for `count` free loopback ports. The sockets are closed right away,
+    so the ports are only very likely (not guaranteed) to still be free for Xray.
     """
-    process = None
+    sockets = []
     try:
-        xray_config = generate_xray_config(config, local_port)
-        xray_json = json.dumps(xray_config).encode('utf-8')
+        for _ in range(count):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.bind(("127.0.0.1", 0))
+            sockets.append(sock)
+        return [sock.getsockname()[1] for sock in sockets]
+    finally:
+        for sock in sockets:
+            sock.close()
 
-        # Start Xray process
+def default_backend():
+    """The backends.Backend named by PROXY_BACKEND."""
+    # Imported here because backends builds on this module
+    from backends import get_backend
+    return get_backend(PROXY_BACKEND)
+
+async def start_xray(xray_config, backend=None):
+    """Spawns Xray (or the core of `backend`) and pipes the given config to it via stdin."""
+    command = backend.command() if backend else [XRAY_BIN, "-config", "stdin:"]
+    with default_metrics.timed("spawn"):
         process = await asyncio.create_subprocess_exec(
-            XRAY_BIN, "-config", "stdin:",
+            *command,
             stdin=subprocess.PIPE,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.PIPE
+            # Xray prints "Failed to start" on stdout, so fold both streams into one pipe
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT
         )
+        default_metrics.xray_started(process)
 
         # Write config to stdin and close it
-        process.stdin.write(xray_json)
-        await process.stdin.drain()
-        process.stdin.close()
+        try:
+            process.stdin.write(json.dumps(xray_config).encode('utf-8'))
+            await process.stdin.drain()
+            process.stdin.close()
+        except BaseException:
+            # The caller never gets the process (e.g. its test was cancelled), so stop it here
+            await stop_xray(process)
+            raise
+    return process
+
+async def port_accepts_connections(port):
+    """Returns True if something is listening on the loopback `port`."""
+    try:
+        _, writer = await asyncio.open_connection("127.0.0.1", port)
+    except OSError:
+        return False
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return True
 
-        # Wait a brief moment for Xray to initialize
-        await asyncio.sleep(0.5)
+# Tasks reading the output of running core processes, referenced so they are not collected
+_output_drains = set()
 
-        # Test connection using aiohttp through the proxy
-        proxy_url = f"http://127.0.0.1:{local_port}"
-        start_time = asyncio.get_event_loop().time()
+async def wait_for_xray_ready(process, local_ports, timeout=XRAY_READY_TIMEOUT, fatal_markers=XRAY_FATAL_MARKERS):
+    """
+    Polls the inbound ports with a short exponential backoff until Xray accepts
+    connections on all of them, while watching its output for fatal startup errors
+    (lines containing one of `fatal_markers`). The output keeps being read until
+    the process exits, so a chatty core never blocks on a full pipe.
+    Returns: (ready: bool, error_reason: str)
+    """
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    failed = loop.create_future()
 
-        try:
-            # Helper function to perform request
-            async def perform_request(req_session):
-                async with req_session.get(TEST_URL, proxy=proxy_url, timeout=REAL_DELAY_TIMEOUT) as response:
-                    await response.read() # Ensure body is fully read
-                    return response.status
-
-            if session:
-                status = await perform_request(session)
-            else:
-                async with aiohttp.ClientSession() as local_session:
-                    status = await perform_request(local_session)
-
-            if status == 204 or status == 200:
-                end_time = asyncio.get_event_loop().time()
-                delay = int((end_time - start_time) * 1000)
-                return True, delay, None
-            else:
-                return False, -1, f"HTTP_{status}"
+    async def watch_output():
+        while True:
+            try:
+                line = await process.stdout.readline()
+            except ValueError:
+                continue  # A line over the stream limit; readline() already dropped it
+            if not line:
+                break  # EOF: Xray has exited
+            if not failed.done() and any(marker in line.decode("utf-8", errors="ignore") for marker in fatal_markers):
+                failed.set_result(True)
+        if not failed.done():
+            failed.set_result(True)
+
+    watcher = asyncio.create_task(watch_output())
+    _output_drains.add(watcher)
+    watcher.add_done_callback(_output_drains.discard)
+    try:
+        delay, max_delay = XRAY_READY_BACKOFF
+        pending_ports = list(local_ports)
+        while True:
+            if failed.done():
+                return False, "XrayStartFailed"
+
+            pending_ports = [port for port in pending_ports if not await port_accepts_connections(port)]
+            if not pending_ports:
+                xray_ready_times.append(int((loop.time() - start_time) * 1000))
+                default_metrics.observe("ready", loop.time() - start_time)
+                return True, None
+
+            if loop.time() - start_time > timeout:
+                return False, "XrayStartTimeout"
+
+            try:
+                await asyncio.wait_for(asyncio.shield(failed), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, max_delay)
+    finally:
+        # Once the process is up the watcher only drains; stopping the process ends it
+        failed.cancel()
+
+def summarize_ready_times():
+    """Returns count, median, p90 and max of the recorded Xray time-to-ready values."""
+    if not xray_ready_times:
+        return None
+    ordered = sorted(xray_ready_times)
+    return {
+        "count": len(ordered),
+        "median_ms": ordered[len(ordered) // 2],
+        "p90_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))],
+        "max_ms": ordered[-1]
+    }
+
+async def stop_xray(process):
+    """Terminates an Xray process, escalating to kill so no zombies are left behind."""
+    try:
+        with default_metrics.timed("terminate"):
+            # Shielded, so cancelling the caller mid-stop still lets the kill escalation finish
+            await asyncio.shield(_terminate(process))
+    finally:
+        default_metrics.xray_stopped(process)
 
+async def _terminate(process):
+    try:
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), timeout=2.0)
         except asyncio.TimeoutError:
-            return False, -1, "Timeout"
-        except aiohttp.ClientError:
-            return False, -1, "ConnectionError"
-        except Exception as e:
-             return False, -1, f"RequestError: {str(e)}"
+            process.kill()
+            await process.wait()
+    except ProcessLookupError:
+        pass
+    except Exception:
+        # Last resort kill if something weird happens
+        try:
+            process.kill()
+        except:
+            pass
+
+async def probe_proxy(local_port, session=None, samples=1, latency=None):
+    """
+    Sends TEST_URL through the local HTTP proxy on `local_port`, or with samples > 1
+    runs probe_proxy_samples() and fills `latency` with its summary.
+    Returns: (success: bool, delay_ms: int, error_reason: str)
+    """
+    with default_metrics.timed("http_probe"):
+        if samples > 1:
+            return await probe_proxy_samples(local_port, samples, latency)
+        return await _probe_proxy(local_port, session)
+
+async def probe_proxy_samples(local_port, samples, latency=None):
+    """
+    Sends `samples` probes through one tunnel to the probe server. The first one pays
+    for the handshake with the server and is reported as handshake_ms; the rest
+    measure the steady-state RTT. Gives up as soon as the first probe fails or more
+    than PROBE_MAX_LOSS of the rest do.
+    Returns: (success, median steady-state delay_ms, error_reason)
+    """
+    if urlparse(TEST_URL).scheme == "https":
+        # aiohttp tunnels https through CONNECT itself; a single-connection pool keeps reusing that tunnel
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=1)) as session:
+            probe = lambda: _probe_proxy(local_port, session)
+            return await _sample_probes(probe, probe, samples, latency)
+
+    # Plain-HTTP requests would each get a new outbound connection from the core, so open the tunnel by hand
+    tunnel = ProbeTunnel(local_port)
+    try:
+        return await _sample_probes(
+            lambda: _timed_probe(tunnel.open()), lambda: _timed_probe(tunnel.get()), samples, latency
+        )
+    finally:
+        tunnel.close()
+
+async def _sample_probes(first, again, samples, latency):
+    success, handshake_ms, error = await first()
+    if not success:
+        return False, -1, error
+
+    rtts = []
+    lost = 0
+    while len(rtts) + lost < samples - 1:
+        success, delay, error = await again()
+        if success:
+            rtts.append(delay)
+            continue
+        lost += 1
+        if lost > PROBE_MAX_LOSS:
+            return False, -1, error
+        # The failed probe may have broken the tunnel; reopening it is not a sample
+        success, _, error = await first()
+        if not success:
+            return False, -1, error
+
+    summary = summarize_samples(handshake_ms, rtts, lost)
+    if latency is not None:
+        latency.update(summary)
+    return True, summary["median_ms"], None
+
+class ProbeTunnel:
+    """
+    A CONNECT tunnel through the local proxy to TEST_URL's server, for sending several
+    plain-HTTP probes over one outbound connection. Only http:// URLs are spoken here:
+    Python 3.10 has no StreamWriter.start_tls to run TLS inside the tunnel.
+    """
+
+    def __init__(self, local_port):
+        self.local_port = local_port
+        self.url = urlparse(TEST_URL)
+        self.writer = None
+        self.reader = None
+
+    async def open(self):
+        """(Re)opens the tunnel and sends the first probe through it. Returns the HTTP status."""
+        self.close()
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", self.local_port)
+        target = f"{self.url.hostname}:{self.url.port or 80}"
+        self.writer.write(f"CONNECT {target} HTTP/1.1\r\nHost: {target}\r\n\r\n".encode())
+        status = await read_http_response(self.reader, head_only=True)
+        if status != 200:
+            return status
+        return await self.get()
+
+    async def get(self):
+        """Sends one probe over the open tunnel. Returns the HTTP status."""
+        path = (self.url.path or "/") + (f"?{self.url.query}" if self.url.query else "")
+        self.writer.write(
+            f"GET {path} HTTP/1.1\r\nHost: {self.url.netloc}\r\nConnection: keep-alive\r\n\r\n".encode()
+        )
+        return await read_http_response(self.reader)
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+
+async def read_http_response(reader, head_only=False):
+    """Reads one HTTP/1.1 response (just its head if head_only) and returns the status code."""
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").lower()
+    status = int(head.split(" ", 2)[1])
+    if head_only or status in (204, 304) or status < 200:
+        return status
+
+    if re.search(r"^transfer-encoding:.*chunked", head, re.M):
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            if size == 0:
+                while await reader.readuntil(b"\r\n") != b"\r\n":
+                    pass  # Trailers
+                return status
+            await reader.readexactly(size + 2)
+
+    length = re.search(r"^content-length:\s*(\d+)", head, re.M)
+    if not length:
+        raise ValueError("response body has no length, so the connection cannot be reused")
+    await reader.readexactly(int(length.group(1)))
+    return status
+
+async def _timed_probe(request):
+    """Awaits a probe returning an HTTP status, with _probe_proxy's timeout and error names."""
+    start_time = asyncio.get_event_loop().time()
+    try:
+        status = await asyncio.wait_for(request, REAL_DELAY_TIMEOUT)
+    except asyncio.TimeoutError:
+        return False, -1, "Timeout"
+    except (OSError, asyncio.IncompleteReadError):
+        return False, -1, "ConnectionError"
+    except Exception as e:
+        return False, -1, f"RequestError: {str(e)}"
+
+    if status == 204 or status == 200:
+        return True, int((asyncio.get_event_loop().time() - start_time) * 1000), None
+    return False, -1, f"HTTP_{status}"
+
+def summarize_samples(handshake_ms, rtts, lost=0):
+    """Median, p90 and jitter (mean difference between consecutive samples) of steady-state RTTs."""
+    ordered = sorted(rtts) or [handshake_ms]
+    jitter = sum(abs(b - a) for a, b in zip(rtts, rtts[1:])) / (len(rtts) - 1) if len(rtts) > 1 else 0
+    return {
+        "handshake_ms": handshake_ms,
+        "median_ms": ordered[len(ordered) // 2],
+        "p90_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))],
+        "jitter_ms": round(jitter, 1),
+        "samples": len(rtts),
+        "lost": lost
+    }
+
+async def _probe_proxy(local_port, session):
+    proxy_url = f"http://127.0.0.1:{local_port}"
+    start_time = asyncio.get_event_loop().time()
+
+    try:
+        # Helper function to perform request
+        async def perform_request(req_session):
+            async with req_session.get(TEST_URL, proxy=proxy_url, timeout=REAL_DELAY_TIMEOUT) as response:
+                await response.read() # Ensure body is fully read
+                return response.status
+
+        if session:
+            status = await perform_request(session)
+        else:
+            async with aiohttp.ClientSession() as local_session:
+                status = await perform_request(local_session)
+
+        if status == 204 or status == 200:
+            end_time = asyncio.get_event_loop().time()
+            delay = int((end_time - start_time) * 1000)
+            return True, delay, None
+        else:
+            return False, -1, f"HTTP_{status}"
+
+    except asyncio.TimeoutError:
+        return False, -1, "Timeout"
+    except aiohttp.ClientError:
+        return False, -1, "ConnectionError"
+    except Exception as e:
+         return False, -1, f"RequestError: {str(e)}"
+
+async def test_single_connection(config, local_port, session=None, samples=1, latency=None, backend=None):
+    """
+    Tests a configuration by spawning a dedicated core subprocess (Xray unless another
+    backend is given), piping the config via stdin, and attempting an HTTP request
+    through the local HTTP proxy using aiohttp.
+    Returns: (success: bool, delay_ms: int, error_reason: str)
+    """
+    backend = backend or default_backend()
+    process = None
+    try:
+        process = await start_xray(backend.generate_config(config, local_port), backend)
+
+        ready, error = await wait_for_xray_ready(process, [local_port], fatal_markers=backend.fatal_markers)
+        if not ready:
+            return False, -1, error
+
+        return await probe_proxy(local_port, session, samples, latency)
 
     except Exception as e:
         return False, -1, f"XrayCrash: {str(e)}"
     finally:
         if process:
-            try:
-                # Robust process termination to prevent zombies
-                process.terminate()
-                try:
-                    await asyncio.wait_for(process.wait(), timeout=2.0)
-                except asyncio.TimeoutError:
-                    process.kill()
-                    await process.wait()
-            except ProcessLookupError:
-                pass
-            except Exception as e:
-                # Last resort kill if something weird happens
-                try:
-                    process.kill()
-                except:
-                    pass
+            await stop_xray(process)
+
+# Tasks starting the core of a batch, referenced so they are not collected while members wait
+_batch_launches = set()
+
+class XrayBatch:
+    """A group of configs tested together, served by one core process (or, after a split, a few)."""
+
+    def __init__(self):
+        self.members = []
+        self.full = asyncio.Event()
+        self.loaded = asyncio.get_running_loop().create_future()
+        self.processes = []
+        self.pending = 0
+
+class XrayBatchEngine:
+    """
+    Groups concurrent test_connection() calls into batches and probes each batch
+    through a single process of the backend's core (a multi-outbound config).
+    Configs the backend knows its core rejects are tested alone. A batch whose
+    combined config is still rejected is split in halves and retried, so a bad
+    outbound ends up isolated and costs only a few extra spawns; batches that
+    time out or crash fall back to one process per config.
+    """
+
+    def __init__(self, batch_size=XRAY_BATCH_SIZE, window=XRAY_BATCH_WINDOW, backend=None):
+        self.batch_size = batch_size
+        self.window = window
+        self.backend = backend or default_backend()
+        self.current = None
+
+    async def test(self, config, session=None, samples=1, latency=None):
+        if not self.backend.loadable(config):
+            # Would only get its whole batch rejected
+            return await test_single_connection(config, reserve_local_ports(1)[0], session, samples, latency, self.backend)
+
+        batch = self.current
+        if batch is None:
+            batch = self.current = XrayBatch()
+            launch = asyncio.create_task(self._launch(batch))
+            _batch_launches.add(launch)
+            launch.add_done_callback(_batch_launches.discard)
+
+        index = len(batch.members)
+        batch.members.append(config)
+        batch.pending += 1
+        if len(batch.members) >= self.batch_size:
+            self.current = None
+            batch.full.set()
+
+        try:
+            with default_metrics.timed("batch_wait"):
+                local_ports, errors = await asyncio.shield(batch.loaded)
+            if errors[index]:
+                return False, -1, errors[index]
+            if local_ports[index] is None:
+                return await test_single_connection(config, reserve_local_ports(1)[0], session, samples, latency, self.backend)
+            return await probe_proxy(local_ports[index], session, samples, latency)
+        finally:
+            batch.pending -= 1
+            if batch.pending == 0:
+                await self._stop(batch)
+
+    async def _launch(self, batch):
+        try:
+            await asyncio.wait_for(batch.full.wait(), timeout=self.window)
+        except asyncio.TimeoutError:
+            pass
+        # Close the batch to newcomers before spawning
+        if self.current is batch:
+            self.current = None
+
+        # Port (or error) per member; None for both means "test it alone"
+        local_ports = [None] * len(batch.members)
+        errors = [None] * len(batch.members)
+        try:
+            if batch.pending:
+                await self._load(batch, list(range(len(batch.members))), local_ports, errors)
+        except Exception:
+            await self._stop(batch)
+            local_ports = [None] * len(batch.members)
+        finally:
+            # Members that left (or were cancelled) before the load could not stop the processes
+            if batch.pending == 0:
+                await self._stop(batch)
+            if not batch.loaded.done():
+                batch.loaded.set_result((local_ports, errors))
+
+    async def _load(self, batch, indexes, local_ports, errors):
+        """
+        Starts one process for the members at `indexes`. If the core rejects their
+        combined config, retries each half; a lone member it rejects gets XrayStartFailed.
+        """
+        ports = reserve_local_ports(len(indexes))
+        configs = [batch.members[index] for index in indexes]
+        process = await start_xray(self.backend.generate_batch_config(configs, ports), self.backend)
+        batch.processes.append(process)
+
+        ready, error = await wait_for_xray_ready(process, ports, fatal_markers=self.backend.fatal_markers)
+        if ready:
+            for index, port in zip(indexes, ports):
+                local_ports[index] = port
+            return
+
+        batch.processes.remove(process)
+        await stop_xray(process)
+        if error != "XrayStartFailed":
+            return  # Timed out or crashed: the members are retested one by one
+        if len(indexes) == 1:
+            errors[indexes[0]] = error
+            return
+        half = len(indexes) // 2
+        await asyncio.gather(
+            self._load(batch, indexes[:half], local_ports, errors),
+            self._load(batch, indexes[half:], local_ports, errors)
+        )
+
+    async def _stop(self, batch):
+        processes, batch.processes = batch.processes, []
+        for process in processes:
+            await stop_xray(process)
+
+_batch_engines = {}  # Backend name -> XrayBatchEngine
+
+async def test_connection(config, local_port, session=None, samples=1, latency=None, backend=None):
+    """
+    Tests a configuration through the PROXY_BACKEND core (Xray by default), or
+    through `backend` if given. With XRAY_BATCH_SIZE > 1 the config shares a core
+    process with other concurrent calls (local_port is then unused); otherwise a
+    dedicated process is spawned on local_port.
+    With samples > 1 the delay is the median of several probes and the `latency`
+    dict, if given, receives handshake_ms, median_ms, p90_ms and jitter_ms.
+    Returns: (success: bool, delay_ms: int, error_reason: str)
+    """
+    backend = backend or default_backend()
+
+    with default_metrics.timed("test_connection"):
+        if XRAY_BATCH_SIZE <= 1:
+            return await test_single_connection(config, local_port, session, samples, latency, backend)
+
+        engine = _batch_engines.get(backend.name)
+        if engine is None:
+            engine = _batch_engines[backend.name] = XrayBatchEngine(XRAY_BATCH_SIZE, backend=backend)
+        return await engine.test(config, session, samples, latency)
@@ -0,0 +1,218 @@
+"""
+Xray binary manager shared by tester.py, local_test.py and pipeline.py.
+
+Release archives are streamed to disk in chunks while being hashed, checked
+against a pinned SHA-256 and only the xray executable is extracted, into a
+directory named after the archive digest:
+
+    bin/<sha256>/xray        one directory per verified archive
+    bin/index.json           "<version>/<asset>" -> sha256 of its archive
+
+A binary already in the store is used without touching the network.
+XRAY_ARCHIVE installs from a local archive instead (offline mode), and
+XRAY_OFFLINE=1 refuses to download at all. A download needs a pinned digest
+(PINNED_SHA256 or XRAY_SHA256); print one for a release archive you checked with
+
+    python xray_toolchain.py --pin Xray-linux-64.zip
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import shutil
+import zipfile
+
+import aiohttp
+import v2ray_utils
+
+# --- CONFIGURATION ---
+XRAY_VERSION = os.environ.get("XRAY_VERSION", "v1.8.4")
+XRAY_RELEASE_URL = "https://github.com/XTLS/Xray-core/releases/download/{version}/{asset}"
+TOOLCHAIN_DIR = os.environ.get("XRAY_TOOLCHAIN_DIR", "bin")
+XRAY_ARCHIVE = os.environ.get("XRAY_ARCHIVE")  # Local release zip to install from, no network needed
+XRAY_OFFLINE = os.environ.get("XRAY_OFFLINE", "0") == "1"  # Never download; fail unless the binary is cached
+XRAY_SHA256 = os.environ.get("XRAY_SHA256", "")  # Overrides the pin below, e.g. for a different version
+# Download an unpinned asset checked only against the release's own .dgst file, which
+# comes from the same host and so catches corruption, not tampering
+XRAY_ALLOW_UNPINNED = os.environ.get("XRAY_ALLOW_UNPINNED", "0") == "1"
+CHUNK_SIZE = 1 << 16  # Bytes per streamed download chunk
+DOWNLOAD_TIMEOUT = 300  # Seconds for the whole archive
+
+# SHA-256 of release archives, "<version>/<asset>" -> hex digest, from `--pin` on an
+# archive checked out of band. Downloading an asset missing here (and from XRAY_SHA256)
+# fails unless XRAY_ALLOW_UNPINNED=1. CI sets XRAY_SHA256 from the repository variable
+# of the same name until "v1.8.4/Xray-linux-64.zip" is pinned here.
+PINNED_SHA256 = {}
+
+# (system, machine) -> release asset
+ASSETS = {
+    ("Linux", "x86_64"): "Xray-linux-64.zip",
+    ("Linux", "aarch64"): "Xray-linux-arm64-v8a.zip",
+    ("Darwin", "x86_64"): "Xray-macos-64.zip",
+    ("Darwin", "arm64"): "Xray-macos-arm64-v8a.zip",
+    ("Windows", "AMD64"): "Xray-windows-64.zip",
+}
+
+class ToolchainError(Exception):
+    pass
+
+def release_asset():
+    key = (platform.system(), platform.machine())
+    if key not in ASSETS:
+        raise ToolchainError(f"No Xray release asset known for {key[0]} {key[1]}")
+    return ASSETS[key]
+
+def binary_name():
+    return "xray.exe" if platform.system() == "Windows" else "xray"
+
+def load_index(directory=TOOLCHAIN_DIR):
+    try:
+        with open(os.path.join(directory, "index.json"), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_index(index, directory=TOOLCHAIN_DIR):
+    path = os.path.join(directory, "index.json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+def binary_path(digest, directory=TOOLCHAIN_DIR):
+    return os.path.join(directory, digest, binary_name())
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def parse_dgst(text):
+    """Extracts the SHA-256 from an Xray release .dgst file ("SHA2-256= <hex>" line)."""
+    for line in text.splitlines():
+        name, _, value = line.partition("=")
+        if name.strip().upper() in ("SHA2-256", "SHA256", "SHA-256"):
+            return value.strip().lower()
+    return None
+
+def install_archive(archive_path, digest, directory=TOOLCHAIN_DIR):
+    """Extracts only the xray executable of a verified archive into directory/<digest>/."""
+    name = binary_name()
+    target = binary_path(digest, directory)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+
+    with zipfile.ZipFile(archive_path, "r") as archive:
+        member = next((info for info in archive.infolist() if os.path.basename(info.filename) == name), None)
+        if member is None:
+            raise ToolchainError(f"{archive_path} has no {name} member")
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        with archive.open(member) as src, open(tmp_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+    os.chmod(tmp_path, 0o755)
+    os.replace(tmp_path, target)
+    return target
+
+async def fetch_expected_digest(session, url):
+    """The digest from the release's .dgst file, for XRAY_ALLOW_UNPINNED downloads."""
+    async with session.get(f"{url}.dgst") as response:
+        if response.status != 200:
+            raise ToolchainError(f"No pinned SHA-256 and {url}.dgst returned HTTP {response.status}")
+        digest = parse_dgst(await response.text())
+    if not digest:
+        raise ToolchainError(f"No SHA-256 in {url}.dgst")
+    return digest
+
+async def download_archive(session, url, path):
+    """Streams `url` to `path` in CHUNK_SIZE chunks and returns the SHA-256 of what was written."""
+    digest = hashlib.sha256()
+    async with session.get(url) as response:
+        if response.status != 200:
+            raise ToolchainError(f"Downloading {url} failed: HTTP {response.status}")
+        with open(path, "wb") as f:
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                digest.update(chunk)
+                f.write(chunk)
+    return digest.hexdigest()
+
+async def ensure_xray(version=XRAY_VERSION, directory=TOOLCHAIN_DIR):
+    """
+    Returns the path of a verified Xray binary for `version`, downloading it only
+    if the store does not already hold it. Raises ToolchainError on failure.
+    """
+    asset = release_asset()
+    key = f"{version}/{asset}"
+    index = load_index(directory)
+    pinned = (XRAY_SHA256 or PINNED_SHA256.get(key, "")).lower()
+
+    # The pin names the directory, so a pinned binary is found even without the index
+    for digest in (pinned, index.get(key)):
+        if digest and os.path.exists(binary_path(digest, directory)):
+            print(f"Xray {version} found at {binary_path(digest, directory)}")
+            return binary_path(digest, directory)
+
+    os.makedirs(directory, exist_ok=True)
+    if XRAY_ARCHIVE:
+        print(f"Installing Xray from {XRAY_ARCHIVE}...")
+        digest = await asyncio.to_thread(sha256_file, XRAY_ARCHIVE)
+        if pinned and digest != pinned:
+            raise ToolchainError(f"{XRAY_ARCHIVE} has SHA-256 {digest}, expected {pinned}")
+        if not pinned:
+            print(f"WARNING: no pinned SHA-256 for {key}, trusting {XRAY_ARCHIVE} as given ({digest})")
+        path = await asyncio.to_thread(install_archive, XRAY_ARCHIVE, digest, directory)
+    elif XRAY_OFFLINE:
+        raise ToolchainError(f"Xray {version} is not cached in {directory} and XRAY_OFFLINE is set")
+    elif not pinned and not XRAY_ALLOW_UNPINNED:
+        raise ToolchainError(f"No pinned SHA-256 for {key}: add it to PINNED_SHA256 or set XRAY_SHA256 "
+                             f"(XRAY_ALLOW_UNPINNED=1 downloads it checked only against the release's .dgst file)")
+    else:
+        url = XRAY_RELEASE_URL.format(version=version, asset=asset)
+        if not pinned:
+            print(f"WARNING: no pinned SHA-256 for {key}; XRAY_ALLOW_UNPINNED is set, so the download is only "
+                  f"checked against {url}.dgst from the same host. Pin it with --pin.")
+        archive_path = os.path.join(directory, f"{asset}.{os.getpid()}.part")
+        print(f"Downloading Xray {version} ({asset})...")
+        try:
+            timeout = aiohttp.ClientTimeout(total=DOWNLOAD_TIMEOUT)
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                expected = pinned or await fetch_expected_digest(session, url)
+                digest = await download_archive(session, url, archive_path)
+            if digest != expected:
+                raise ToolchainError(f"{url} has SHA-256 {digest}, expected {expected}")
+            path = await asyncio.to_thread(install_archive, archive_path, digest, directory)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise ToolchainError(f"Downloading {url} failed: {e!r}")
+        finally:
+            if os.path.exists(archive_path):
+                os.remove(archive_path)
+
+    index[key] = digest
+    save_index(index, directory)
+    print(f"Xray {version} installed at {path}")
+    return path
+
+async def setup_xray():
+    """Points v2ray_utils.XRAY_BIN at a verified binary; returns False (after printing why) if there is none."""
+    try:
+        v2ray_utils.XRAY_BIN = await ensure_xray()
+    except ToolchainError as e:
+        print(f"Xray setup failed: {e}")
+        return False
+    return True
+
+def print_pin(archive_path, version=XRAY_VERSION):
+    """Prints the PINNED_SHA256 entry for a release archive saved under its asset name."""
+    print(f'"{version}/{os.path.basename(archive_path)}": "{sha256_file(archive_path)}",')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Installs the pinned Xray release, or prints the pin for an archive.")
+    parser.add_argument("--pin", metavar="ARCHIVE", help="Print the PINNED_SHA256 entry for this release archive")
+    args = parser.parse_args()
+    if args.pin:
+        print_pin(args.pin)
+    elif not asyncio.run(setup_xray()):
+        raise SystemExit(1)